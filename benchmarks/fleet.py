@@ -0,0 +1,373 @@
+"""
+複数のプロセスでLLMRobotPlanner.processを実行する評価用のフリート
+
+指示のコーパスをシャードに分割してワーカープロセスに割り当て、各プロセスはシミュレーターのコマンドで
+LLMRobotPlannerを実行する（プロセス内ではJobManagerで--threads個のジョブを並行して実行する）
+生成AIの応答のキャッシュとレート制限はブローカーのプロセス（multiprocessing.managers）に置き、全てのワーカーで共有する為、
+生成AIのリクエスト数の上限（--rpm）に達するまではコア数にほぼ比例してスループットが上がる
+終了時に各ワーカーの結果と、--traceを指定した場合はログ（TraceFileHandler）を1つにまとめる
+
+    メインプロセス ── ブローカー（SharedResponseCache, SharedRateLimiter）
+        │                 ↑ プロキシ
+        └─ ワーカープロセス × --workers（LLMRobotPlanner + JobManager × --threads）
+
+実行方法（リポジトリのルートで実行）:
+    python -m benchmarks.fleet --workers 4 --repeat 100 [--threads 4] [--llm-latency 0.5] [--rpm 600]
+    # ログを1つのファイルにまとめて、プロファイラーに再生する
+    python -m benchmarks.fleet --workers 4 --repeat 10 --trace /tmp/fleet.lrpt
+    python -m logger.trace_file profile /tmp/fleet.lrpt
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+import argparse
+import contextlib
+import glob
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.wrappers.replay import RecordReplayWrapper, LogNormalLatency, prompt_key
+from planner.command.simulator import CommandSimulator
+from planner.job_manager import JobManager, JobSpec
+from logger.logger import LLMRobotPlannerLogSystem
+from logger.trace_file import TraceFileHandler, merge_traces, rotated_files
+
+from benchmarks.planner_bench import JOBS_PATH, build_commands, build_planner, load_corpus, _percentile
+from benchmarks.sim.scripted_llm import ScriptedLLMWrapper
+
+# --- ブローカー（プロセス間で共有するオブジェクト） ---
+
+class SharedResponseCache():
+    """
+    プロンプト（と応答のスキーマ名）をキーとする生成AIの応答のLRUキャッシュ
+    ブローカーのプロセスに置き、ワーカーはプロキシ経由で使用する（呼び出しはブローカーの複数のスレッドで実行される）
+
+    Args:
+        max_entries: int 保持する応答の最大数
+    """
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SharedRateLimiter():
+    """
+    全てのワーカーの生成AIへのリクエストをperiod秒あたりmax_requests回に制限する（GCRA）
+    reserve()は次に使用できる時刻を予約し、呼び出し元が待機するべき時間を返す（ブローカーでは待機しない）
+
+    Args:
+        max_requests: int period秒あたりのリクエスト数の上限
+        period: float 期間[s]
+        burst: Optional[int] 待機せずに連続して送信できるリクエスト数（Noneの場合はmax_requests）
+    """
+    def __init__(self, max_requests: int, period: float = 60.0, burst: Optional[int] = None):
+        if max_requests < 1:
+            raise ValueError("max_requests must be 1 or more")
+        self.interval = period / max_requests
+        self.tolerance = self.interval * ((burst if burst is not None else max_requests) - 1)
+        self._tat = 0.0  # 理論上の次のリクエストの時刻
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            wait = max(0.0, tat - self.tolerance - now)
+            self._tat = tat + self.interval
+            self.requests += 1
+            if wait > 0:
+                self.delayed += 1
+                self.wait_seconds += wait
+            return wait
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"requests": self.requests, "delayed": self.delayed, "wait_seconds": self.wait_seconds}
+
+
+_broker_cache: Optional[SharedResponseCache] = None
+_broker_limiter: Optional[SharedRateLimiter] = None
+
+
+def _init_broker(max_entries: int, rpm: Optional[int]):
+    global _broker_cache, _broker_limiter
+    _broker_cache = SharedResponseCache(max_entries)
+    _broker_limiter = SharedRateLimiter(rpm, period=60.0) if rpm else None
+
+
+def _get_cache() -> Optional[SharedResponseCache]:
+    return _broker_cache
+
+
+def _get_limiter() -> Optional[SharedRateLimiter]:
+    return _broker_limiter
+
+
+class _Broker(BaseManager):
+    pass
+
+_Broker.register("cache", callable=_get_cache)
+_Broker.register("limiter", callable=_get_limiter)
+
+
+class BrokeredWrapper(GenAIWrapper):
+    """
+    共有のキャッシュとレート制限を経由してinnerにリクエストするラッパー
+    キャッシュに応答がある場合はinnerにリクエストせず、レート制限も消費しない
+
+    Args:
+        inner: GenAIWrapper
+        cache: Optional[SharedResponseCache]（のプロキシ）
+        limiter: Optional[SharedRateLimiter]（のプロキシ）
+    """
+    def __init__(self, inner: GenAIWrapper, cache=None, limiter=None):
+        self._inner = inner
+        self._cache = cache
+        self._limiter = limiter
+
+    def reserve_request_slot(self, block: bool = True) -> bool:
+        return self._inner.reserve_request_slot(block)
+
+    def generate_content(self, prompt, *args, response_schema=None, **kwargs) -> str:
+        key = prompt_key(prompt, response_schema.name if response_schema is not None else None)
+        if self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+        if self._limiter is not None:
+            wait = self._limiter.reserve()
+            if wait > 0:
+                time.sleep(wait)
+        response = self._inner.generate_content(prompt, *args, response_schema=response_schema, **kwargs)
+        if self._cache is not None:
+            self._cache.put(key, response)
+        return response
+
+
+# --- ワーカー ---
+
+_worker_manager: Optional[JobManager] = None
+_worker_trace: Optional[str] = None
+
+
+def _init_worker(address, authkey: bytes, config: Dict[str, Any]):
+    """ワーカープロセスの初期化（ブローカーに接続し、fork元のLLMRobotPlannerを生成する）"""
+    global _worker_manager, _worker_trace
+    broker = _Broker(address=address, authkey=authkey)
+    broker.connect()
+    cache = broker.cache() if config["cache"] else None
+    limiter = broker.limiter() if config["rpm"] else None
+
+    corpus = load_corpus(config["jobs"])
+    latency = LogNormalLatency(config["llm_latency"], sigma=0.4) if config["llm_latency"] > 0 else None
+    seed = config["seed"] * 1000 + os.getpid()
+    inner: GenAIWrapper
+    if config["replay"]:
+        inner = RecordReplayWrapper(config["replay"], mode="replay", latency=latency, seed=seed)
+    else:
+        inner = ScriptedLLMWrapper(corpus["jobs"], latency=latency, seed=seed)
+    planner = build_planner(
+        BrokeredWrapper(inner, cache, limiter),
+        CommandSimulator(latency=config["command_latency"]),
+        corpus["documents"],
+        config["doc_latency"],
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        planner.initialize()
+    if config["trace"]:
+        _worker_trace = f"{config['trace']}.worker-{os.getpid()}"
+        LLMRobotPlannerLogSystem().add_handler(TraceFileHandler(_worker_trace))
+    _worker_manager = JobManager(planner, max_workers=config["threads"])
+
+
+def _run_shard(shard: List[Tuple[int, Dict[str, Any]]], config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """シャードの全てのジョブを実行し、ジョブごとの結果を返す"""
+    assert _worker_manager is not None
+    specs, simulators = [], []
+    for index, job in shard:
+        # ジョブごとにシードを固定し、どのワーカーで実行しても同じ結果にする
+        simulator = CommandSimulator(
+            latency=config["command_latency"],
+            failure_rates={"find": config["find_failure_rate"]},
+            seed=config["seed"] * 1000 + index,
+        )
+        specs.append(JobSpec(job["instruction"], commands=build_commands(simulator)))
+        simulators.append(simulator)
+    # 標準出力へのデバッグ表示は計測の対象外にする
+    with contextlib.redirect_stdout(io.StringIO()):
+        job_results = _worker_manager.run_all(specs)
+
+    results = []
+    for (index, job), simulator, result in zip(shard, simulators, job_results):
+        results.append({
+            "index": index,
+            "name": job["name"],
+            "worker": os.getpid(),
+            "wall": result.wall,
+            "tasks": len(result.memory._tasks),
+            "commands": simulator.executed,
+            "command_failures": simulator.failed,
+            "command_time": simulator.simulated_time,
+            "error": f"{type(result.error).__name__}: {result.error}" if result.error is not None else None,
+        })
+    return results
+
+
+# --- メインプロセス ---
+
+def shard_jobs(jobs: List[Dict[str, Any]], shard_size: int) -> List[List[Tuple[int, Dict[str, Any]]]]:
+    """ジョブを(コーパス内の通し番号, ジョブ)のシャードに分割する"""
+    indexed = list(enumerate(jobs))
+    return [indexed[i:i + shard_size] for i in range(0, len(indexed), shard_size)]
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    walls = [r["wall"] for r in results]
+    return {
+        "jobs": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed if elapsed > 0 else 0.0,
+        "wall_mean": statistics.mean(walls) if walls else 0.0,
+        "wall_p50": _percentile(walls, 0.5) if walls else 0.0,
+        "wall_p95": _percentile(walls, 0.95) if walls else 0.0,
+        "commands": sum(r["commands"] for r in results),
+        "command_failures": sum(r["command_failures"] for r in results),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", default=JOBS_PATH, help="ジョブのコーパス")
+    parser.add_argument("--repeat", type=int, default=1, help="コーパスを繰り返す回数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセスの数")
+    parser.add_argument("--threads", type=int, default=1, help="ワーカープロセスごとに並行して実行するジョブの数")
+    parser.add_argument("--shard-size", type=int, default=None, help="1回でワーカーに割り当てるジョブの数（省略した場合はワーカーごとに約4シャード）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--command-latency", type=float, default=0.01, help="コマンドの実行時間[s]")
+    parser.add_argument("--find-failure-rate", type=float, default=0.3, help="findコマンドの失敗率")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="生成AIのレイテンシの中央値[s]（0の場合は待機しない）")
+    parser.add_argument("--doc-latency", type=float, default=0.0, help="文書検索のレイテンシ[s]")
+    parser.add_argument("--replay", metavar="PATH", help="PATHに記録した応答を再生する（省略した場合はコーパスから応答を組み立てる）")
+    parser.add_argument("--rpm", type=int, default=None, help="全てのワーカーの生成AIへのリクエスト数の上限[回/分]")
+    parser.add_argument("--no-cache", action="store_true", help="生成AIの応答を共有のキャッシュから返さない")
+    parser.add_argument("--cache-size", type=int, default=100000, help="共有のキャッシュに保持する応答の最大数")
+    parser.add_argument("--trace", metavar="PATH", help="各ワーカーのログをまとめてPATHに記録する")
+    parser.add_argument("--json", metavar="PATH", help="結果をJSONで出力する")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.jobs)
+    jobs = corpus["jobs"] * args.repeat
+    shard_size = args.shard_size or max(1, math.ceil(len(jobs) / (args.workers * 4)))
+    shards = shard_jobs(jobs, shard_size)
+    config = {
+        "jobs": args.jobs, "seed": args.seed, "threads": args.threads,
+        "command_latency": args.command_latency, "find_failure_rate": args.find_failure_rate,
+        "llm_latency": args.llm_latency, "doc_latency": args.doc_latency, "replay": args.replay,
+        "rpm": args.rpm, "cache": not args.no_cache, "trace": args.trace,
+    }
+
+    # ワーカーはspawnで起動する（ログのUIDの接頭辞などのモジュールの状態を、プロセスごとに初期化する為）
+    context = multiprocessing.get_context("spawn")
+    broker = _Broker(ctx=context)
+    broker.start(_init_broker, (args.cache_size, args.rpm))
+    authkey = bytes(context.current_process().authkey)
+    results: List[Dict[str, Any]] = []
+    try:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(broker.address, authkey, config),
+        ) as pool:
+            futures = [pool.submit(_run_shard, shard, config) for shard in shards]
+            for done, future in enumerate(as_completed(futures), 1):
+                results.extend(future.result())
+                print(f"\r{len(results)}/{len(jobs)} jobs ({done}/{len(shards)} shards)", end="", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+        print(file=sys.stderr)
+        cache_stats = broker.cache().stats()
+        limiter_stats = broker.limiter().stats() if args.rpm else None
+    finally:
+        broker.shutdown()
+    results.sort(key=lambda r: r["index"])
+
+    if args.trace:
+        # シャードを割り当てられなかったワーカーのファイルも削除する為、結果ではなくファイル名から集める
+        pattern = re.compile(re.escape(args.trace) + r"\.worker-\d+")
+        worker_traces = sorted(p for p in glob.glob(f"{glob.escape(args.trace)}.worker-*") if pattern.fullmatch(p))
+        count = merge_traces(worker_traces, args.trace)
+        for path in worker_traces:
+            for file in rotated_files(path):
+                os.remove(file)
+        print(f"trace: merged {count} entries from {len(worker_traces)} workers into {args.trace}")
+
+    summary = summarize(results, elapsed)
+    print(f"{'worker':>8}{'jobs':>6}{'errors':>8}{'wall mean[s]':>14}")
+    for worker in sorted({r["worker"] for r in results}):
+        rs = [r for r in results if r["worker"] == worker]
+        print(f"{worker:>8}{len(rs):>6}{sum(1 for r in rs if r['error']):>8}{statistics.mean(r['wall'] for r in rs):>14.3f}")
+    print(
+        f"\njobs: {summary['jobs']}  errors: {summary['errors']}  workers: {args.workers}x{args.threads}  "
+        f"elapsed: {summary['elapsed']:.2f}s  throughput: {summary['throughput']:.2f} jobs/s  "
+        f"wall mean/p50/p95: {summary['wall_mean']:.3f}/{summary['wall_p50']:.3f}/{summary['wall_p95']:.3f}s  "
+        f"cmds: {summary['commands']}/{summary['command_failures']}"
+    )
+    requests = cache_stats["hits"] + cache_stats["misses"]
+    if not args.no_cache and requests:
+        print(f"llm cache: {cache_stats['hits']}/{requests} hits ({cache_stats['hits'] / requests * 100:.1f}%)  entries: {cache_stats['entries']}")
+    if limiter_stats is not None:
+        print(
+            f"rate limit: {limiter_stats['requests']:.0f} requests  delayed: {limiter_stats['delayed']:.0f}  "
+            f"wait: {limiter_stats['wait_seconds']:.2f}s"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": vars(args), "summary": summary, "llm_cache": cache_stats, "rate_limit": limiter_stats,
+                "jobs": results,
+            }, f, ensure_ascii=False, indent=2)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+生成AIの出力したJSONの解析（utils.json_utils.fix_and_parse_json）のベンチマーク
+
+benchmarks/data/gemini_json_corpus.jsonl の各出力について、
+期待する解析結果と一致するかを確認した上で1件あたりの解析時間を計測する
+
+実行方法（リポジトリのルートで実行）:
+    python -m benchmarks.json_parse_bench [--repeat 2000]
+"""
+from typing import List, Dict, Any
+import argparse
+import json
+import os
+import sys
+import time
+
+from utils.json_utils import fix_and_parse_json
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "gemini_json_corpus.jsonl")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_corpus(corpus: List[Dict[str, Any]]) -> List[str]:
+    """期待する解析結果と一致しないエントリ名のリストを返す"""
+    failures = []
+    for entry in corpus:
+        try:
+            result = fix_and_parse_json(entry["text"])
+        except Exception as e:
+            failures.append(f"{entry['name']}: {e}")
+            continue
+        if result != entry["expected"]:
+            failures.append(f"{entry['name']}: {result!r} != {entry['expected']!r}")
+    return failures
+
+
+def bench(corpus: List[Dict[str, Any]], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for entry in corpus:
+        text = entry["text"]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fix_and_parse_json(text)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "name": entry["name"],
+            "size": len(text),
+            "mean_us": elapsed / repeat * 1e6,
+        })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    failures = check_corpus(corpus)
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+
+    print(f"{'name':<36}{'size':>8}{'mean [us]':>12}")
+    for r in bench(corpus, args.repeat):
+        print(f"{r['name']:<36}{r['size']:>8}{r['mean_us']:>12.2f}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
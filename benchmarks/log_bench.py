@@ -0,0 +1,129 @@
+"""
+LLMRobotPlannerLogSystemの1回のspanあたりのオーバーヘッドを計測するベンチマーク
+
+公開されているAPI（log.span, span.input/output, log.event）のみを使用する為、
+過去のバージョンのloggerパッケージに対しても同じ条件で計測できる
+
+シナリオ:
+    empty:        入力や出力を持たないspan
+    input_output: input, output, feedbackを1回ずつ記録するspan（LLMの呼び出しやDBのアクセスと同じ使い方）
+    nested:       深さ3の入れ子のspan
+    wide:         1つのspanの中に--wide個の子のspanを記録する（子1つあたりの時間）
+    event:        log.event
+
+ハンドラー:
+    none:     ハンドラー無し
+    realtime: 何もしないRealTimeHandler（全てのイベントを受け取る）
+    end_only: 何もしないNonRealTimeHandler（ENDイベントのみを受け取る）
+
+実行方法（リポジトリのルートで実行）:
+    python -m benchmarks.log_bench [--iterations 20000] [--json out.json]
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from logger.logger import LLMRobotPlannerLogSystem, RealTimeHandler, NonRealTimeHandler, LogEvent
+
+log = LLMRobotPlannerLogSystem()
+
+
+class _NullRealTimeHandler(RealTimeHandler):
+    def handle(self, log: LogEvent):
+        pass
+
+
+class _NullEndHandler(NonRealTimeHandler):
+    def handle(self, log: LogEvent):
+        pass
+
+
+def _empty():
+    with log.span("empty"):
+        pass
+
+
+def _input_output():
+    with log.span("LLM Generation", tag={"llm"}, metadata={"tier": "fast"}) as span:
+        span.input("prompt")
+        span.output("response")
+        span.feedback("ok")
+
+
+def _nested():
+    with log.span("outer") as a:
+        a.input("a")
+        with log.span("middle") as b:
+            b.input("b")
+            with log.span("inner") as c:
+                c.output("c")
+
+
+def _event():
+    log.event("event", context="context")
+
+
+def _make_wide(width: int) -> Callable[[], None]:
+    def wide():
+        with log.span("wide"):
+            for _ in range(width):
+                with log.span("child") as span:
+                    span.output("x")
+    return wide
+
+
+def measure(func: Callable[[], None], iterations: int, repeat: int, per_call: int = 1) -> Dict[str, float]:
+    """funcをiterations回実行する計測をrepeat回行い、1回（per_callで割った値）あたりの時間[us]を返す"""
+    for _ in range(min(iterations, 1000)):
+        func()
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append((time.perf_counter() - start) / iterations / per_call * 1e6)
+    return {"median_us": statistics.median(samples), "min_us": min(samples)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="1回の計測で実行する回数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の回数")
+    parser.add_argument("--wide", type=int, default=1000, help="wideのシナリオの子の数")
+    parser.add_argument("--json", metavar="PATH", help="結果をJSONで出力する")
+    args = parser.parse_args(argv)
+
+    scenarios = {
+        "empty": (_empty, args.iterations, 1),
+        "input_output": (_input_output, args.iterations, 1),
+        "nested": (_nested, args.iterations, 3),
+        "wide": (_make_wide(args.wide), max(1, args.iterations // args.wide), args.wide),
+        "event": (_event, args.iterations, 1),
+    }
+    handlers = {"none": None, "realtime": _NullRealTimeHandler(), "end_only": _NullEndHandler()}
+
+    results = []
+    print(f"{'scenario':<14}{'handler':<10}{'median[us]':>12}{'min[us]':>10}")
+    for handler_name, handler in handlers.items():
+        if handler is not None:
+            log.add_handler(handler)
+        try:
+            for name, (func, iterations, per_call) in scenarios.items():
+                r = measure(func, iterations, args.repeat, per_call)
+                results.append({"scenario": name, "handler": handler_name, **r})
+                print(f"{name:<14}{handler_name:<10}{r['median_us']:>12.2f}{r['min_us']:>10.2f}")
+        finally:
+            if handler is not None:
+                log.remove_handler(handler)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+LLMRobotPlanner.processのエンドツーエンドのベンチマーク
+
+benchmarks/data/planner_jobs.json の各ジョブ（指示）について、
+シミュレーターのコマンドと生成AIの代替（コーパスから応答を組み立てるもの、または記録の再生）で
+プランニングと実行を行い、ジョブごとに以下を計測する
+    - wall: process()の実行時間
+    - llm: 生成AIへのリクエスト数（スキーマ名ごと）
+    - replan: リプランニングの回数（command_level / task_level）
+    - commands: 実行したコマンド数と失敗したコマンド数、コマンドの擬似的な実行時間
+    - db: DatabaseManagerの処理時間
+    - log: ログシステム（記録の生成とハンドラーの呼び出し）の処理時間
+
+実行方法（リポジトリのルートで実行）:
+    python -m benchmarks.planner_bench [--repeat 3] [--json out.json]
+    # 応答を記録して、記録から再生する
+    python -m benchmarks.planner_bench --record /tmp/planner.jsonl.gz
+    python -m benchmarks.planner_bench --replay /tmp/planner.jsonl.gz --llm-latency 0.8
+    # コマンドレベルのリプランニングをパッチで行う場合と比較する
+    python -m benchmarks.planner_bench --repeat 5 --find-failure-rate 0.5 --incremental-replanning
+    # ログを記録して、プロファイラーに再生する
+    python -m benchmarks.planner_bench --trace /tmp/planner.lrpt
+    python -m logger.trace_file profile /tmp/planner.lrpt
+"""
+from typing import Any, Dict, List, Optional
+from collections import Counter
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+from planner.failure_rules import FailureRuleEngine
+from planner.llm_robot_planner import LLMRobotPlanner
+from planner.llm.gen_ai import UnifiedAIRequestHandler
+from planner.llm.router import ModelRouter
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.wrappers.replay import RecordReplayWrapper, LogNormalLatency
+from planner.command.command_base import Command
+from planner.command.robot_state import RobotState
+from planner.command.simulator import CommandSimulator
+from planner.command.commands.standard_commands import (
+    MoveCommand, FindCommand, IntrofuceSelfCommand, SpeakMessageCommand, AskQuestionCommand,
+    PickUpObjectCommand, DropObjectCommand, RecordCurrentLocationCommand, ErrorCommand,
+)
+from planner.database.database import DatabaseManager
+from logger.logger import LLMRobotPlannerLogSystem, RealTimeHandler, LogEvent
+from logger.profiler import ProfilerHandler
+from logger.async_handler import AsyncHandler
+from logger.trace_file import TraceFileHandler
+from utils.metrics import default_registry as metrics
+
+from benchmarks.sim.scripted_llm import ScriptedLLMWrapper
+from benchmarks.sim.document_db import InMemoryDocumentDB
+
+# リプランニングの回数（ルールで分類し、生成AIにリクエストしなかった失敗も含める為、ResultEvaluatorのメトリクスから数える）
+_REPLANNING = metrics.counter("replanning_total", "評価の結果必要となったリプランニングの回数", ("level",))
+_REPLANNING_LEVELS = ("command_level", "task_level")
+
+JOBS_PATH = os.path.join(os.path.dirname(__file__), "data", "planner_jobs.json")
+
+
+class _Timer():
+    """オブジェクトのメソッドを置き換えて、呼び出しの合計時間を計測する"""
+    def __init__(self):
+        self.total = 0.0
+        self.calls = 0
+        self._patched: List[tuple] = []
+
+    def wrap(self, obj: Any, names: List[str]):
+        for name in names:
+            original = getattr(obj, name)
+
+            def timed(*args, __original=original, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return __original(*args, **kwargs)
+                finally:
+                    self.total += time.perf_counter() - start
+                    self.calls += 1
+            setattr(obj, name, timed)
+            self._patched.append((obj, name))
+
+    def restore(self):
+        for obj, name in self._patched:
+            delattr(obj, name)
+        self._patched.clear()
+
+
+class _CountingWrapper(GenAIWrapper):
+    """リクエスト数を数えるラッパー"""
+    def __init__(self, inner: GenAIWrapper, max_calls: int):
+        self._inner = inner
+        self._max_calls = max_calls
+        self.calls: Counter = Counter()
+
+    def reset(self):
+        self.calls.clear()
+
+    def reserve_request_slot(self, block: bool = True) -> bool:
+        return self._inner.reserve_request_slot(block)
+
+    def generate_content(self, prompt, *args, response_schema=None, **kwargs) -> str:
+        if sum(self.calls.values()) >= self._max_calls:
+            raise RuntimeError(f"LLM call limit ({self._max_calls}) exceeded")
+        name = response_schema.name if response_schema is not None else "none"
+        self.calls[name] += 1
+        return self._inner.generate_content(prompt, *args, response_schema=response_schema, **kwargs)
+
+
+class _CollectingHandler(RealTimeHandler):
+    """GUIのハンドラーの代わりにイベントを保持するハンドラー"""
+    def __init__(self):
+        self.events: List[LogEvent] = []
+
+    def handle(self, log: LogEvent):
+        self.events.append(log)
+
+
+_DB_METHODS = [
+    "add_location_knowledge", "add_object_knowledge", "get_all_known_locations", "get_all_known_objects",
+    "get_by_name_from_knowledge", "query_document",
+]
+_LOG_METHODS = ["_begin_log_entry", "_end_log_entry", "_update_entry", "_log_instant_entry"]
+
+
+def _states() -> List[RobotState]:
+    return [
+        RobotState(name="not_in_hand", description="ロボットが手に何も持っていない", args_description={}, initial_state=True),
+        RobotState(name="in_hand", description="ロボットがxを手に持っている", args_description={"x": "str"}, initial_state=False),
+    ]
+
+
+def load_corpus(path: str = JOBS_PATH) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_commands(simulator: CommandSimulator) -> List[Command]:
+    """シミュレーターで実行するコマンド"""
+    return [
+        MoveCommand(simulator), FindCommand(simulator), IntrofuceSelfCommand(), SpeakMessageCommand(simulator),
+        AskQuestionCommand(simulator), PickUpObjectCommand(simulator), DropObjectCommand(simulator),
+        RecordCurrentLocationCommand(simulator), ErrorCommand(),
+    ]
+
+
+def build_planner(
+    llm_wrapper: GenAIWrapper,
+    simulator: CommandSimulator,
+    documents: List[str],
+    doc_latency: float,
+    incremental_replanning: bool = False,
+    failure_rules: Optional[FailureRuleEngine] = None,
+) -> LLMRobotPlanner:
+    router = ModelRouter()
+    router.register("bench", llm_wrapper)
+    return LLMRobotPlanner(
+        api_keys={},
+        commands=build_commands(simulator),
+        states=_states(),
+        llm=UnifiedAIRequestHandler({}, router=router),
+        db=DatabaseManager(db_path=":memory:", document_db=InMemoryDocumentDB(documents, latency=doc_latency)),
+        incremental_replanning=incremental_replanning,
+        failure_rules=failure_rules,
+    )
+
+
+def run_job(
+    job: Dict[str, Any],
+    llm: _CountingWrapper,
+    simulator: CommandSimulator,
+    documents: List[str],
+    doc_latency: float,
+    incremental_replanning: bool = False,
+    failure_rules: Optional[FailureRuleEngine] = None,
+) -> Dict[str, Any]:
+    llm.reset()
+    simulator.reset_stats()
+    replans_before = {level: _REPLANNING.get(level=level) for level in _REPLANNING_LEVELS}
+    planner = build_planner(llm, simulator, documents, doc_latency, incremental_replanning, failure_rules)
+
+    # 標準出力へのデバッグ表示は計測の対象外にする
+    with contextlib.redirect_stdout(io.StringIO()):
+        planner.initialize()
+
+    db_timer, log_timer = _Timer(), _Timer()
+    db_timer.wrap(planner._db, _DB_METHODS)
+    log_timer.wrap(LLMRobotPlannerLogSystem(), _LOG_METHODS)
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            try:
+                planner.process(job["instruction"], "")
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            wall = time.perf_counter() - start
+    finally:
+        db_timer.restore()
+        log_timer.restore()
+    replans = {level: int(_REPLANNING.get(level=level) - replans_before[level]) for level in _REPLANNING_LEVELS}
+
+    return {
+        "name": job["name"],
+        "wall": wall,
+        "llm_calls": sum(llm.calls.values()),
+        "llm_calls_by_schema": dict(llm.calls),
+        "replans_command_level": replans["command_level"],
+        "replans_task_level": replans["task_level"],
+        "commands": simulator.executed,
+        "command_failures": simulator.failed,
+        "command_time": simulator.simulated_time,
+        "db_time": db_timer.total,
+        "db_calls": db_timer.calls,
+        "log_time": log_timer.total,
+        "log_calls": log_timer.calls,
+        "error": error,
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    walls = [r["wall"] for r in results]
+    total_wall = sum(walls)
+    return {
+        "jobs": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "wall_mean": statistics.mean(walls),
+        "wall_p50": _percentile(walls, 0.5),
+        "wall_p95": _percentile(walls, 0.95),
+        "llm_calls_per_job": statistics.mean(r["llm_calls"] for r in results),
+        "replans_per_job": statistics.mean(r["replans_command_level"] + r["replans_task_level"] for r in results),
+        "db_time_ratio": sum(r["db_time"] for r in results) / total_wall if total_wall else 0.0,
+        "log_time_ratio": sum(r["log_time"] for r in results) / total_wall if total_wall else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", default=JOBS_PATH, help="ジョブのコーパス")
+    parser.add_argument("--repeat", type=int, default=1, help="各ジョブの実行回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--command-latency", type=float, default=0.01, help="コマンドの実行時間[s]")
+    parser.add_argument("--find-failure-rate", type=float, default=0.3, help="findコマンドの失敗率")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="生成AIのレイテンシの中央値[s]（0の場合は待機しない）")
+    parser.add_argument("--doc-latency", type=float, default=0.0, help="文書検索のレイテンシ[s]")
+    parser.add_argument("--incremental-replanning", action="store_true", help="コマンドレベルのリプランニングで未実行のコマンドに対するパッチのみを生成する")
+    parser.add_argument("--failure-rules", action="store_true", help="失敗したコマンドをルールで分類する")
+    parser.add_argument("--record", metavar="PATH", help="生成AIの応答をPATHに記録する")
+    parser.add_argument("--replay", metavar="PATH", help="PATHに記録した応答を再生する")
+    parser.add_argument("--log-handler", choices=["none", "memory", "async"], default="memory", help="ログのハンドラー（async: memoryをAsyncHandlerで実行する）")
+    parser.add_argument("--max-llm-calls", type=int, default=200, help="1ジョブあたりの生成AIへのリクエスト数の上限")
+    parser.add_argument("--profile", metavar="DIR", help="ジョブごとのプロファイル（speedscope, Chrome trace形式）をDIRに出力し、集計結果を表示する")
+    parser.add_argument("--trace", metavar="PATH", help="ログをTraceFileHandlerでPATHに記録する（python -m logger.trace_file で再生する）")
+    parser.add_argument("--metrics", metavar="PATH", help="メトリクスをPrometheusのテキスト形式でPATHに出力する")
+    parser.add_argument("--json", metavar="PATH", help="結果をJSONで出力する")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.jobs)
+    latency = LogNormalLatency(args.llm_latency, sigma=0.4) if args.llm_latency > 0 else None
+    inner: GenAIWrapper
+    if args.replay:
+        inner = RecordReplayWrapper(args.replay, mode="replay", latency=latency, seed=args.seed)
+    else:
+        inner = ScriptedLLMWrapper(corpus["jobs"], latency=latency, seed=args.seed)
+        if args.record:
+            inner = RecordReplayWrapper(args.record, mode="record", inner=inner)
+    llm = _CountingWrapper(inner, args.max_llm_calls)
+
+    log_system = LLMRobotPlannerLogSystem()
+    handler: Optional[_CollectingHandler] = _CollectingHandler() if args.log_handler != "none" else None
+    async_handler: Optional[AsyncHandler] = AsyncHandler(handler) if handler is not None and args.log_handler == "async" else None
+    if handler is not None:
+        log_system.add_handler(async_handler or handler)
+    profiler: Optional[ProfilerHandler] = ProfilerHandler(print_summary=False, output_dir=args.profile, max_profiles=None) if args.profile else None
+    if profiler is not None:
+        log_system.add_handler(profiler)
+    trace_handler: Optional[TraceFileHandler] = TraceFileHandler(args.trace) if args.trace else None
+    if trace_handler is not None:
+        log_system.add_handler(trace_handler)
+
+    # ルールはジョブ間で共有し、前のジョブの評価から学習したルールを使用する
+    failure_rules = FailureRuleEngine() if args.failure_rules else None
+    results = []
+    try:
+        for n in range(args.repeat):
+            for i, job in enumerate(corpus["jobs"]):
+                # ジョブごとにシードを固定し、実行順序に関わらず同じ結果にする
+                simulator = CommandSimulator(
+                    latency=args.command_latency,
+                    failure_rates={"find": args.find_failure_rate},
+                    seed=args.seed * 1000 + i,
+                )
+                results.append(run_job(job, llm, simulator, corpus["documents"], args.doc_latency, args.incremental_replanning, failure_rules))
+                if async_handler is not None:
+                    async_handler.flush()
+                if handler is not None:
+                    handler.events.clear()
+    finally:
+        if handler is not None:
+            log_system.remove_handler(async_handler or handler)
+        if async_handler is not None:
+            async_handler.close()
+        if profiler is not None:
+            log_system.remove_handler(profiler)
+        if trace_handler is not None:
+            log_system.remove_handler(trace_handler)
+            trace_handler.close()
+
+    print(f"{'name':<16}{'wall[s]':>9}{'llm':>6}{'replan':>8}{'cmds':>7}{'db[ms]':>9}{'log[ms]':>9}{'log%':>7}  error")
+    for r in results:
+        print(
+            f"{r['name']:<16}{r['wall']:>9.3f}{r['llm_calls']:>6}"
+            f"{r['replans_command_level']:>4}/{r['replans_task_level']:<3}"
+            f"{r['commands']:>4}/{r['command_failures']:<2}"
+            f"{r['db_time'] * 1e3:>9.2f}{r['log_time'] * 1e3:>9.2f}{r['log_time'] / r['wall'] * 100 if r['wall'] else 0:>7.2f}"
+            f"  {r['error'] or ''}"
+        )
+    summary = summarize(results)
+    print(
+        f"\njobs: {summary['jobs']}  errors: {summary['errors']}  "
+        f"wall mean/p50/p95: {summary['wall_mean']:.3f}/{summary['wall_p50']:.3f}/{summary['wall_p95']:.3f}s  "
+        f"llm/job: {summary['llm_calls_per_job']:.1f}  replans/job: {summary['replans_per_job']:.2f}  "
+        f"db: {summary['db_time_ratio'] * 100:.2f}%  log: {summary['log_time_ratio'] * 100:.2f}%"
+    )
+    if profiler is not None:
+        for profile in profiler.profiles:
+            print()
+            print(profile.format_summary(5))
+    if isinstance(inner, RecordReplayWrapper) and inner.mode == "replay":
+        print(f"replay hits: {inner.hits}  nearest: {inner.nearest_hits}")
+
+    if args.metrics:
+        metrics.write_textfile(args.metrics)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "summary": summary, "jobs": results}, f, ensure_ascii=False, indent=2)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+ChromaDBWithGeminiの代わりに使用する、埋め込みAPIを使用しない文書データベース
+
+文字2-gramのJaccard距離で検索し、ChromaDBのqueryと同じ形式で結果を返す
+"""
+from typing import Dict, List, Optional, Set
+import threading
+import time
+
+
+def _bigrams(text: str) -> Set[str]:
+    return {text[i:i + 2] for i in range(max(1, len(text) - 1))}
+
+
+class InMemoryDocumentDB():
+    """
+    Args:
+        documents: Optional[List[str]] 初期の文書
+        latency: float 1回の検索の擬似的なレイテンシ[s]（埋め込みの計算と検索の時間）
+    """
+    def __init__(self, documents: Optional[List[str]] = None, latency: float = 0.0):
+        self._lock = threading.Lock()
+        self._documents: Dict[str, str] = {}
+        self._bigrams: Dict[str, Set[str]] = {}
+        self.latency = latency
+        if documents:
+            self.upsert(documents, [str(i) for i in range(len(documents))])
+
+    def upsert(self, documents: List[str], ids: List[str]):
+        with self._lock:
+            for doc, uid in zip(documents, ids):
+                self._documents[uid] = doc
+                self._bigrams[uid] = _bigrams(doc)
+
+    def query(self, query_texts: List[str], n_results: int = 1):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        result = {"ids": [], "documents": [], "distances": []}
+        with self._lock:
+            items = list(self._bigrams.items())
+        for text in query_texts:
+            q = _bigrams(text)
+            scored = sorted(
+                ((1.0 - len(q & b) / len(q | b), uid) for uid, b in items),
+            )[:n_results]
+            result["ids"].append([uid for _, uid in scored])
+            result["documents"].append([self._documents[uid] for _, uid in scored])
+            result["distances"].append([d for d, _ in scored])
+        return result
@@ -0,0 +1,116 @@
+"""
+ジョブのコーパスから応答を組み立てる、ベンチマーク用の生成AIの代替
+
+プロンプトの種類は応答のスキーマ名で判別し、プロンプトに含まれる指示文やタスクの説明から
+コーパスの該当するエントリを探して応答を返す（複数一致する場合は最も長いもの）
+"""
+from typing import Any, Dict, List, Optional
+import json
+import random
+import re
+import threading
+import time
+
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.wrappers.replay import LatencyModel
+from planner.llm.exceptions import ReplayMissError, LLMTimeoutError
+
+# REGENERATE_COMMANDS_PATCHのプロンプトの失敗したコマンド（1行のJSON）
+_FAILED_COMMAND = re.compile(r"失敗したコマンド: (\{.*\})")
+
+
+def _find_longest(candidates: Dict[str, Any], prompt: str) -> Optional[Any]:
+    best = None
+    for key, value in candidates.items():
+        if key in prompt and (best is None or len(key) > len(best[0])):
+            best = (key, value)
+    return best[1] if best is not None else None
+
+
+def tasks_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """コーパスのジョブからTASKS_RESPONSE_SCHEMAの形式の応答を生成する"""
+    return {
+        "tasks": [
+            {
+                "task_sequence_number": i,
+                "task_description": task["description"],
+                "task_additional_info": task.get("additional_info", ""),
+                "task_dependencies": [],
+                "task_environmental_conditions": {
+                    "required_physical_conditions": [],
+                    "required_information_conditions": {
+                        "required_information_locations": task.get("locations", []),
+                        "required_information_objects": [],
+                    },
+                },
+                "task_reason": task.get("reason", ""),
+                "task_outcome": {
+                    "desired_information": [],
+                    "desired_robot_state": [],
+                },
+            } for i, task in enumerate(job["tasks"], 1)
+        ]
+    }
+
+
+class ScriptedLLMWrapper(GenAIWrapper):
+    """
+    Args:
+        jobs: List[dict] ジョブのコーパス（benchmarks/data/planner_jobs.jsonを参照）
+        latency: Optional[LatencyModel] 擬似的なレイテンシ（Noneの場合は待機しない）
+        seed: int レイテンシの乱数のシード
+    """
+    def __init__(self, jobs: List[Dict[str, Any]], latency: Optional[LatencyModel] = None, seed: int = 0):
+        self._jobs = {job["instruction"]: job for job in jobs}
+        self._tasks = {task["description"]: task for job in jobs for task in job["tasks"]}
+        self._task_jobs = {task["description"]: job for job in jobs for task in job["tasks"]}
+        self._latency = latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, *args, response_schema=None, timeout=None, **kwargs) -> str:
+        schema_name = response_schema.name if response_schema is not None else None
+        response = self._respond(prompt, schema_name)
+
+        if self._latency is not None:
+            with self._lock:
+                delay = self._latency.sample(self._rng, None)
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise LLMTimeoutError(f"scripted latency {delay:.2f}s exceeds timeout {timeout}s")
+            time.sleep(delay)
+        return json.dumps(response, ensure_ascii=False)
+
+    def _respond(self, prompt: str, schema_name: Optional[str]) -> Dict[str, Any]:
+        if schema_name == "tasks":
+            # REGENERATE_TASKSのプロンプトは指示文を含まない為、実行済みのタスクの説明からジョブを探す
+            job = _find_longest(self._jobs, prompt) or _find_longest(self._task_jobs, prompt)
+            if job is not None:
+                return tasks_response(job)
+        elif schema_name == "commands":
+            task = _find_longest(self._tasks, prompt)
+            if task is not None:
+                return {
+                    f"command{i}": {"name": cmd["name"], "args": cmd.get("args", {})}
+                    for i, cmd in enumerate(task["commands"], 1)
+                }
+        elif schema_name == "replanning_data":
+            task = _find_longest(self._tasks, prompt)
+            if task is not None:
+                return {
+                    "1": {
+                        "cause": "コマンドの実行に失敗した",
+                        "detail": "シミュレーターがコマンドの失敗を返した",
+                        "error_level": task.get("on_failure", "command_level"),
+                        "solution": "同じコマンドを再度実行する",
+                    }
+                }
+        elif schema_name == "command_patch":
+            # replanning_dataの解決策（同じコマンドを再度実行する）に合わせて、失敗したコマンドを残りのプランの先頭に挿入する
+            match = _FAILED_COMMAND.search(prompt)
+            if match is not None:
+                return {"operations": [{"op": "insert", "index": 1, "command": json.loads(match.group(1))}]}
+        elif schema_name == "rag_query":
+            task = _find_longest(self._tasks, prompt)
+            return {"query": task.get("queries", []) if task is not None else []}
+        raise ReplayMissError(f"no scripted response for schema '{schema_name}'")
@@ -0,0 +1,232 @@
+"""
+SQLiteの永続化層（PlanningHistory, LocationKnowledge, ObjectKnowledge）のマイクロベンチマーク
+
+テーブルの行数（--sizes）ごとに以下を計測し、行数に対する処理時間の伸び方を確認する
+    insert:   add_tasks / add_commands / add_execution_result（1行ごとにcommitする現在の実装）
+    history:  get_executed_tasks / get_executed_commands（1行ごとに実行結果を問い合わせるN+1のパターン）
+              get_all_executed_commands（全件の取得）
+    lookup:   LocationKnowledge / ObjectKnowledge の get_by_name
+    scan:     LocationKnowledge / ObjectKnowledge の get_all
+
+計測の対象外となるテーブルの初期データは、executemanyで1つのトランザクションとして投入する
+結果はpytest-benchmarkと同じ形式の統計量（min, max, mean, stddev, median, rounds, ops）でJSONに出力し、
+--compareで過去の結果と比較して、meanが--thresholdの割合を超えて遅くなったものを回帰として報告する
+
+実行方法（リポジトリのルートで実行）:
+    python -m benchmarks.sqlite_bench [--sizes 1000 10000 100000 1000000] [--json out.json] [--compare old.json]
+"""
+from typing import Any, Callable, Dict, List, Optional
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from planner.database.sqlite import SQLiteInterface, PlanningHistory, LocationKnowledge, ObjectKnowledge
+from planner.database.data_type import TaskRecord, CommandRecord, CommandExecutionResultRecord
+
+TASKS_PER_JOB = 10  # 1ジョブあたりのタスク数
+COMMANDS_PER_TASK = 1  # 1タスクあたりのコマンド数
+INSERT_BATCH = 100  # insertの1ラウンドで追加する行数
+
+
+class Benchmark():
+    """
+    pytest-benchmarkのbenchmarkフィクスチャと同じ考え方で関数を繰り返し実行し、統計量を記録する
+
+    Args:
+        min_time: float 1つのベンチマークで最低限計測する時間[s]
+        max_rounds: int 最大の実行回数
+        min_rounds: int 最小の実行回数
+    """
+    def __init__(self, min_time: float = 0.2, max_rounds: int = 50, min_rounds: int = 3):
+        self.min_time = min_time
+        self.max_rounds = max_rounds
+        self.min_rounds = min_rounds
+        self.results: List[Dict[str, Any]] = []
+
+    def __call__(self, group: str, name: str, params: Dict[str, Any], func: Callable[[], Any], setup: Optional[Callable[[], None]] = None):
+        timings: List[float] = []
+        total = 0.0
+        while len(timings) < self.max_rounds and (len(timings) < self.min_rounds or total < self.min_time):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+            total += elapsed
+        mean = statistics.mean(timings)
+        result = {
+            "group": group,
+            "name": name,
+            "fullname": f"{group}::{name}[{','.join(f'{k}={v}' for k, v in params.items())}]",
+            "params": params,
+            "stats": {
+                "min": min(timings),
+                "max": max(timings),
+                "mean": mean,
+                "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+                "median": statistics.median(timings),
+                "rounds": len(timings),
+                "total": total,
+                "ops": 1.0 / mean if mean > 0 else 0.0,
+            },
+        }
+        self.results.append(result)
+        return result
+
+
+# --- 初期データの投入 ---
+
+def seed_history(history: PlanningHistory, rows: int):
+    """Tasks, Commandsがそれぞれrows行になるように実行済みのデータを投入する"""
+    conn = history._conn
+    now = datetime.now(timezone.utc).isoformat()
+    jobs = max(1, rows // TASKS_PER_JOB)
+    with conn:
+        conn.executemany(
+            "INSERT INTO Jobs (job_id, content, status, timestamp) VALUES (?, ?, 'success', ?)",
+            ((j, f"job {j}", now) for j in range(1, jobs + 1))
+        )
+        conn.executemany(
+            "INSERT INTO Tasks (task_id, job_id, sequence_number, status, task_name, task_details, timestamp) VALUES (?, ?, ?, 'success', ?, '', ?)",
+            ((t, (t - 1) // TASKS_PER_JOB + 1, (t - 1) % TASKS_PER_JOB + 1, f"task {t}", now) for t in range(1, rows + 1))
+        )
+        conn.executemany(
+            "INSERT INTO TaskExecutionResults (task_id, status, detailed_info, start_time, end_time, timestamp) VALUES (?, 'success', '', ?, ?, ?)",
+            ((t, now, now, now) for t in range(1, rows + 1))
+        )
+        conn.executemany(
+            "INSERT INTO Commands (command_id, task_id, sequence_number, action, status, command_description, command_args, timestamp) VALUES (?, ?, ?, 'move', 'success', '', ?, ?)",
+            ((c, (c - 1) // COMMANDS_PER_TASK + 1, (c - 1) % COMMANDS_PER_TASK, json.dumps({"location": f"loc{c % 100}"}), now) for c in range(1, rows * COMMANDS_PER_TASK + 1))
+        )
+        conn.executemany(
+            "INSERT INTO CommandExecutionResults (command_id, status, detailed_info, x, y, z, start_time, end_time, timestamp) VALUES (?, 'success', '', 0, 0, 0, ?, ?, ?)",
+            ((c, now, now, now) for c in range(1, rows * COMMANDS_PER_TASK + 1))
+        )
+
+
+def seed_knowledge(location: LocationKnowledge, objects: ObjectKnowledge, rows: int):
+    conn = location._conn
+    with conn:
+        conn.executemany(
+            "INSERT INTO locations (location_id, location_name, description, x, y, z) VALUES (?, ?, '', 0, 0, 0)",
+            ((f"loc_{i}", f"location{i}") for i in range(rows))
+        )
+        conn.executemany(
+            "INSERT INTO objects (object_id, object_type, description, x, y, z, confidence) VALUES (?, ?, '', 0, 0, 0, 1.0)",
+            ((f"obj_{i}", f"object{i}") for i in range(rows))
+        )
+
+
+# --- ベンチマーク ---
+
+def run_size(bench: Benchmark, rows: int, db_path: str, max_full_scan_rows: int):
+    params = {"rows": rows}
+    sqlite = SQLiteInterface(db_path)
+    try:
+        history = PlanningHistory(sqlite)
+        location = LocationKnowledge(sqlite)
+        objects = ObjectKnowledge(sqlite)
+        seed_history(history, rows)
+        seed_knowledge(location, objects, rows)
+
+        # insert（1行ごとにcommitする）
+        def new_tasks() -> List[TaskRecord]:
+            return [TaskRecord(uid=-1, job_uid=1, sequence_number=i, description=f"new task {i}") for i in range(INSERT_BATCH)]
+
+        def new_commands() -> List[CommandRecord]:
+            return [CommandRecord(uid=-1, task_uid=1, sequence_number=i, description="move", args={"location": "キッチン"}) for i in range(INSERT_BATCH)]
+
+        bench("insert", "add_tasks", dict(params, batch=INSERT_BATCH), lambda: history.add_tasks(new_tasks(), 1))
+        bench("insert", "add_commands", dict(params, batch=INSERT_BATCH), lambda: history.add_commands(new_commands(), 1))
+        command_ids: List[int] = []
+        bench(
+            "insert", "add_execution_result", dict(params, batch=INSERT_BATCH),
+            lambda: [history.add_execution_result(CommandExecutionResultRecord(status="success"), "command", cid) for cid in command_ids],
+            setup=lambda: command_ids.__setitem__(slice(None), history.add_commands(new_commands(), 1)),
+        )
+
+        # history（N+1のパターンと全件の取得）
+        job_id = max(1, rows // TASKS_PER_JOB // 2)
+        task_id = max(1, rows // 2)
+        bench("history", "get_executed_tasks", dict(params, per_job=TASKS_PER_JOB), lambda: history.get_executed_tasks(job_id))
+        bench("history", "get_executed_commands", dict(params, per_task=COMMANDS_PER_TASK), lambda: history.get_executed_commands(task_id))
+        if rows <= max_full_scan_rows:
+            bench("history", "get_all_executed_commands", params, history.get_all_executed_commands)
+
+        # lookup / scan
+        name = f"location{rows // 2}"
+        bench("lookup", "location_get_by_name", params, lambda: location.get_by_name(name))
+        bench("lookup", "object_get_by_name", params, lambda: objects.get_by_name(f"object{rows // 2}"))
+        if rows <= max_full_scan_rows:
+            bench("scan", "location_get_all", params, location.get_all)
+            bench("scan", "object_get_all", params, objects.get_all)
+    finally:
+        sqlite.close()
+
+
+def compare(results: List[Dict[str, Any]], previous_path: str, threshold: float) -> List[str]:
+    """前回の結果と比べてmeanがthresholdの割合を超えて増加したベンチマークのリストを返す"""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = {b["fullname"]: b for b in json.load(f)["benchmarks"]}
+    regressions = []
+    for r in results:
+        old = previous.get(r["fullname"])
+        if old is None:
+            continue
+        ratio = r["stats"]["mean"] / old["stats"]["mean"] if old["stats"]["mean"] > 0 else 1.0
+        if ratio > 1.0 + threshold:
+            regressions.append(f"{r['fullname']}: {old['stats']['mean'] * 1e3:.3f}ms -> {r['stats']['mean'] * 1e3:.3f}ms (x{ratio:.2f})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="テーブルの行数")
+    parser.add_argument("--db", default=None, help="データベースのパス（省略した場合は一時ファイル、':memory:'でメモリ上）")
+    parser.add_argument("--min-time", type=float, default=0.2, help="1つのベンチマークで最低限計測する時間[s]")
+    parser.add_argument("--max-full-scan-rows", type=int, default=100000, help="全件を取得するベンチマークを行う最大の行数")
+    parser.add_argument("--json", metavar="PATH", help="結果をJSONで出力する")
+    parser.add_argument("--compare", metavar="PATH", help="過去の結果（--jsonの出力）と比較する")
+    parser.add_argument("--threshold", type=float, default=0.2, help="回帰とみなすmeanの増加の割合")
+    args = parser.parse_args(argv)
+
+    bench = Benchmark(min_time=args.min_time)
+    for rows in args.sizes:
+        if args.db is None:
+            with tempfile.TemporaryDirectory() as d:
+                run_size(bench, rows, os.path.join(d, "bench.db"), args.max_full_scan_rows)
+        else:
+            if args.db != ":memory:" and os.path.exists(args.db):
+                os.remove(args.db)
+            run_size(bench, rows, args.db, args.max_full_scan_rows)
+
+    print(f"{'benchmark':<58}{'mean [ms]':>12}{'median [ms]':>13}{'rounds':>8}")
+    for r in bench.results:
+        s = r["stats"]
+        print(f"{r['fullname']:<58}{s['mean'] * 1e3:>12.3f}{s['median'] * 1e3:>13.3f}{s['rounds']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "machine_info": {"python_version": platform.python_version(), "platform": platform.platform()},
+                "datetime": datetime.now(timezone.utc).isoformat(),
+                "benchmarks": bench.results,
+            }, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        regressions = compare(bench.results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"[REGRESSION] {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+メトリクスのレジストリから、ダッシュボードに表示する値を一定間隔で集計する
+
+ログの文字列を解析せずに、各モジュールが記録したメトリクス（utils.metrics）の前回の集計からの差分を使用する為、
+直近の区間（window）の値と、起動してからの累積の値の両方を表示できる
+GUIに依存しない為、flet以外の表示（コンソールなど）にも使用できる
+
+Example:
+    sampler = MetricsSampler()
+    while True:
+        time.sleep(1.0)
+        snapshot = sampler.sample()
+        print(snapshot.series["llm_latency"].window_p95)
+"""
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import deque
+import time
+
+from utils.metrics import MetricsRegistry, HdrHistogram, Histogram, Counter, Gauge, default_registry
+
+# (表示名, メトリクス名, 集計するラベル)
+HISTOGRAM_SERIES: Dict[str, Tuple[str, str, Dict[str, str]]] = {
+    "llm_latency": ("LLMのレイテンシ[s]", "llm_request_duration_seconds", {"outcome": "success"}),
+    "llm_generation": ("生成の所要時間（再試行を含む）[s]", "llm_generation_duration_seconds", {}),
+    "prompt_tokens": ("プロンプトのトークン数/回", "gemini_tokens_per_request", {"kind": "prompt"}),
+    "completion_tokens": ("応答のトークン数/回", "gemini_tokens_per_request", {"kind": "completion"}),
+    "db_query": ("DBの処理時間[s]", "db_query_duration_seconds", {}),
+    "document_query": ("文書検索の所要時間[s]", "document_query_duration_seconds", {}),
+    "command": ("コマンドの実行時間[s]", "command_duration_seconds", {}),
+}
+
+COUNTER_SERIES: Dict[str, Tuple[str, str, Dict[str, str]]] = {
+    "throttle_wait": ("レート制限の待機時間[s]", "gemini_throttle_wait_seconds_total", {}),
+    "llm_retries": ("LLMの再試行", "llm_retries_total", {}),
+    "llm_timeouts": ("LLMのタイムアウト", "llm_timeouts_total", {}),
+    "replanning_command": ("リプランニング（コマンド）", "replanning_total", {"level": "command_level"}),
+    "replanning_task": ("リプランニング（タスク）", "replanning_total", {"level": "task_level"}),
+    "command_failures": ("失敗したコマンド", "command_evaluations_total", {"status": "failure"}),
+    "json_repaired": ("JSONの修正（成功）", "llm_json_repairs_total", {"result": "repaired"}),
+    "json_unrepaired": ("JSONの修正（失敗）", "llm_json_repairs_total", {"result": "unrepaired"}),
+}
+
+# 区間の時間の内訳（値は区間内に各処理に費やした時間の合計[s]）
+BREAKDOWN: Dict[str, str] = {
+    "llm": "LLMの応答待ち",
+    "throttle": "レート制限の待機",
+    "command": "ロボットのコマンド",
+    "db": "DB・文書検索",
+}
+
+
+@dataclass
+class SeriesStats():
+    """1つの系列の集計値（window_*は前回の集計からの区間の値、Noneは記録が無いことを表す）"""
+    label: str
+    count: float = 0.0
+    total: float = 0.0
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    window_count: float = 0.0
+    window_total: float = 0.0
+    window_mean: Optional[float] = None
+    window_p95: Optional[float] = None
+    history: List[Optional[float]] = field(default_factory=list)  # 過去の区間の代表値（ヒストグラムは平均、カウンターは増分）
+
+
+@dataclass
+class DashboardSnapshot():
+    timestamp: float
+    elapsed: float  # 区間の長さ[s]
+    series: Dict[str, SeriesStats]
+    breakdown: Dict[str, float]  # 区間内の処理時間の合計[s]（並行して実行された場合はelapsedを超えることがある）
+    in_flight: float  # 実行中のLLMへのリクエスト数
+
+    def share(self, key: str) -> float:
+        """区間の長さに対するbreakdown[key]の割合（0〜1）"""
+        if self.elapsed <= 0:
+            return 0.0
+        return min(1.0, self.breakdown.get(key, 0.0) / self.elapsed)
+
+
+class MetricsSampler():
+    """
+    Args:
+        registry: MetricsRegistry 集計するレジストリ
+        history: int 保持する過去の区間の数
+    """
+    def __init__(self, registry: MetricsRegistry = default_registry, history: int = 60):
+        self.registry = registry
+        self._previous_time = time.monotonic()
+        self._previous_hist: Dict[str, HdrHistogram] = {}
+        self._previous_counter: Dict[str, float] = {}
+        self._history: Dict[str, Deque[Optional[float]]] = {
+            key: deque(maxlen=history) for key in list(HISTOGRAM_SERIES) + list(COUNTER_SERIES)
+        }
+
+    def _histogram(self, name: str, labels: Dict[str, str]) -> Optional[HdrHistogram]:
+        metric = self.registry.get(name)
+        if not isinstance(metric, Histogram):
+            return None  # まだ登録されていない（モジュールが読み込まれていない）
+        return metric.aggregate(**labels)
+
+    def _counter(self, name: str, labels: Dict[str, str]) -> float:
+        metric = self.registry.get(name)
+        if isinstance(metric, (Counter, Gauge)):
+            return metric.total(**labels)
+        if isinstance(metric, Histogram):
+            return float(metric.aggregate(**labels).count)
+        return 0.0
+
+    def _histogram_stats(self, key: str, label: str, hist: Optional[HdrHistogram]) -> SeriesStats:
+        stats = SeriesStats(label=label)
+        if hist is not None:
+            previous = self._previous_hist.get(key)
+            window = hist.diff(previous) if previous is not None else hist
+            self._previous_hist[key] = hist
+            stats.count, stats.total = hist.count, hist.sum
+            stats.p50, stats.p95 = hist.quantile(0.5), hist.quantile(0.95)
+            stats.window_count, stats.window_total = window.count, window.sum
+            stats.window_mean = window.mean
+            stats.window_p95 = window.quantile(0.95)
+        self._history[key].append(stats.window_mean)
+        stats.history = list(self._history[key])
+        return stats
+
+    def _counter_stats(self, key: str, label: str, value: float) -> SeriesStats:
+        delta = value - self._previous_counter.get(key, 0.0)
+        self._previous_counter[key] = value
+        self._history[key].append(delta)
+        return SeriesStats(
+            label=label, count=value, total=value, window_count=delta, window_total=delta,
+            history=list(self._history[key])
+        )
+
+    def sample(self) -> DashboardSnapshot:
+        """前回のsample()からの区間と累積の値を集計する"""
+        now = time.monotonic()
+        elapsed = now - self._previous_time
+        self._previous_time = now
+
+        series: Dict[str, SeriesStats] = {}
+        for key, (label, name, labels) in HISTOGRAM_SERIES.items():
+            series[key] = self._histogram_stats(key, label, self._histogram(name, labels))
+        for key, (label, name, labels) in COUNTER_SERIES.items():
+            series[key] = self._counter_stats(key, label, self._counter(name, labels))
+
+        # LLMのリクエストの時間は成功したものに限らず全て含める（失敗や破棄したヘッジも待ち時間になる為）
+        # レート制限の待機はリクエストの時間に含まれる為、LLMの応答待ちからは除く
+        llm = self._histogram("llm_request_duration_seconds", {})
+        llm_total = llm.sum if llm is not None else 0.0
+        llm_window = llm_total - self._previous_counter.get("_llm_total", 0.0)
+        self._previous_counter["_llm_total"] = llm_total
+        throttle = series["throttle_wait"].window_total
+        breakdown = {
+            "llm": max(0.0, llm_window - throttle),
+            "throttle": throttle,
+            "command": series["command"].window_total,
+            "db": series["db_query"].window_total + series["document_query"].window_total,
+        }
+        in_flight = self._counter("llm_requests_in_flight", {})
+        return DashboardSnapshot(
+            timestamp=time.time(), elapsed=elapsed, series=series, breakdown=breakdown, in_flight=in_flight
+        )
@@ -0,0 +1,187 @@
+from flet import *  # type: ignore
+from gui.metrics_sampler import MetricsSampler, DashboardSnapshot, SeriesStats, BREAKDOWN
+from typing import Dict, List, Optional
+import threading
+
+_SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+_BREAKDOWN_COLORS = {
+    "llm": colors.BLUE_400,
+    "throttle": colors.ORANGE_400,
+    "command": colors.GREEN_400,
+    "db": colors.PURPLE_300,
+}
+
+
+def sparkline(values: List[Optional[float]], width: int = 30) -> str:
+    """値の推移を文字で表す（Noneは空白）"""
+    values = values[-width:]
+    present = [v for v in values if v is not None]
+    if not present:
+        return ""
+    high = max(present)
+    if high <= 0:
+        return "".join(" " if v is None else _SPARK_CHARS[0] for v in values)
+    return "".join(
+        " " if v is None else _SPARK_CHARS[min(len(_SPARK_CHARS) - 1, int(v / high * (len(_SPARK_CHARS) - 1)))]
+        for v in values
+    )
+
+
+def _seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value * 1000:.3g} ms" if value < 1 else f"{value:.2f} s"
+
+
+def _number(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:,.0f}"
+
+
+def _count_text(stats: SeriesStats) -> str:
+    """カウンターの累積値と直近の区間の増分"""
+    if stats.window_count:
+        return f"{stats.total:.0f} (+{stats.window_count:.0f})"
+    return f"{stats.total:.0f}"
+
+
+class _StatCard(Card):
+    """1つの系列の値（区間の値を大きく、累積の値を小さく表示する）"""
+    def __init__(self, title: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value_text = Text("-", size=28, weight=FontWeight.BOLD)
+        self.sub_text = Text("", size=12, color=colors.GREY_400)
+        self.spark_text = Text("", size=14, font_family="monospace")
+        self.content = Container(
+            padding=10,
+            content=Column(
+                spacing=4,
+                controls=[Text(title, size=14), self.value_text, self.sub_text, self.spark_text]
+            )
+        )
+
+    def set_values(self, value: str, sub: str, history: List[Optional[float]]):
+        self.value_text.value = value
+        self.sub_text.value = sub
+        self.spark_text.value = sparkline(history)
+
+
+class LLMRobotPlannerDashboardView(Container):
+    """
+    メトリクス（utils.metrics）から、LLM、DB、コマンドの処理時間とリプランニングの回数を表示するビュー
+
+    interval秒ごとにMetricsSamplerで集計し、直近の区間の値と推移、起動してからの累積の値を表示する
+    「時間の内訳」は区間の長さに対する各処理の時間の割合で、ロボットがLLMとハードウェアのどちらを待っているかを表す
+
+    Args:
+        page: Page
+        interval: float 更新の間隔[s]
+        sampler: Optional[MetricsSampler] 集計に使用するMetricsSampler（省略した場合はdefault_registryを集計する）
+    """
+    def __init__(
+        self,
+        page: Page,
+        interval: float = 1.0,
+        sampler: Optional[MetricsSampler] = None,
+        *args,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.page = page
+        self.expand = True
+        self.interval = interval
+        self.sampler = sampler if sampler is not None else MetricsSampler()
+
+        self._cards: Dict[str, _StatCard] = {
+            "llm_latency": _StatCard("LLMのレイテンシ"),
+            "tokens": _StatCard("トークン数/回（プロンプト / 応答）"),
+            "throttle_wait": _StatCard("レート制限の待機"),
+            "db_query": _StatCard("DBの処理時間"),
+            "command": _StatCard("コマンドの実行時間"),
+            "replanning": _StatCard("リプランニング（コマンド / タスク）"),
+        }
+        self._breakdown_bars: Dict[str, ProgressBar] = {}
+        self._breakdown_texts: Dict[str, Text] = {}
+        breakdown_rows = []
+        for key, label in BREAKDOWN.items():
+            self._breakdown_bars[key] = ProgressBar(value=0, color=_BREAKDOWN_COLORS[key], expand=True)
+            self._breakdown_texts[key] = Text("0%", width=60, text_align=TextAlign.RIGHT)
+            breakdown_rows.append(Row(controls=[
+                Text(label, width=140), self._breakdown_bars[key], self._breakdown_texts[key]
+            ]))
+        self.status_text = Text("", size=12, color=colors.GREY_400)
+
+        self.content = Column(
+            scroll=ScrollMode.AUTO,
+            controls=[
+                Text("時間の内訳（直近の区間）", size=18),
+                Column(controls=breakdown_rows),
+                self.status_text,
+                Divider(),
+                ResponsiveRow(
+                    controls=[Container(col={"sm": 12, "md": 6, "xl": 4}, content=card) for card in self._cards.values()]
+                ),
+            ]
+        )
+        self._stop = threading.Event()
+
+    def did_mount(self):
+        self._stop.clear()
+        threading.Thread(target=self._refresh_loop, name="dashboard-refresh", daemon=True).start()
+
+    def will_unmount(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.show(self.sampler.sample())
+            except Exception:
+                # ページが閉じられた後など、更新できない場合は停止する
+                import logging
+                logging.getLogger("LLMRobotPlanner").exception("failed to refresh the dashboard")
+                return
+
+    def show(self, snapshot: DashboardSnapshot):
+        s = snapshot.series
+        self._set_latency_card("llm_latency", s["llm_latency"])
+        self._set_latency_card("db_query", s["db_query"])
+        self._set_latency_card("command", s["command"])
+
+        prompt, completion = s["prompt_tokens"], s["completion_tokens"]
+        self._cards["tokens"].set_values(
+            f"{_number(prompt.window_mean)} / {_number(completion.window_mean)}",
+            f"累積の平均 {_number(prompt.total / prompt.count if prompt.count else None)} / "
+            f"{_number(completion.total / completion.count if completion.count else None)}",
+            [
+                (p or 0) + (c or 0) if p is not None or c is not None else None
+                for p, c in zip(prompt.history, completion.history)
+            ],
+        )
+        throttle = s["throttle_wait"]
+        self._cards["throttle_wait"].set_values(
+            _seconds(throttle.window_total),
+            f"累積 {_seconds(throttle.total)}  再試行 {_count_text(s['llm_retries'])}  タイムアウト {_count_text(s['llm_timeouts'])}",
+            throttle.history,
+        )
+        command_level, task_level = s["replanning_command"], s["replanning_task"]
+        self._cards["replanning"].set_values(
+            f"{_number(command_level.total)} / {_number(task_level.total)}",
+            f"失敗したコマンド {_number(s['command_failures'].total)}",
+            [(a or 0) + (b or 0) for a, b in zip(command_level.history, task_level.history)],
+        )
+
+        for key in BREAKDOWN:
+            share = snapshot.share(key)
+            self._breakdown_bars[key].value = share
+            self._breakdown_texts[key].value = f"{share * 100:.0f}%"
+        self.status_text.value = f"区間 {snapshot.elapsed:.1f} s  実行中のLLMリクエスト {snapshot.in_flight:.0f}"
+        self.update()
+
+    def _set_latency_card(self, key: str, stats: SeriesStats):
+        self._cards[key].set_values(
+            _seconds(stats.window_mean),
+            f"区間 {stats.window_count:.0f}回 p95 {_seconds(stats.window_p95)}  "
+            f"累積 {stats.count:.0f}回 p50 {_seconds(stats.p50)} p95 {_seconds(stats.p95)}",
+            stats.history,
+        )
@@ -1,17 +1,153 @@
 from flet import *  # type: ignore
 from gui.control.selectable_list import SelectableList, SelectableListItem
+from logger.logger import LogRecord, DurationLogRecord
+from typing import Deque, Dict, List, Optional, Callable, Set
+from collections import deque
+from datetime import datetime
+import threading
 
 
-# ログデータの保存やアクセスは仮の実装（後でちゃんとしたものを実装する）
+def format_timestamp(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def truncate_text(text: str, limit: Optional[int]) -> str:
+    """limit文字を超える部分を省略する（Noneの場合は省略しない）"""
+    if limit is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}\n…（残り{len(text) - limit}文字を省略）"
+
+
+class LogRow():
+    """リストの1行（trace/action/spanの開始、またはイベント）"""
+    __slots__ = ("seq", "record", "depth")
+
+    def __init__(self, seq: Optional[int], record: LogRecord, depth: int):
+        self.seq = seq  # メモリ上のリングバッファでの通し番号（ファイルから読み込んだ行はNone）
+        self.record = record  # 最新のレコード（詳細の文字列は選択された時に作成する）
+        self.depth = depth
+
+    @property
+    def uid(self) -> str:
+        return self.record.uid
+
+    @property
+    def action(self) -> str:
+        return self.record.name
+
+    @property
+    def is_instant(self) -> bool:
+        return not isinstance(self.record, DurationLogRecord)
+
+
+class _TracePager():
+    """
+    TraceFileHandlerで記録したファイルから、リングバッファから破棄された古い行を読み込む
+
+    ファイルを先頭から読み込み、必要な範囲の行のみを保持する（ページを移動する時のみ呼び出す）
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def _rows(self):
+        from logger.trace_file import TraceReader
+        from logger.logger import LogEventType
+        depths: Dict[str, int] = {}
+        rows: Dict[str, LogRow] = {}  # 詳細を更新する為に、返した行のうち終了していないもの
+        for event in TraceReader(self.path):
+            record = event.record
+            is_duration = isinstance(record, DurationLogRecord)
+            if event.event_type == LogEventType.BEGIN or not is_duration:
+                depth = depths[record.parent] + 1 if record.parent in depths else 0
+                row = LogRow(None, record, depth)
+                if is_duration:
+                    depths[record.uid] = depth
+                    rows[record.uid] = row
+                yield row
+            elif record.uid in rows:
+                rows[record.uid].record = record
+                if event.event_type == LogEventType.END:
+                    del rows[record.uid]
+                    depths.pop(record.uid, None)
+
+    def before(self, uid: str, n: int) -> List[LogRow]:
+        """uidの行より前のn行"""
+        window: Deque[LogRow] = deque(maxlen=n)
+        for row in self._rows():
+            if row.uid == uid:
+                return list(window)
+            window.append(row)
+        return []
+
+    def after(self, uid: str, n: int, stop: Callable[[str], bool]) -> List[LogRow]:
+        """uidの行より後のn行（stop(uid)がTrueになる行の手前まで）"""
+        result: List[LogRow] = []
+        found = False
+        for row in self._rows():
+            if found:
+                if stop(row.uid) or len(result) >= n:
+                    break
+                result.append(row)
+            elif row.uid == uid:
+                found = True
+        return result
+
 
 class LLMRobotPlannerRealTimeInfoView(Container):
-    def __init__(self, page: Page, *args, **kwargs):
+    """
+    ログのtrace/action/span/イベントの一覧と詳細を表示するビュー
+
+    長時間の実行でもGUIが遅くならないように
+        - 行はリングバッファ（最大max_rows行）にのみ保持し、画面にはwindow_size行だけコントロールを作成する
+        - ハンドラーからの追加や更新はバッファに記録するだけで、画面の更新は最大max_fps回/秒にまとめて行う
+        - trace_path（TraceFileHandlerで記録したファイル）を指定した場合、バッファから破棄された行はファイルから読み込む
+
+    Args:
+        page: Page
+        max_rows: int メモリに保持する行の最大数
+        window_size: int 画面に表示する行の数
+        max_fps: float 画面を更新する最大の頻度[回/s]
+        trace_path: Optional[str] 古い行を読み込むファイル
+        detail_limit: Optional[int] 詳細のinput, output, feedbackごとに表示する最大の文字数
+            超える部分は省略し、「全て表示」を押した場合のみ表示する（Noneの場合は省略しない）
+    """
+    def __init__(
+        self,
+        page: Page,
+        max_rows: int = 5000,
+        window_size: int = 200,
+        max_fps: float = 10.0,
+        trace_path: Optional[str] = None,
+        detail_limit: Optional[int] = 4000,
+        *args,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self.page = page
         self.expand = True
-        self.list_info_view = SelectableList(auto_scroll=False, on_change=self._on_change_list_item)
+        self.max_rows = max_rows
+        self.window_size = window_size
+        self.max_fps = max_fps
+        self.detail_limit = detail_limit
+        self._pager = _TracePager(trace_path) if trace_path is not None else None
+
+        self.list_info_view = SelectableList(auto_scroll=True, item_extent=32, on_change=self._on_change_list_item)
+        self.range_text = Text("", size=12)
         self.left_view = Container(
-            content=self.list_info_view,
+            content=Column(
+                expand=True,
+                controls=[
+                    Row(
+                        controls=[
+                            TextButton("古いログ", icon=icons.ARROW_UPWARD, on_click=lambda e: self.page_older()),
+                            TextButton("新しいログ", icon=icons.ARROW_DOWNWARD, on_click=lambda e: self.page_newer()),
+                            TextButton("最新", icon=icons.VERTICAL_ALIGN_BOTTOM, on_click=lambda e: self.follow_latest()),
+                            self.range_text,
+                        ]
+                    ),
+                    Container(content=self.list_info_view, expand=True),
+                ]
+            ),
             expand=True
         )
         self.right_info_view = Container(expand=True)
@@ -19,37 +155,182 @@ class LLMRobotPlannerRealTimeInfoView(Container):
         self.content = Row(
             controls=[self.left_view, VerticalDivider(), self.right_info_view]
         )
-        
-        # テスト実装
-        from typing import Dict
-        self.data_logs: Dict[str, dict] = {}
-        self.n = 0
-    
-    # テスト実装
-    def append_list_item(
-        self, action_text, detail_text, timestamp_text, uid_text, is_instant
-    ):
-        
-        # テスト実装
-        log = {"action": action_text, "detail": detail_text, "timestamp": timestamp_text, "uid": uid_text}        
-        self.data_logs[uid_text] = log
-        
-        self.list_info_view.controls.append(
-            SelectableListItem(
-                on_selected=self._on_list_item_selected,
-                on_unselected=self._on_list_item_unselected,
-                content=Container(margin=margin.only(left=30*self.n), content=Text(action_text, size=18)),
-            )
+
+        self._lock = threading.RLock()  # バッファ（ハンドラーのスレッドから更新される）
+        # 画面に表示している行（_visible, list_info_view.controls, _follow）は、更新スレッドとクリックのハンドラーから変更される為、
+        # このロックを取得して変更する（ロックの順序は_view_lock -> _lock、ハンドラーは_lockのみ取得する為、画面の更新を待たない）
+        self._view_lock = threading.RLock()
+        self._rows: Deque[LogRow] = deque()  # リングバッファ
+        self._row_by_uid: Dict[str, LogRow] = {}
+        self._depths: Dict[str, int] = {}  # 終了していないtrace/action/spanの深さ
+        self._seq = 0
+        self._visible: List[LogRow] = []  # 画面に表示している行
+        self._follow = True  # 最新の行を表示し続けるか
+        self._dirty = False
+        self._selected: Optional[LogRow] = None
+        self._selected_dirty = False
+        self._expanded: Set[str] = set()  # 詳細を省略せずに表示するレコードのUID
+        self._stop = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def did_mount(self):
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name="log-view-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def will_unmount(self):
+        self._stop.set()
+
+    def append_record(self, record: LogRecord):
+        """行を追加する（trace/action/spanの開始、またはイベント）"""
+        with self._lock:
+            depth = self._depths[record.parent] + 1 if record.parent in self._depths else 0
+            row = LogRow(self._seq, record, depth)
+            self._seq += 1
+            if len(self._rows) >= self.max_rows:
+                evicted = self._rows.popleft()
+                self._row_by_uid.pop(evicted.uid, None)
+                self._expanded.discard(evicted.uid)
+            self._rows.append(row)
+            self._row_by_uid[record.uid] = row
+            if not row.is_instant:
+                self._depths[record.uid] = depth
+            self._dirty = True
+            
+    def update_record(self, record: LogRecord, is_duration_end: bool = False):
+        """行のレコードを最新のものに置き換える（詳細は表示する時に作成する為、選択中の行のみ再表示する）"""
+        with self._lock:
+            row = self._row_by_uid.get(record.uid)
+            if row is not None:
+                row.record = record
+                if row is self._selected:
+                    self._selected_dirty = True
+            if is_duration_end:
+                self._depths.pop(record.uid, None)
+
+    def _refresh_loop(self):
+        interval = 1.0 / self.max_fps
+        while not self._stop.wait(interval):
+            try:
+                self._refresh()
+            except Exception:
+                # ページが閉じられた後など、更新できない場合は停止する
+                import logging
+                logging.getLogger("LLMRobotPlanner").exception("failed to refresh the log view")
+                return
+
+    def _refresh(self):
+        """前回の更新以降の変更をまとめて画面に反映する"""
+        with self._view_lock:
+            with self._lock:
+                list_changed = self._dirty and self._follow
+                self._dirty = False
+                if list_changed:
+                    last_seq = self._visible[-1].seq if self._visible else None
+                    if last_seq is None or not self._rows or last_seq < self._rows[0].seq:
+                        new_rows = list(self._rows)[-self.window_size:]
+                        reset = True
+                    else:
+                        start = last_seq - self._rows[0].seq + 1
+                        new_rows = [self._rows[i] for i in range(start, len(self._rows))][-self.window_size:]
+                        reset = False
+                selected = self._selected if self._selected_dirty else None
+                self._selected_dirty = False
+
+            # 計算してから反映するまでの間にページが移動されないように、_view_lockを保持したまま反映する
+            if list_changed:
+                if reset:
+                    self._set_visible(new_rows)
+                else:
+                    self._append_visible(new_rows)
+        if selected is not None:
+            self._detail_view(selected.record)
+
+    def _make_item(self, row: LogRow) -> SelectableListItem:
+        return SelectableListItem(
+            on_selected=self._on_list_item_selected,
+            on_unselected=self._on_list_item_unselected,
+            data=row,
+            content=Container(margin=margin.only(left=30*row.depth), content=Text(row.action, size=18, no_wrap=True)),
         )
+
+    def _set_visible(self, rows: List[LogRow]):
+        """_view_lockを取得して呼び出す"""
+        self._visible = list(rows)
+        self.list_info_view.controls = [self._make_item(row) for row in rows]
+        self._update_list()
+
+    def _append_visible(self, rows: List[LogRow]):
+        """_view_lockを取得して呼び出す"""
+        if not rows:
+            return
+        self._visible.extend(rows)
+        self.list_info_view.controls.extend(self._make_item(row) for row in rows)
+        overflow = len(self._visible) - self.window_size
+        if overflow > 0:
+            del self._visible[:overflow]
+            del self.list_info_view.controls[:overflow]
+        self._update_list()
+
+    def _update_list(self):
+        if self._visible:
+            first, last = self._visible[0], self._visible[-1]
+            if first.seq is not None and last.seq is not None:
+                self.range_text.value = f"#{first.seq + 1} - #{last.seq + 1} / {self._seq}"
+            else:
+                self.range_text.value = f"{format_timestamp(first.record.timestamp)} - {format_timestamp(last.record.timestamp)}（ファイル）"
+        else:
+            self.range_text.value = ""
+        self.list_info_view.auto_scroll = self._follow
         self.list_info_view.update()
-        if not is_instant:
-            self.n += 1
-            
-    def update_list_item(self, action_text, detail_text, timestamp_text, uid_text, is_duration_end):
-        log = {"action": action_text, "detail": detail_text, "timestamp": timestamp_text, "uid": uid_text}        
-        self.data_logs[uid_text] = log
-        if is_duration_end:
-            self.n -= 1
+        self.range_text.update()
+
+    def page_older(self):
+        """表示している行より前のwindow_size行を表示する"""
+        with self._view_lock:
+            with self._lock:
+                if not self._visible:
+                    return
+                first = self._visible[0]
+                rows: List[LogRow] = []
+                if first.seq is not None and self._rows and first.seq > self._rows[0].seq:
+                    end = first.seq - self._rows[0].seq
+                    rows = [self._rows[i] for i in range(max(0, end - self.window_size), end)]
+            if len(rows) < self.window_size and self._pager is not None:
+                # バッファに無い分はファイルから読み込む（ハンドラーを待たせないように_lockの外で行う）
+                rows = self._pager.before(rows[0].uid if rows else first.uid, self.window_size - len(rows)) + rows
+            if rows:
+                self._follow = False
+                self._set_visible(rows)
+
+    def page_newer(self):
+        """表示している行より後のwindow_size行を表示する"""
+        with self._view_lock:
+            with self._lock:
+                if not self._visible or self._follow:
+                    return
+                last = self._visible[-1]
+            rows: List[LogRow] = []
+            if last.seq is None and self._pager is not None:
+                rows = self._pager.after(last.uid, self.window_size, stop=lambda uid: uid in self._row_by_uid)
+            with self._lock:
+                if len(rows) < self.window_size and self._rows:
+                    # ファイルの行の続き、またはバッファ内の次の行
+                    start = 0 if last.seq is None or last.seq < self._rows[0].seq else last.seq - self._rows[0].seq + 1
+                    end = start + self.window_size - len(rows)
+                    rows += [self._rows[i] for i in range(start, min(end, len(self._rows)))]
+                    if end >= len(self._rows):
+                        self._follow = True
+            if rows:
+                self._set_visible(rows)
+
+    def follow_latest(self):
+        """最新の行を表示し、以降は追加される行に追従する"""
+        with self._view_lock:
+            with self._lock:
+                self._follow = True
+                rows = list(self._rows)[-self.window_size:]
+            self._set_visible(rows)
             
     def _on_list_item_selected(self, e):
         e.bgcolor = colors.with_opacity(0.2, colors.WHITE)
@@ -60,18 +341,50 @@ class LLMRobotPlannerRealTimeInfoView(Container):
         e.update()
     
     def _on_change_list_item(self, e):
-        # テスト実装
-        index = e["index"]
-        keys = list(self.data_logs.keys())
-        log = self.data_logs[keys[index]]
-        self._detail_view(log["action"], log["detail"], log["timestamp"], log["uid"])
+        item = e["ref_list_item"]
+        if item is None:
+            self._selected = None
+            return
+        row: LogRow = item.data
+        self._selected = row
+        self._detail_view(row.record)
         
-    def _detail_view(self, action_text, detail_text, timestamp_text, uid_text):
+    def _detail_text(self, record: LogRecord, expanded: bool) -> str:
+        """詳細の文字列を作成する（プロンプトや応答の全文を含む為、選択された時にのみ作成する）"""
+        limit = None if expanded else self.detail_limit
+        if isinstance(record, DurationLogRecord):
+            return (
+                f"input:\n{truncate_text(record.input, limit)}\n\n"
+                f"output:\n{truncate_text(record.output, limit)}\n\n"
+                f"feedback:\n{truncate_text(record.feedback, limit)}"
+            )
+        return truncate_text(getattr(record, "context", ""), limit)
+
+    def _is_truncated(self, record: LogRecord) -> bool:
+        if self.detail_limit is None:
+            return False
+        if isinstance(record, DurationLogRecord):
+            return max(len(record.input), len(record.output), len(record.feedback)) > self.detail_limit
+        return len(getattr(record, "context", "")) > self.detail_limit
+
+    def _expand_detail(self, record: LogRecord):
+        with self._lock:
+            self._expanded.add(record.uid)
+            row = self._row_by_uid.get(record.uid)
+        self._detail_view(row.record if row is not None else record)
+
+    def _detail_view(self, record: LogRecord):
         icon_name = icons.ABC
-        title_text = action_text
-        # detail_text = detail_text
-        # timestamp_text = timestamp_text
-        # uid_text = uid_text
+        title_text = record.name
+        expanded = record.uid in self._expanded
+        detail_text = self._detail_text(record, expanded)
+        timestamp_text = format_timestamp(record.timestamp)
+        uid_text = record.uid
+        detail_header: List[Control] = [Text(value="Detail")]
+        if not expanded and self._is_truncated(record):
+            detail_header.append(
+                TextButton("全て表示", icon=icons.UNFOLD_MORE, on_click=lambda e: self._expand_detail(record))
+            )
         
         self.right_info_view.content = Column(
             alignment=MainAxisAlignment.START,
@@ -101,9 +414,7 @@ class LLMRobotPlannerRealTimeInfoView(Container):
                         Container(
                             content=Column(
                                 controls=[
-                                    Text(
-                                        value="Detail"
-                                    ),
+                                    Row(controls=detail_header),
                                     TextField(
                                         value=detail_text,
                                         read_only=True,
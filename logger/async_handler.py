@@ -0,0 +1,211 @@
+"""
+ハンドラーの処理をバックグラウンドのスレッドで行うラッパー
+
+LLMRobotPlannerLogSystemはハンドラーを呼び出し元のスレッドで同期的に実行する為、
+GUIの更新などの遅いハンドラーがプランニングを遅くする
+AsyncHandlerでラップしたハンドラーは、イベントを上限付きのキューに追加するだけで呼び出し元に戻り、
+ハンドラーごとの1つのワーカースレッドがキューに追加された順序で処理する（同じレコードのイベントの順序は保たれる）
+
+Example:
+    log_system.add_handler(AsyncHandler(LoggingGUIHandler(view), maxsize=10000, overflow="drop_oldest"))
+
+キューが一杯になった場合の動作（overflow）:
+    "block":       空きができるまで呼び出し元を待機させる（イベントを失わない）
+    "drop_oldest": キュー内の最も古いUPDATEイベントを破棄する
+                   UPDATEは後のUPDATE/ENDが同じレコードの最新の状態を含む為、破棄しても最終的な表示は変わらない
+                   キューにUPDATEが無い場合、追加するイベントがUPDATEであればそれを破棄し、BEGIN/ENDであれば待機する
+    "sample":      キューの長さがsample_threshold以上の間、UPDATEイベントはsample_everyに1件だけ追加する
+                   キューが一杯の場合はUPDATEを破棄し、BEGIN/ENDは待機する
+
+終了時（atexit）には全てのAsyncHandlerのキューに残ったイベントを処理してから終了する
+"""
+from typing import Deque, Literal, Optional
+from collections import deque
+import atexit
+import threading
+import time
+import weakref
+
+from logger.logger import Handler, LogEvent, LogEventType
+
+import logging
+logger = logging.getLogger("LLMRobotPlannerLogSystem")
+
+OverflowPolicy = Literal["block", "drop_oldest", "sample"]
+
+_handlers: "weakref.WeakSet[AsyncHandler]" = weakref.WeakSet()
+
+
+class AsyncHandler(Handler):
+    """
+    Args:
+        handler: Handler 実際に処理を行うハンドラー（is_realtimeはこのハンドラーの値を使用する）
+        maxsize: int キューの最大の長さ
+        overflow: OverflowPolicy キューが一杯になった場合の動作
+        sample_every: int overflow="sample"の場合に、UPDATEイベントを何件に1件追加するか
+        sample_threshold: float overflow="sample"の場合に、間引きを開始するキューの長さ（maxsizeに対する割合）
+        flush_timeout: Optional[float] 終了時にキューの処理を待つ最大の時間[s]
+    """
+    def __init__(
+        self,
+        handler: Handler,
+        maxsize: int = 10000,
+        overflow: OverflowPolicy = "block",
+        sample_every: int = 10,
+        sample_threshold: float = 0.5,
+        flush_timeout: Optional[float] = 5.0,
+    ):
+        if overflow not in ("block", "drop_oldest", "sample"):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be 1 or more")
+        self._handler = handler
+        self._is_realtime = handler.is_realtime
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.sample_every = max(1, sample_every)
+        self.sample_threshold = sample_threshold
+        self.flush_timeout = flush_timeout
+
+        self._queue: Deque[LogEvent] = deque()
+        self._cond = threading.Condition()
+        self._unfinished = 0  # キューに追加されてから処理が完了していないイベントの数
+        self._closed = False
+        self._sample_count = 0
+
+        # 統計
+        self.processed = 0  # ハンドラーが処理したイベントの数
+        self.dropped = 0  # キューが一杯の為に破棄したイベントの数
+        self.sampled_out = 0  # 間引いたイベントの数
+        self.errors = 0  # ハンドラーが例外を送出した回数
+        self.blocked_time = 0.0  # 呼び出し元がキューの空きを待った時間[s]
+        self.max_queue_length = 1
+
+        self._worker = threading.Thread(target=self._run, name=f"log-handler-{type(handler).__name__}", daemon=True)
+        self._worker.start()
+        _handlers.add(self)
+
+    @property
+    def handler(self) -> Handler:
+        return self._handler
+
+    @property
+    def is_realtime(self) -> bool:
+        return self._is_realtime
+
+    def handle(self, log: LogEvent):
+        with self._cond:
+            if self._closed:
+                # 終了後のイベントは呼び出し元のスレッドで処理する
+                self._handle(log)
+                return
+            if not self._make_room(log):
+                return
+            self._queue.append(log)
+            self._unfinished += 1
+            if len(self._queue) == 1:
+                # ワーカーはキューが空の場合のみ待機する為、空から増えた場合だけ通知する
+                self._cond.notify_all()
+            elif len(self._queue) > self.max_queue_length:
+                self.max_queue_length = len(self._queue)
+
+    def _make_room(self, log: LogEvent) -> bool:
+        """logを追加できる状態にする（logを破棄する場合はFalse）、self._condを取得した状態で呼び出す"""
+        is_update = log.event_type == LogEventType.UPDATE
+        if self.overflow == "sample" and is_update and len(self._queue) >= self.maxsize * self.sample_threshold:
+            self._sample_count += 1
+            if self._sample_count % self.sample_every != 0:
+                self.sampled_out += 1
+                return False
+        if len(self._queue) < self.maxsize:
+            return True
+
+        if self.overflow == "drop_oldest":
+            for i, queued in enumerate(self._queue):
+                if queued.event_type == LogEventType.UPDATE:
+                    del self._queue[i]
+                    self._unfinished -= 1
+                    self.dropped += 1
+                    return True
+        if self.overflow in ("drop_oldest", "sample") and is_update:
+            self.dropped += 1
+            return False
+
+        start = time.perf_counter()
+        while len(self._queue) >= self.maxsize and not self._closed:
+            self._cond.wait()
+        self.blocked_time += time.perf_counter() - start
+        if self._closed:
+            self._handle(log)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            # キューのイベントをまとめて取り出し、ロックの取得の回数を減らす
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+                events = list(self._queue)
+                self._queue.clear()
+                self._cond.notify_all()  # 待機中の呼び出し元に空きを知らせる
+            for event in events:
+                self._handle(event)
+            with self._cond:
+                self._unfinished -= len(events)
+                if self._unfinished == 0:
+                    self._cond.notify_all()
+
+    def _handle(self, event: LogEvent):
+        try:
+            self._handler.handle(event)
+            self.processed += 1
+        except Exception:
+            # ハンドラーの例外でワーカーが停止しないように、記録して処理を続ける
+            self.errors += 1
+            logger.exception(f"log handler {type(self._handler).__name__} failed")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        キューに追加済みのイベントの処理が完了するまで待機する
+
+        Returns:
+            bool: timeout以内に完了した場合はTrue
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._unfinished > 0:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """キューに残ったイベントを処理してワーカーを停止する（以降のイベントは呼び出し元のスレッドで処理する）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout if timeout is not None else self.flush_timeout)
+        _handlers.discard(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "queue_length": len(self._queue),
+            "max_queue_length": self.max_queue_length,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "errors": self.errors,
+            "blocked_time": self.blocked_time,
+        }
+
+
+@atexit.register
+def _flush_all():
+    for handler in list(_handlers):
+        handler.close()
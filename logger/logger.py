@@ -1,11 +1,16 @@
-from dataclasses import dataclass, field, asdict, replace
-from typing import Dict, Any, Optional, Union, List, TypeVar, Mapping, Tuple, Set, FrozenSet
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Any, Optional, Union, List, TypeVar, Callable, Mapping, Tuple, Set, FrozenSet
 from abc import ABC, abstractmethod
 from types import MappingProxyType
 from contextlib import contextmanager
 from enum import Enum
 from uuid import uuid4
 from datetime import datetime
+import contextvars
+import functools
+import itertools
+import threading
+import time
 
 from logger.exceptions import *
 
@@ -20,6 +25,7 @@ class LogType(Enum):
     EVENT = "event"
 
 T = TypeVar('T', bound='LogRecord')
+R = TypeVar('R')
 
 @dataclass(frozen=True)
 class LogRecord(ABC):
@@ -83,9 +89,10 @@ class LogRecord(ABC):
         return self.create_new(metadata=new_metadata)
     
     def to_dict(self) -> Dict[str, Any]:
-        return {k: (dict(v) if isinstance(v, MappingProxyType) else 
-                    (list(v) if isinstance(v, frozenset) else v))
-                for k, v in asdict(self).items()}
+        # asdictはMappingProxyTypeを複製できない為、フィールドを直接参照する
+        return {f.name: (dict(v) if isinstance(v, MappingProxyType) else 
+                         (list(v) if isinstance(v, frozenset) else v))
+                for f in fields(self) for v in (getattr(self, f.name),)}
             
     def create_new(self: T, **changes) -> T:
         return replace(self, **changes)
@@ -188,12 +195,113 @@ class EventRecord(InstantLogRecord):
         return LogType.EVENT
 
 
+_RECORD_CLASSES: Dict[LogType, type] = {
+    LogType.TRACE: TraceRecord,
+    LogType.ACTION: ActionRecord,
+    LogType.SPAN: SpanRecord,
+    LogType.EVENT: EventRecord,
+}
+
+_EMPTY_METADATA: MappingProxyType = MappingProxyType({})
+
+# レコードのID（uuid4の生成を避ける為、プロセスごとの接頭辞と単調増加する番号を使用する）
+_uid_prefix = uuid4().hex[:12]
+_uid_counter = itertools.count(1)
+
+
+def _next_uid() -> str:
+    return f"{_uid_prefix}-{next(_uid_counter)}"
+
+
+def _build_record(log_type: LogType, fields: Dict[str, Any]) -> LogRecord:
+    """
+    __init__と__post_init__を経由せずにレコードを作成する
+    
+    fieldsのtagはfrozenset、metadataはMappingProxyType、childrenはtupleである必要がある
+    """
+    record = object.__new__(_RECORD_CLASSES[log_type])
+    record.__dict__.update(fields)
+    return record
+
+
+class _OpenEntry():
+    """
+    開始から終了までの間のtrace/action/span（LogSystemの内部でのみ使用する）
+
+    input, outputなどの更新の度に新しいレコードを作成せず、このオブジェクトを直接変更する
+    ハンドラーに渡すレコード（イミュータブルなスナップショット）は、ハンドラーに渡す時に作成し、次に変更されるまで再利用する
+    """
+    __slots__ = (
+        "log_type", "uid", "name", "tag", "metadata", "parent", "children", "timestamp",
+        "input", "output", "feedback", "start_time", "end_time", "_snapshot", "log_overhead",
+    )
+
+    def __init__(
+        self,
+        log_type: LogType,
+        name: str,
+        tag: Union[Set[str], FrozenSet[str]],
+        metadata: Mapping[str, MetadataValueType],
+        parent: Optional[uuidv4_str],
+    ):
+        now = time.time()
+        self.log_type = log_type
+        self.uid = _next_uid()
+        self.name = name
+        self.tag = tag if isinstance(tag, frozenset) else frozenset(tag)
+        self.metadata = MappingProxyType(dict(metadata)) if metadata else _EMPTY_METADATA
+        self.parent = parent
+        self.children: List[uuidv4_str] = []
+        self.timestamp = now
+        self.input = ""
+        self.output = ""
+        self.feedback = ""
+        self.start_time = datetime.fromtimestamp(now)
+        self.end_time: Optional[datetime] = None
+        self._snapshot: Optional[LogRecord] = None
+        self.log_overhead = 0.0  # ルートのエントリの場合、その木のログの記録に費やした時間[s]
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            if key not in ("input", "output", "feedback"):
+                raise InvalidLogOperationError(key, self.log_type.value)
+            setattr(self, key, value)
+        self._snapshot = None
+
+    def add_child(self, uid: uuidv4_str):
+        self.children.append(uid)
+        self._snapshot = None
+
+    def end(self):
+        self.end_time = datetime.now()
+        self._snapshot = None
+
+    def snapshot(self) -> LogRecord:
+        if self._snapshot is None:
+            self._snapshot = _build_record(self.log_type, {
+                "name": self.name,
+                "tag": self.tag,
+                "metadata": self.metadata,
+                "parent": self.parent,
+                "children": tuple(self.children),
+                "timestamp": self.timestamp,
+                "uid": self.uid,
+                "input": self.input,
+                "output": self.output,
+                "feedback": self.feedback,
+                "start_time": self.start_time,
+                "end_time": self.end_time,
+            })
+        return self._snapshot
+
+
 class LogEntryContext():
     def __init__(self, log_system: 'LLMRobotPlannerLogSystem', 
-                 uid: str, log_type: LogType):
+                 uid: str, log_type: LogType, entry: Optional[_OpenEntry] = None):
         self._log_system: LLMRobotPlannerLogSystem = log_system
         self._uid: str = uid
         self._log_type: LogType = log_type
+        self._entry: Optional[_OpenEntry] = entry
 
     @property
     def uid(self) -> str:
@@ -224,7 +332,11 @@ class LogEntryContext():
             raise InvalidLogOperationError("context", self._log_type.value)
 
     def _update(self, **kwargs):
-        self._log_system._update_current_entry(**kwargs)
+        if self._entry is not None:
+            # スタックの先頭ではなく、このコンテキストのエントリを更新する
+            self._log_system._update_entry(self._entry, **kwargs)
+        else:
+            self._log_system._update_current_entry(**kwargs)
         
         
 class Handler(ABC):
@@ -247,11 +359,53 @@ class NonRealTimeHandler(Handler):
     def is_realtime(self) -> bool:
         return False
     
+# 開始済みで終了していないエントリのスタック
+# スレッドやasyncioのタスクごとに独立させる為、コンテキスト変数にイミュータブルなtupleとして保持する
+_log_stack: contextvars.ContextVar[Tuple[_OpenEntry, ...]] = contextvars.ContextVar("log_stack", default=())
+
+
+class LogContext():
+    """
+    LLMRobotPlannerLogSystem.capture()で取得したログのスタック
+    
+    別のスレッドでattach()すると、そのスレッドで開始したエントリの親が取得した時点のエントリになる
+    """
+    __slots__ = ("_stack",)
+
+    def __init__(self, stack: Tuple[_OpenEntry, ...]):
+        self._stack = stack
+
+    @property
+    def uid(self) -> Optional[uuidv4_str]:
+        """取得した時点で最も内側のエントリのUID（エントリが無い場合はNone）"""
+        return self._stack[-1].uid if self._stack else None
+
+
+def _add_overhead(stack: Tuple[_OpenEntry, ...], elapsed: float):
+    """ログの記録に費やした時間を、プロセス全体の累計とスタックのルートのエントリ（ジョブ）に加算する"""
+    LLMRobotPlannerLogSystem._overhead += elapsed
+    if stack:
+        stack[0].log_overhead += elapsed
+
+
 class LLMRobotPlannerLogSystem():
+    """
+    ログの記録を行うクラス（シングルトン）
+
+    エントリの親子関係はコンテキスト変数で管理する為、スレッドやasyncioのタスクごとに独立している
+    新しいスレッドは親のエントリを引き継がない為、ワーカースレッドで実行する処理の親を設定する場合は
+    bind()でラップするか、capture()で取得したLogContextをattach()する
+
+    Example:
+        with log.span("タスク"):
+            future = executor.submit(log.bind(work), arg)  # workの中のspanは"タスク"の子になる
+    """
 
     _instance = None  # singleton
     _handlers: List[Handler] = []
-    _log_stack: List[LogRecord] = []
+    _realtime_handlers: List[Handler] = []
+    _handlers_lock = threading.Lock()
+    _overhead: float = 0.0  # ログの記録（ハンドラーの処理を含む）に費やした累積時間[s]
     
     def __new__(cls):
         if cls._instance is None:
@@ -260,10 +414,56 @@ class LLMRobotPlannerLogSystem():
     
 
     def add_handler(self, handler: Handler):
-        self._handlers.append(handler)
+        # ハンドラーのリストは置き換えて更新する為、イベントの処理中に他のスレッドが変更しても影響しない
+        with self._handlers_lock:
+            self._set_handlers(self._handlers + [handler])
     
     def remove_handler(self, handler: Handler):
-        self._handlers.remove(handler)
+        with self._handlers_lock:
+            handlers = list(self._handlers)
+            handlers.remove(handler)
+            self._set_handlers(handlers)
+
+    def _set_handlers(self, handlers: List[Handler]):
+        LLMRobotPlannerLogSystem._realtime_handlers = [h for h in handlers if h.is_realtime]
+        LLMRobotPlannerLogSystem._handlers = handlers
+
+    def current_uid(self) -> Optional[uuidv4_str]:
+        """現在のコンテキストで最も内側のエントリのUID（エントリが無い場合はNone）"""
+        stack = _log_stack.get()
+        return stack[-1].uid if stack else None
+
+    def capture(self) -> LogContext:
+        """現在のコンテキストのログのスタックを取得する"""
+        return LogContext(_log_stack.get())
+
+    @contextmanager
+    def attach(self, context: LogContext):
+        """ブロックの中で開始したエントリの親を、contextを取得した時点のエントリにする"""
+        token = _log_stack.set(context._stack)
+        try:
+            yield
+        finally:
+            _log_stack.reset(token)
+
+    def bind(self, fn: Callable[..., R]) -> Callable[..., R]:
+        """
+        呼び出した時点のログのスタックを引き継いでfnを実行する関数を返す
+        
+        ThreadPoolExecutor.submitなど、別のスレッドで実行する関数に使用する
+        """
+        context = self.capture()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.attach(context):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    @property
+    def overhead(self) -> float:
+        """ログの記録に費やした累積時間[s]（プロセス全体、ジョブごとの時間はルートのENDのchanges["log_overhead"]）"""
+        return self._overhead
     
     def event(
         self, 
@@ -287,16 +487,16 @@ class LLMRobotPlannerLogSystem():
         tag: Union[FrozenSet[str], Set[str]] = frozenset(),
         metadata: Dict[str, MetadataValueType] = {}
     ):
-        uid = self._begin_log_entry(LogType.TRACE, name, tag, metadata)
-        context = LogEntryContext(self, uid, LogType.TRACE)
+        entry = self._begin_log_entry(LogType.TRACE, name, tag, metadata)
+        context = LogEntryContext(self, entry.uid, LogType.TRACE, entry)
         try:
             yield context
         except Exception as e:
             # TODO: Errorのログの記録方法を変える
-            self._update_current_entry(feedback=str(e))
+            self._update_entry(entry, feedback=str(e))
             raise e
         finally:
-            self._end_log_entry()
+            self._end_log_entry(entry.uid)
     
     @contextmanager
     def action(
@@ -305,16 +505,16 @@ class LLMRobotPlannerLogSystem():
         tag: Union[FrozenSet[str], Set[str]] = frozenset(),
         metadata: Dict[str, MetadataValueType] = {}
     ):
-        uid = self._begin_log_entry(LogType.ACTION, name, tag, metadata)
-        context = LogEntryContext(self, uid, LogType.ACTION)
+        entry = self._begin_log_entry(LogType.ACTION, name, tag, metadata)
+        context = LogEntryContext(self, entry.uid, LogType.ACTION, entry)
         try:
             yield context
         except Exception as e:
             # TODO: Errorのログの記録方法を変える
-            self._update_current_entry(feedback=str(e))
+            self._update_entry(entry, feedback=str(e))
             raise e
         finally:
-            self._end_log_entry()
+            self._end_log_entry(entry.uid)
     
     @contextmanager
     def span(
@@ -323,68 +523,118 @@ class LLMRobotPlannerLogSystem():
         tag: Union[FrozenSet[str], Set[str]] = frozenset(),
         metadata: Dict[str, MetadataValueType] = {}
     ):
-        uid = self._begin_log_entry(LogType.SPAN, name, tag, metadata)
-        context = LogEntryContext(self, uid, LogType.SPAN)
+        entry = self._begin_log_entry(LogType.SPAN, name, tag, metadata)
+        context = LogEntryContext(self, entry.uid, LogType.SPAN, entry)
         try:
             yield context
         except Exception as e:
             # TODO: Errorのログの記録方法を変える
-            self._update_current_entry(feedback=str(e))
+            self._update_entry(entry, feedback=str(e))
             raise e
         finally:
-            self._end_log_entry()
-    
+            self._end_log_entry(entry.uid)
     
-    def _begin_log_entry(self, log_type: LogType, *args, **kwargs):
-        parent = self._log_stack[-1].uid if self._log_stack else None
-        
-        record = self._create_record(log_type, *args, **kwargs, parent=parent)
-        if self._log_stack:
-            self._log_stack[-1] = self._log_stack[-1].with_child(record.uid)
-        self._log_stack.append(record)
-        event = LogEvent(LogEventType.BEGIN, record)
-        self._process_handler(event, realtime=True)
-        return record.uid
     
-    def _end_log_entry(self, uid=None):        
-        if uid is None:
-            record = self._log_stack.pop(-1)
-            if isinstance(record, DurationLogRecord):
-                updated_record = record.with_end_time()
-                event = LogEvent(LogEventType.END, updated_record, record, {"end_time": updated_record.end_time})
-            else:
-                event = LogEvent(LogEventType.END, record)
-            self._process_handler(event)
-        else:
-            for i, record in enumerate(reversed(self._log_stack)):
-                if record.uid == uid:
-                    index = len(self._log_stack) - i - 1
-                    break
+    def _begin_log_entry(
+        self,
+        log_type: LogType,
+        name: str,
+        tag: Union[FrozenSet[str], Set[str]] = frozenset(),
+        metadata: Mapping[str, MetadataValueType] = _EMPTY_METADATA,
+    ) -> _OpenEntry:
+        start = time.perf_counter()
+        try:
+            stack = _log_stack.get()
+            parent = stack[-1] if stack else None
+            entry = _OpenEntry(log_type, name, tag, metadata, parent.uid if parent is not None else None)
+            if parent is not None:
+                parent.add_child(entry.uid)
+            _log_stack.set(stack + (entry,))
+            if self._realtime_handlers:
+                self._process_handler(LogEvent(LogEventType.BEGIN, entry.snapshot()), realtime=True)
+            return entry
+        finally:
+            _add_overhead(_log_stack.get(), time.perf_counter() - start)
+
+    def _end_log_entry(self, uid=None):
+        start = time.perf_counter()
+        stack = _log_stack.get()
+        try:
+            if uid is None:
+                index = len(stack) - 1
             else:
-                return
-            while len(self._log_stack) > index:
-                record = self._log_stack.pop(-1)
-                if isinstance(record, DurationLogRecord):
-                    updated_record = record.with_end_time()
-                    event = LogEvent(LogEventType.END, updated_record, record, {"end_time": updated_record.end_time})
+                for index in range(len(stack) - 1, -1, -1):
+                    if stack[index].uid == uid:
+                        break
                 else:
-                    event = LogEvent(LogEventType.END, record)
-                self._process_handler(event)
-            
+                    return
+            if index < 0:
+                return
+            _log_stack.set(stack[:index])
+            # uidのエントリより後に開始して終了していないエントリも終了する
+            for entry in reversed(stack[index:]):
+                self._emit_end(entry)
+        finally:
+            _add_overhead(stack, time.perf_counter() - start)
+
+    def _emit_end(self, entry: _OpenEntry):
+        previous_record = entry._snapshot
+        entry.end()
+        if self._handlers:
+            record = entry.snapshot()
+            changes: Dict[str, Any] = {"end_time": entry.end_time}
+            if entry.parent is None:
+                # ルートの場合はジョブのログの記録に費やした時間を渡す（ProfilerHandlerが使用する）
+                changes["log_overhead"] = entry.log_overhead
+            self._process_handler(LogEvent(LogEventType.END, record, previous_record, changes))
+
+    def _update_entry(self, entry: _OpenEntry, **kwargs):
+        start = time.perf_counter()
+        try:
+            previous_record = entry._snapshot
+            entry.update(**kwargs)
+            if self._realtime_handlers:
+                self._process_handler(LogEvent(LogEventType.UPDATE, entry.snapshot(), previous_record, kwargs), realtime=True)
+        finally:
+            _add_overhead(_log_stack.get(), time.perf_counter() - start)
+
     def _update_current_entry(self, **kwargs):
-        if self._log_stack:
-            previous_record = self._log_stack[-1]
-            updated_record = previous_record.create_new(**kwargs)
-            self._log_stack[-1] = updated_record
-            event = LogEvent(LogEventType.UPDATE, updated_record, previous_record, kwargs)
-            self._process_handler(event, realtime=True)
-                    
-    def _log_instant_entry(self, log_type: LogType, *args, **kwargs) -> uuidv4_str:
-        parent = self._log_stack[-1].uid if self._log_stack else None
-        record = self._create_record(log_type, *args, **kwargs, parent=parent)
-        log_event = LogEvent(LogEventType.END, record)
-        self._process_handler(log_event)
-        return record.uid
+        stack = _log_stack.get()
+        if stack:
+            self._update_entry(stack[-1], **kwargs)
+
+    def _log_instant_entry(
+        self,
+        log_type: LogType,
+        name: str,
+        context: Optional[str] = None,
+        tag: Union[FrozenSet[str], Set[str]] = frozenset(),
+        metadata: Mapping[str, MetadataValueType] = _EMPTY_METADATA,
+    ) -> uuidv4_str:
+        start = time.perf_counter()
+        try:
+            stack = _log_stack.get()
+            parent = stack[-1] if stack else None
+            uid = _next_uid()
+            record = _build_record(log_type, {
+                "name": name,
+                "tag": tag if isinstance(tag, frozenset) else frozenset(tag),
+                "metadata": MappingProxyType(dict(metadata)) if metadata else _EMPTY_METADATA,
+                "parent": parent.uid if parent is not None else None,
+                "children": (),
+                "timestamp": time.time(),
+                "uid": uid,
+                "context": context or "",
+            })
+            # _build_recordは__post_init__を経由しない為、InstantLogRecordと同じ型の検証を親に追加する前に行う
+            record._validate_types()
+            if parent is not None:
+                parent.add_child(uid)
+            if self._handlers:
+                self._process_handler(LogEvent(LogEventType.END, record))
+            return uid
+        finally:
+            _add_overhead(_log_stack.get(), time.perf_counter() - start)
     
     def _create_record(self, log_type: LogType, *args, **kwargs) -> LogRecord:
         if log_type == LogType.TRACE:
@@ -399,8 +649,5 @@ class LLMRobotPlannerLogSystem():
             raise ValueError(f"Unknown log type: {log_type}")
         
     def _process_handler(self, event: LogEvent, realtime: bool = False):
-        for handler in self._handlers:
-            if realtime and handler.is_realtime:
-                handler.handle(event)
-            elif not realtime:
-                handler.handle(event)
+        for handler in (self._realtime_handlers if realtime else self._handlers):
+            handler.handle(event)
@@ -0,0 +1,325 @@
+"""
+ログのtrace/action/spanの木構造から、ジョブごとの処理時間の内訳を集計するハンドラー
+
+ルートのtrace（LLMRobotPlanner.processが開始するジョブ）が終了した時点で、
+    - 各レコードの自己時間（子のレコードを除いた時間）
+    - カテゴリ（llm, rag, db, command など）ごとの自己時間
+    - ログの記録自体に費やした時間（ルートのENDのchanges["log_overhead"]、ジョブごとに計測する）
+を集計したJobProfileを作成し、自己時間の上位N件を表示する
+JobProfileはspeedscope（https://www.speedscope.app）とChromeのtrace event形式（chrome://tracing, Perfetto）で出力できる
+
+カテゴリはレコードのtagのうちcategoriesに含まれるものを使用し、含まれない場合は親のカテゴリを引き継ぐ
+（ルートまでカテゴリが無い場合はdefault_category）
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import deque
+import json
+import os
+import re
+import threading
+
+from logger.logger import (
+    RealTimeHandler, LogEvent, LogEventType, LogType,
+    LogRecord, DurationLogRecord
+)
+
+DEFAULT_CATEGORIES = ("llm", "rag", "db", "command")
+
+
+@dataclass
+class ProfileNode():
+    """
+    プロファイルの1つのフレーム（trace/action/spanのレコード、またはイベント）
+
+    start, endはUNIX時間[s]、イベントの場合はstart == end
+    """
+    uid: str
+    name: str
+    log_type: LogType
+    category: str
+    start: float
+    end: Optional[float] = None
+    children: List['ProfileNode'] = field(default_factory=list)
+
+    @property
+    def is_instant(self) -> bool:
+        return self.log_type == LogType.EVENT
+
+    @property
+    def total(self) -> float:
+        if self.end is None:
+            return 0.0
+        return max(0.0, self.end - self.start)
+
+    @property
+    def self_time(self) -> float:
+        # 並行して実行された子（ヘッジしたリクエストなど）の合計が親を超える場合は0とする
+        return max(0.0, self.total - sum(c.total for c in self.children))
+
+    def walk(self, depth: int = 0) -> Iterable[Tuple['ProfileNode', int]]:
+        yield self, depth
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+@dataclass
+class FrameStats():
+    """同じ名前とカテゴリのフレームを集計した結果"""
+    name: str
+    category: str
+    calls: int = 0
+    total: float = 0.0
+    self_time: float = 0.0
+
+
+@dataclass
+class JobProfile():
+    """
+    1つのジョブ（ルートのレコード）のプロファイル
+
+    Attributes:
+        root: ProfileNode ルートのフレーム
+        log_overhead: float ジョブのログの記録に費やした時間[s]（各フレームの自己時間に含まれる為、カテゴリには加えない）
+    """
+    root: ProfileNode
+    log_overhead: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def wall(self) -> float:
+        return self.root.total
+
+    def frames(self) -> List[FrameStats]:
+        """フレームを名前とカテゴリごとに集計し、自己時間の降順で返す"""
+        stats: Dict[Tuple[str, str], FrameStats] = {}
+        for node, _ in self.root.walk():
+            if node.is_instant:
+                continue
+            s = stats.setdefault((node.name, node.category), FrameStats(node.name, node.category))
+            s.calls += 1
+            s.total += node.total
+            s.self_time += node.self_time
+        return sorted(stats.values(), key=lambda s: s.self_time, reverse=True)
+
+    def by_category(self) -> Dict[str, float]:
+        """カテゴリごとの自己時間[s]（合計はwall以下、ログの記録の時間は各カテゴリに含まれる）"""
+        result: Dict[str, float] = {}
+        for node, _ in self.root.walk():
+            if not node.is_instant:
+                result[node.category] = result.get(node.category, 0.0) + node.self_time
+        return dict(sorted(result.items(), key=lambda kv: kv[1], reverse=True))
+
+    def format_summary(self, top_n: int = 10) -> str:
+        wall = self.wall or 1e-12
+        lines = [f"[profile] {self.name}  wall: {self.wall * 1e3:.2f}ms"]
+        lines.append("  category        self[ms]      %")
+        for category, t in self.by_category().items():
+            lines.append(f"  {category:<12}{t * 1e3:>12.2f}{t / wall * 100:>7.1f}")
+        lines.append(f"  (うちlogging){self.log_overhead * 1e3:>12.2f}{self.log_overhead / wall * 100:>7.1f}")
+        lines.append(f"  top {top_n} (self time)  calls    self[ms]   total[ms]  name")
+        for s in self.frames()[:top_n]:
+            lines.append(f"  {s.category:<18}{s.calls:>6}{s.self_time * 1e3:>12.2f}{s.total * 1e3:>12.2f}  {s.name}")
+        return "\n".join(lines)
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        """speedscopeのevented profile形式に変換する"""
+        frames: List[Dict[str, str]] = []
+        frame_index: Dict[Tuple[str, str], int] = {}
+        events: List[Dict[str, Any]] = []
+        origin = self.root.start
+
+        def frame_of(node: ProfileNode) -> int:
+            key = (node.name, node.category)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": node.name, "file": node.category})
+            return frame_index[key]
+
+        def emit(node: ProfileNode, lower: float, upper: float):
+            # speedscopeはフレームが正しく入れ子になっている必要がある為、子の区間を親の区間内に収める
+            start = min(max(node.start, lower), upper)
+            end = min(max(node.end if node.end is not None else upper, start), upper)
+            frame = frame_of(node)
+            events.append({"type": "O", "frame": frame, "at": start - origin})
+            cursor = start
+            for child in sorted((c for c in node.children if not c.is_instant), key=lambda c: c.start):
+                cursor = emit(child, max(cursor, start), end)
+            events.append({"type": "C", "frame": frame, "at": end - origin})
+            return end
+
+        emit(self.root, self.root.start, self.root.end if self.root.end is not None else self.root.start)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "evented",
+                "name": self.name,
+                "unit": "seconds",
+                "startValue": 0.0,
+                "endValue": self.wall,
+                "events": events,
+            }],
+            "name": self.name,
+            "activeProfileIndex": 0,
+            "exporter": "llm-robot-planning ProfilerHandler",
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Chromeのtrace event形式（chrome://tracing, Perfetto）に変換する"""
+        events: List[Dict[str, Any]] = []
+        for node, depth in self.root.walk():
+            ts = node.start * 1e6
+            if node.is_instant:
+                events.append({"name": node.name, "cat": node.category, "ph": "i", "s": "t", "ts": ts, "pid": 1, "tid": 1})
+            else:
+                args = {"type": node.log_type.value, "self_ms": node.self_time * 1e3, "depth": depth}
+                if node is self.root:
+                    args["log_overhead_ms"] = self.log_overhead * 1e3
+                events.append({
+                    "name": node.name, "cat": node.category, "ph": "X", "ts": ts, "dur": node.total * 1e6,
+                    "pid": 1, "tid": 1, "args": args,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "wall": self.wall,
+            "log_overhead": self.log_overhead,
+            "by_category": self.by_category(),
+            "frames": [s.__dict__ for s in self.frames()],
+        }
+
+
+class ProfilerHandler(RealTimeHandler):
+    """
+    ジョブごとのJobProfileを作成するハンドラー
+
+    Args:
+        top_n: int ジョブの終了時に表示する自己時間の上位の件数
+        print_summary: bool ジョブの終了時に集計結果を表示するか
+        output_dir: Optional[str] 指定した場合はジョブごとにspeedscope, Chrome trace形式のファイルを出力する
+        formats: Tuple[str, ...] 出力する形式（"speedscope", "chrome"）
+        root_types: Tuple[LogType, ...] ジョブとして扱うルートのレコードの種類
+        categories: Tuple[str, ...] カテゴリとして扱うtag
+        default_category: str カテゴリが無いフレームのカテゴリ
+        max_profiles: Optional[int] 保持するJobProfileの最大数（古いものから破棄する、Noneの場合は無制限）
+    """
+    def __init__(
+        self,
+        top_n: int = 10,
+        print_summary: bool = True,
+        output_dir: Optional[str] = None,
+        formats: Tuple[str, ...] = ("speedscope", "chrome"),
+        root_types: Tuple[LogType, ...] = (LogType.TRACE,),
+        categories: Tuple[str, ...] = DEFAULT_CATEGORIES,
+        default_category: str = "planner",
+        max_profiles: Optional[int] = 100,
+    ):
+        self.top_n = top_n
+        self.print_summary = print_summary
+        self.output_dir = output_dir
+        self.formats = formats
+        self.root_types = root_types
+        self.categories = categories
+        self.default_category = default_category
+        self.profiles: deque = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+        self._open: Dict[str, ProfileNode] = {}
+        self._roots: Dict[str, ProfileNode] = {}  # uid -> ルートのフレーム
+
+    def handle(self, log: LogEvent):
+        if log.event_type == LogEventType.UPDATE:
+            return
+        with self._lock:
+            if log.event_type == LogEventType.BEGIN:
+                self._begin(log.record)
+            elif log.event_type == LogEventType.END:
+                profile = self._end(log)
+            else:
+                return
+        if log.event_type == LogEventType.END and profile is not None:
+            self._on_job_end(profile)
+
+    def _category(self, record: LogRecord, parent: Optional[ProfileNode]) -> str:
+        for category in self.categories:
+            if category in record.tag:
+                return category
+        return parent.category if parent is not None else self.default_category
+
+    def _begin(self, record: LogRecord):
+        if not isinstance(record, DurationLogRecord):
+            return
+        parent = self._open.get(record.parent) if record.parent is not None else None
+        if record.parent is not None and parent is None:
+            return  # ハンドラーの登録前に開始したジョブのレコードは集計しない
+        if record.parent is None and record.type not in self.root_types:
+            return
+        node = ProfileNode(
+            uid=record.uid,
+            name=record.name,
+            log_type=record.type,
+            category=self._category(record, parent),
+            start=record.start_time.timestamp(),
+        )
+        self._open[record.uid] = node
+        if parent is not None:
+            parent.children.append(node)
+        else:
+            self._roots[record.uid] = node
+
+    def _end(self, log: LogEvent) -> Optional[JobProfile]:
+        record = log.record
+        if not isinstance(record, DurationLogRecord):
+            # イベントは親のフレームに時刻のみを記録する
+            parent = self._open.get(record.parent) if record.parent is not None else None
+            if parent is not None:
+                parent.children.append(ProfileNode(
+                    uid=record.uid, name=record.name, log_type=record.type,
+                    category=self._category(record, parent), start=record.timestamp, end=record.timestamp
+                ))
+            return None
+        node = self._open.pop(record.uid, None)
+        if node is None:
+            return None
+        node.end = record.end_time.timestamp() if record.end_time is not None else node.start
+        if record.uid not in self._roots:
+            return None
+        root = self._roots.pop(record.uid)
+        # 並行して実行されたジョブのログの記録を含めない為、プロセス全体の累計ではなくジョブごとの値を使用する
+        overhead = (log.changes or {}).get("log_overhead", 0.0)
+        return JobProfile(root=root, log_overhead=overhead)
+
+    def _on_job_end(self, profile: JobProfile):
+        self.profiles.append(profile)
+        if self.print_summary:
+            print(profile.format_summary(self.top_n))
+        if self.output_dir is not None:
+            self.export(profile, self.output_dir, self.formats)
+
+    @staticmethod
+    def export(profile: JobProfile, output_dir: str, formats: Tuple[str, ...] = ("speedscope", "chrome")) -> List[str]:
+        """
+        JobProfileをファイルに出力する
+
+        Returns:
+            List[str]: 出力したファイルのパス
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        base = f"{int(profile.root.start * 1000)}_{re.sub(r'[^0-9A-Za-z_-]+', '_', profile.name).strip('_') or 'job'}"
+        paths = []
+        for fmt in formats:
+            if fmt == "speedscope":
+                data, path = profile.to_speedscope(), os.path.join(output_dir, f"{base}.speedscope.json")
+            elif fmt == "chrome":
+                data, path = profile.to_chrome_trace(), os.path.join(output_dir, f"{base}.trace.json")
+            else:
+                raise ValueError(f"unknown profile format: {fmt}")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            paths.append(path)
+        return paths
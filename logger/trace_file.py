@@ -0,0 +1,571 @@
+"""
+ログのイベントを長さ付きのバイナリ形式でファイルに記録するハンドラーと、記録したファイルを再生するリーダー
+
+フィールドでの実行のログをメモリに保持せずに残し、後からLoggingGUIHandlerやProfilerHandlerに再生して分析する為に使用する
+
+Example:
+    # 記録（GUIなどと同様に、プランニングを遅くしないようにAsyncHandlerでラップする）
+    log_system.add_handler(AsyncHandler(TraceFileHandler("logs/trace.lrpt", max_bytes=64 * 1024 * 1024)))
+
+    # 再生（ローテーションしたファイルも古い順に読み込む）
+    TraceReader("logs/trace.lrpt").replay([ProfilerHandler()])
+
+    # コマンドライン（リポジトリのルートで実行）
+    python -m logger.trace_file stats logs/trace.lrpt
+    python -m logger.trace_file profile logs/trace.lrpt [--output DIR]
+    python -m logger.trace_file dump logs/trace.lrpt > trace.jsonl
+    python -m logger.trace_file merge logs/merged.lrpt logs/worker-1.lrpt logs/worker-2.lrpt
+
+ファイルの形式:
+    ヘッダー: b"LRPT" + バージョン（1バイト） + コーデック（1バイト、0: JSON, 1: msgpack）
+    エントリ: ペイロードの長さ（4バイト、リトルエンディアン） + ペイロード
+    msgpackがインストールされている場合はmsgpack、無い場合はJSON（UTF-8）でペイロードをエンコードする
+
+エントリ（ペイロードは配列、時刻はUNIX時間[s]）:
+    ["b", type, uid, name, tag, metadata, parent, timestamp, start_time]  BEGIN
+    ["u", uid, time, changes]                                            UPDATE（変更されたフィールドのみ）
+    ["e", uid, end_time(, log_overhead)]                                  END（trace/action/span、log_overheadはルートのみ）
+    ["i", type, uid, name, tag, metadata, parent, timestamp, context]     イベント（END）
+    ["s", type, uid, name, tag, metadata, parent, timestamp, start_time, input, output, feedback, children]
+        ローテーションの時点で終了していないレコードの状態（各ファイルを単独で再生できるように、新しいファイルの先頭に記録する）
+
+childrenは子のBEGINから復元できる為、BEGIN/UPDATEには記録しない
+"""
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime
+from types import MappingProxyType
+import argparse
+import atexit
+import heapq
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import weakref
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+from logger.logger import (
+    RealTimeHandler, Handler, LogEvent, LogEventType, LogType, LogRecord, DurationLogRecord,
+    _build_record, _EMPTY_METADATA
+)
+
+import logging
+logger = logging.getLogger("LLMRobotPlannerLogSystem")
+
+MAGIC = b"LRPT"
+VERSION = 1
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+
+_HEADER = struct.Struct("<4sBB")
+_LENGTH = struct.Struct("<I")
+
+_TYPE_CODES: Dict[LogType, int] = {LogType.TRACE: 0, LogType.ACTION: 1, LogType.SPAN: 2, LogType.EVENT: 3}
+_CODE_TYPES: Dict[int, LogType] = {v: k for k, v in _TYPE_CODES.items()}
+
+_handlers: "weakref.WeakSet[TraceFileHandler]" = weakref.WeakSet()
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+def _encoder(codec: int):
+    if codec == CODEC_MSGPACK:
+        return msgpack.Packer(use_bin_type=True, default=str).pack
+    # bytesなどJSONで表現できないメタデータの値は文字列にする
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str).encode
+    return lambda payload: dumps(payload).encode("utf-8")
+
+
+def _decoder(codec: int):
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise TraceFormatError("this trace file is encoded with msgpack, but msgpack is not installed")
+        return lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if codec == CODEC_JSON:
+        return lambda data: json.loads(data.decode("utf-8"))
+    raise TraceFormatError(f"unknown codec: {codec}")
+
+
+def _ts(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value is not None else None
+
+
+def _entry_time(entry: list) -> Optional[float]:
+    """エントリの時刻（BEGINと状態は開始時刻）"""
+    kind = entry[0]
+    if kind in ("u", "e"):
+        return entry[2]
+    return entry[7] if kind == "i" else entry[8]
+
+
+def rotated_files(path: str) -> List[str]:
+    """pathとローテーションしたファイル（path.1, path.2, ...）を古い順に返す"""
+    backups = []
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        backups.append(f"{path}.{n}")
+        n += 1
+    files = list(reversed(backups))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+class TraceFileHandler(RealTimeHandler):
+    """
+    LogEventをファイルに追記するハンドラー
+
+    Args:
+        path: str 記録するファイルのパス（既存のファイルには追記する）
+        max_bytes: Optional[int] ファイルのサイズがこれを超えた場合にローテーションする（Noneの場合はサイズでローテーションしない）
+        max_age: Optional[float] ファイルを開いてからこの時間[s]が経過した場合にローテーションする
+        backup_count: int 保持するローテーション済みのファイルの数（path.1が最も新しい）
+        codec: Optional[str] "msgpack"または"json"（Noneの場合はmsgpackがインストールされていればmsgpack）
+        flush_interval: float 最後にディスクに書き出してからこの時間[s]が経過した場合に書き出す
+            ルートのレコード（ジョブ）の終了時とclose()の時には常に書き出す
+    """
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        max_age: Optional[float] = None,
+        backup_count: int = 5,
+        codec: Optional[str] = None,
+        flush_interval: float = 1.0,
+    ):
+        if codec is None:
+            codec = "msgpack" if msgpack is not None else "json"
+        if codec not in ("msgpack", "json"):
+            raise ValueError(f"unknown codec: {codec}")
+        if codec == "msgpack" and msgpack is None:
+            raise ImportError("msgpack is not installed (pip install msgpack)")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._codec = CODEC_MSGPACK if codec == "msgpack" else CODEC_JSON
+        self._encode = _encoder(self._codec)
+
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._last_flush = 0.0
+        # 終了していないレコード（ローテーション時に状態を記録する為に保持する）: uid -> (最新のレコード, 子のUID)
+        self._open: Dict[str, Tuple[LogRecord, List[str]]] = {}
+
+        # 統計
+        self.events_written = 0
+        self.bytes_written = 0
+        self.rotations = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._open_file()
+        _handlers.add(self)
+
+    def handle(self, log: LogEvent):
+        payload, is_root_end = self._payload(log)
+        with self._lock:
+            self._track(log)
+            if self._file is None:
+                # close()の後のイベント（終了時に他のハンドラーから遅れて届いたもの）は1件ずつ追記する
+                with open(self.path, "ab") as f:
+                    f.write(_LENGTH.pack(len(payload)) + payload)
+                return
+            if self._should_rotate():
+                self._rotate()
+            self._write(payload)
+            now = time.monotonic()
+            if is_root_end or now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def _payload(self, log: LogEvent) -> Tuple[bytes, bool]:
+        record = log.record
+        if log.event_type == LogEventType.BEGIN:
+            return self._encode([
+                "b", _TYPE_CODES[record.type], record.uid, record.name, sorted(record.tag), dict(record.metadata),
+                record.parent, record.timestamp, _ts(record.start_time),
+            ]), False
+        if log.event_type == LogEventType.UPDATE:
+            return self._encode(["u", record.uid, time.time(), dict(log.changes or {})]), False
+        if isinstance(record, DurationLogRecord):
+            entry = ["e", record.uid, _ts(record.end_time)]
+            if log.changes and "log_overhead" in log.changes:
+                entry.append(log.changes["log_overhead"])
+            return self._encode(entry), record.parent is None
+        return self._encode([
+            "i", _TYPE_CODES[record.type], record.uid, record.name, sorted(record.tag), dict(record.metadata),
+            record.parent, record.timestamp, getattr(record, "context", ""),
+        ]), False
+
+    def _track(self, log: LogEvent):
+        """終了していないレコードの状態を更新する、self._lockを取得した状態で呼び出す"""
+        record = log.record
+        if log.event_type == LogEventType.BEGIN:
+            self._open[record.uid] = (record, [])
+            if record.parent in self._open:
+                self._open[record.parent][1].append(record.uid)
+        elif log.event_type == LogEventType.UPDATE:
+            if record.uid in self._open:
+                self._open[record.uid] = (record, self._open[record.uid][1])
+        elif record.uid in self._open:
+            del self._open[record.uid]
+        elif record.parent in self._open:
+            self._open[record.parent][1].append(record.uid)
+
+    def _write(self, payload: bytes):
+        self._file.write(_LENGTH.pack(len(payload)))
+        self._file.write(payload)
+        self._size += _LENGTH.size + len(payload)
+        self.events_written += 1
+        self.bytes_written += _LENGTH.size + len(payload)
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes is not None and self._size >= self.max_bytes:
+            return True
+        return self.max_age is not None and time.monotonic() - self._opened_at >= self.max_age
+
+    def _open_file(self):
+        # 既存のファイルが別のコーデックや壊れたヘッダーの場合は、ローテーションして新しいファイルに記録する
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size or _HEADER.unpack(header) != (MAGIC, VERSION, self._codec):
+                self._shift_backups()
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(_HEADER.pack(MAGIC, VERSION, self._codec))
+            self._size = _HEADER.size
+        self._opened_at = self._last_flush = time.monotonic()
+
+    def _shift_backups(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for n in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{n}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _rotate(self):
+        """self._lockを取得した状態で呼び出す"""
+        self._file.close()
+        self._shift_backups()
+        self._open_file()
+        self.rotations += 1
+        # 新しいファイルだけで再生できるように、終了していないレコードの状態を親から順に記録する
+        for record, children in self._open.values():
+            self._write(self._encode([
+                "s", _TYPE_CODES[record.type], record.uid, record.name, sorted(record.tag), dict(record.metadata),
+                record.parent, record.timestamp, _ts(record.start_time),
+                record.input, record.output, record.feedback, children,
+            ]))
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        _handlers.discard(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "size": self._size,
+            "events_written": self.events_written,
+            "bytes_written": self.bytes_written,
+            "rotations": self.rotations,
+            "open_records": len(self._open),
+        }
+
+
+@atexit.register
+def _close_all():
+    for handler in list(_handlers):
+        handler.close()
+
+
+class _ReplayEntry():
+    """再生中の終了していないレコード"""
+    __slots__ = ("log_type", "fields", "children", "record")
+
+    def __init__(self, log_type: LogType, fields: Dict[str, Any], children: List[str]):
+        self.log_type = log_type
+        self.fields = fields
+        self.children = children
+        self.record: Optional[LogRecord] = None
+
+    def snapshot(self) -> LogRecord:
+        if self.record is None:
+            self.fields["children"] = tuple(self.children)
+            self.record = _build_record(self.log_type, dict(self.fields))
+        return self.record
+
+
+class TraceReader():
+    """
+    TraceFileHandlerで記録したファイルからLogEventを復元する
+
+    ファイルは先頭から順に読み込み、終了していないレコードのみを保持する為、ファイルの大きさに関わらずメモリの使用量は一定
+    最後のエントリが書き込みの途中で終了している場合（プロセスが異常終了した場合など）は、その直前までを読み込む
+
+    Args:
+        path: str 記録したファイルのパス
+        include_rotated: bool ローテーションしたファイル（path.1, path.2, ...）も古い順に読み込むか
+    """
+    def __init__(self, path: str, include_rotated: bool = True):
+        self.files = rotated_files(path) if include_rotated else [path]
+        if not self.files:
+            raise FileNotFoundError(path)
+        self.truncated = False  # 途中で終了しているエントリがあったか
+
+    def entries(self) -> Iterator[list]:
+        """ファイルのエントリ（デコードしたペイロード）を順に返す"""
+        for path in self.files:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    continue
+                magic, version, codec = _HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise TraceFormatError(f"{path} is not a trace file")
+                if version != VERSION:
+                    raise TraceFormatError(f"unsupported trace file version: {version}")
+                decode = _decoder(codec)
+                while True:
+                    prefix = f.read(_LENGTH.size)
+                    if not prefix:
+                        break
+                    if len(prefix) < _LENGTH.size:
+                        self.truncated = True
+                        break
+                    (length,) = _LENGTH.unpack(prefix)
+                    data = f.read(length)
+                    if len(data) < length:
+                        self.truncated = True
+                        break
+                    yield decode(data)
+
+    def events(self) -> Iterator[Tuple[float, LogEvent]]:
+        """(イベントの時刻, LogEvent)を記録した順に返す"""
+        open_entries: Dict[str, _ReplayEntry] = {}
+
+        def add_child(parent: Optional[str], uid: str):
+            entry = open_entries.get(parent) if parent is not None else None
+            if entry is not None:
+                entry.children.append(uid)
+                entry.record = None
+
+        for e in self.entries():
+            kind = e[0]
+            if kind == "b" or kind == "s":
+                uid = e[2]
+                if uid in open_entries:
+                    continue  # ローテーションの前のファイルで開始済み
+                log_type = _CODE_TYPES[e[1]]
+                fields = {
+                    "name": e[3], "tag": frozenset(e[4]),
+                    "metadata": MappingProxyType(e[5]) if e[5] else _EMPTY_METADATA,
+                    "parent": e[6], "timestamp": e[7], "uid": uid,
+                    "input": "", "output": "", "feedback": "",
+                    "start_time": datetime.fromtimestamp(e[8]), "end_time": None,
+                }
+                children: List[str] = []
+                if kind == "s":
+                    fields.update(input=e[9], output=e[10], feedback=e[11])
+                    children = list(e[12])
+                add_child(e[6], uid)
+                entry = open_entries[uid] = _ReplayEntry(log_type, fields, children)
+                yield e[8], LogEvent(LogEventType.BEGIN, entry.snapshot())
+            elif kind == "u":
+                entry = open_entries.get(e[1])
+                if entry is None:
+                    continue
+                previous = entry.snapshot()
+                entry.fields.update(e[3])
+                entry.record = None
+                yield e[2], LogEvent(LogEventType.UPDATE, entry.snapshot(), previous, e[3])
+            elif kind == "e":
+                entry = open_entries.pop(e[1], None)
+                if entry is None:
+                    continue
+                previous = entry.snapshot()
+                end_time = datetime.fromtimestamp(e[2]) if e[2] is not None else None
+                entry.fields["end_time"] = end_time
+                entry.record = None
+                changes = {"end_time": end_time}
+                if len(e) > 3:
+                    changes["log_overhead"] = e[3]
+                yield e[2], LogEvent(LogEventType.END, entry.snapshot(), previous, changes)
+            elif kind == "i":
+                add_child(e[6], e[2])
+                record = _build_record(_CODE_TYPES[e[1]], {
+                    "name": e[3], "tag": frozenset(e[4]),
+                    "metadata": MappingProxyType(e[5]) if e[5] else _EMPTY_METADATA,
+                    "parent": e[6], "children": (), "timestamp": e[7], "uid": e[2], "context": e[8],
+                })
+                yield e[7], LogEvent(LogEventType.END, record)
+            else:
+                raise TraceFormatError(f"unknown entry: {kind}")
+
+    def __iter__(self) -> Iterator[LogEvent]:
+        for _, event in self.events():
+            yield event
+
+    def replay(self, handlers: Iterable[Handler], speed: Optional[float] = None) -> int:
+        """
+        記録したイベントをハンドラーに渡す
+
+        Args:
+            handlers: Iterable[Handler] イベントを渡すハンドラー（is_realtimeがFalseのハンドラーにはENDのみを渡す）
+            speed: Optional[float] 記録した時の間隔のspeed倍の速さで再生する（Noneの場合は待機せずに再生する）
+        Returns:
+            int: 再生したイベントの数
+        """
+        handlers = list(handlers)
+        realtime = [h for h in handlers if h.is_realtime]
+        count = 0
+        first: Optional[float] = None
+        started = time.monotonic()
+        for t, event in self.events():
+            if speed is not None and t is not None:
+                if first is None:
+                    first = t
+                wait = (t - first) / speed - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            for handler in (handlers if event.event_type == LogEventType.END else realtime):
+                handler.handle(event)
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """ファイルのイベントの数と大きさを集計する"""
+        counts = {"begin": 0, "update": 0, "end": 0, "event": 0, "state": 0}
+        names = {"b": "begin", "u": "update", "e": "end", "i": "event", "s": "state"}
+        first = last = None
+        for e in self.entries():
+            counts[names[e[0]]] += 1
+            t = _entry_time(e)
+            if t is not None:
+                first = t if first is None else min(first, t)
+                last = t if last is None else max(last, t)
+        return {
+            "files": self.files,
+            "bytes": sum(os.path.getsize(p) for p in self.files),
+            "entries": counts,
+            "start": datetime.fromtimestamp(first).isoformat() if first is not None else None,
+            "end": datetime.fromtimestamp(last).isoformat() if last is not None else None,
+            "truncated": self.truncated,
+        }
+
+
+def merge_traces(paths: Iterable[str], output: str, codec: Optional[str] = None, include_rotated: bool = True) -> int:
+    """
+    複数のファイル（複数のプロセスで記録したものなど）を時刻順に1つのファイルにまとめる
+
+    各ファイルのエントリの順序は保ったまま、ファイル間は時刻で並べる
+    レコードのUIDはプロセスごとに異なる接頭辞を持つ為、まとめても衝突しない
+
+    Args:
+        paths: Iterable[str] まとめるファイルのパス
+        output: str 出力するファイルのパス（既存のファイルは上書きする）
+        codec: Optional[str] 出力の形式（TraceFileHandlerを参照）
+        include_rotated: bool ローテーションしたファイルも読み込むか
+
+    Returns:
+        int: 書き込んだエントリの数
+    """
+    if codec is None:
+        codec = "msgpack" if msgpack is not None else "json"
+    code = CODEC_MSGPACK if codec == "msgpack" else CODEC_JSON
+    encode = _encoder(code)
+
+    def timed(index: int, reader: TraceReader) -> Iterator[Tuple[float, int, list]]:
+        # 状態のエントリは開始時刻を持つ為、ファイル内の順序が変わらないように時刻を単調にする
+        last = 0.0
+        for entry in reader.entries():
+            t = _entry_time(entry)
+            last = max(last, t) if t is not None else last
+            yield last, index, entry
+
+    readers = [TraceReader(path, include_rotated=include_rotated) for path in paths]
+    count = 0
+    with open(output, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, code))
+        for _, _, entry in heapq.merge(*(timed(i, r) for i, r in enumerate(readers)), key=lambda item: item[:2]):
+            data = encode(entry)
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+            count += 1
+    return count
+
+
+def _event_to_json(event: LogEvent) -> Dict[str, Any]:
+    record = event.record.to_dict()
+    for key in ("start_time", "end_time"):
+        if isinstance(record.get(key), datetime):
+            record[key] = record[key].isoformat()
+    return {"event_type": event.event_type.value, "type": event.record.type.value, "record": record}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TraceFileHandlerで記録したファイルの集計と再生")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("stats", help="ファイルのエントリの数と期間を表示する")
+    p.add_argument("path")
+    p = sub.add_parser("profile", help="ProfilerHandlerに再生してジョブごとの処理時間の内訳を表示する")
+    p.add_argument("path")
+    p.add_argument("--output", metavar="DIR", help="ジョブごとのプロファイル（speedscope, Chrome trace形式）をDIRに出力する")
+    p.add_argument("--top", type=int, default=10, help="表示する自己時間の上位の件数")
+    p = sub.add_parser("dump", help="イベントをJSON Lines形式で標準出力に出力する")
+    p.add_argument("path")
+    p = sub.add_parser("merge", help="複数のファイルを時刻順に1つのファイルにまとめる")
+    p.add_argument("output")
+    p.add_argument("inputs", nargs="+")
+    for p in sub.choices.values():
+        p.add_argument("--no-rotated", action="store_true", help="ローテーションしたファイルを読み込まない")
+    args = parser.parse_args(argv)
+
+    if args.command == "merge":
+        count = merge_traces(args.inputs, args.output, include_rotated=not args.no_rotated)
+        print(f"merged {count} entries from {len(args.inputs)} files into {args.output}")
+        return 0
+
+    reader = TraceReader(args.path, include_rotated=not args.no_rotated)
+    if args.command == "stats":
+        print(json.dumps(reader.stats(), ensure_ascii=False, indent=2))
+    elif args.command == "profile":
+        from logger.profiler import ProfilerHandler
+        profiler = ProfilerHandler(top_n=args.top, output_dir=args.output)
+        count = reader.replay([profiler])
+        print(f"replayed {count} events, {len(profiler.profiles)} jobs")
+    elif args.command == "dump":
+        for event in reader:
+            print(json.dumps(_event_to_json(event), ensure_ascii=False, default=str))
+    if reader.truncated:
+        print("warning: the last entry is truncated", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+LLMRobotPlannerをHTTP API（service/http_api.py）で操作するヘッドレスのサービス
+
+実行方法（リポジトリのルートで実行）:
+    python main_service.py [--port 8765] [--workers 1] [--max-queue 100] [--trace logs/trace.lrpt]
+    # API Keyを使用せず、ベンチマークのコーパスとシミュレーターで実行する（負荷試験用）
+    python main_service.py --offline --workers 4 --llm-latency 0.5
+
+    curl -X POST localhost:8765/jobs -d '{"instruction": "キッチンに移動して"}'
+    curl localhost:8765/jobs/job-1?wait=60
+"""
+from typing import Callable
+import argparse
+import logging
+
+from planner.llm_robot_planner import LLMRobotPlanner, RobotState
+from planner.plan_cache import PlanCache, CommandPlanCache
+from planner.failure_rules import FailureRuleEngine
+from planner.command.commands.standard_commands import *
+from logger.logger import LLMRobotPlannerLogSystem
+from logger.async_handler import AsyncHandler
+from logger.trace_file import TraceFileHandler
+from service.planner_service import PlannerService
+from service.http_api import PlannerHTTPServer
+from utils.utils import read_key_value_pairs
+
+LLM_logger = logging.getLogger("LLMRobotPlanner")
+log_system = LLMRobotPlannerLogSystem()
+
+
+def _states():
+    return [
+        RobotState(
+            name="not_in_hand",
+            description="ロボットが手に何も持っていない",
+            args_description={},
+            initial_state=True
+        ),
+        RobotState(
+            name="in_hand",
+            description="ロボットがxを手に持っている",
+            args_description={"x": "str"},
+            initial_state=False
+        )
+    ]
+
+
+def online_planner_factory() -> Callable[[], LLMRobotPlanner]:
+    api_keys = {"google": read_key_value_pairs("key.env")["GEMINI_API_KEY"]}
+
+    def factory() -> LLMRobotPlanner:
+        return LLMRobotPlanner(
+            api_keys=api_keys,
+            commands=[
+                MoveCommand(),
+                FindCommand(),
+                IntrofuceSelfCommand(),
+                SpeakMessageCommand(),
+                AskQuestionCommand(),
+                PickUpObjectCommand(),
+                DropObjectCommand(),
+                RecordCurrentLocationCommand(),
+                ErrorCommand(),
+            ],
+            states=_states(),
+            # 常駐する為、繰り返し依頼される指示やタスクはタスクとコマンドの生成を省略する
+            plan_cache=PlanCache(),
+            command_plan_cache=CommandPlanCache(),
+            # 既知の失敗は生成AIに問い合わせずにリプランニングのレベルを決める
+            failure_rules=FailureRuleEngine(),
+        )
+    return factory
+
+
+def offline_planner_factory(llm_latency: float, command_latency: float, seed: int) -> Callable[[], LLMRobotPlanner]:
+    """ベンチマークの生成AIの代替とシミュレーターを使用する（コーパスにある指示のみ処理できる）"""
+    from benchmarks.planner_bench import build_planner, load_corpus
+    from benchmarks.sim.scripted_llm import ScriptedLLMWrapper
+    from planner.command.simulator import CommandSimulator
+    from planner.llm.wrappers.replay import LogNormalLatency
+
+    corpus = load_corpus()
+    latency = LogNormalLatency(llm_latency, sigma=0.4) if llm_latency > 0 else None
+    llm = ScriptedLLMWrapper(corpus["jobs"], latency=latency, seed=seed)
+
+    def factory() -> LLMRobotPlanner:
+        simulator = CommandSimulator(latency=command_latency, seed=seed)
+        return build_planner(llm, simulator, corpus["documents"], doc_latency=0.0)
+    return factory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLMRobotPlannerのHTTP APIサービス")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="同時に処理するジョブの数")
+    parser.add_argument("--max-queue", type=int, default=100, help="キューで待機できるジョブの最大数（超えた場合は429を返す）")
+    parser.add_argument("--trace", metavar="PATH", help="ログをPATHに記録する")
+    parser.add_argument("--offline", action="store_true", help="API Keyを使用せず、ベンチマークのコーパスとシミュレーターで実行する")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="--offlineの場合の生成AIのレイテンシの中央値[s]")
+    parser.add_argument("--command-latency", type=float, default=0.01, help="--offlineの場合のコマンドの実行時間[s]")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+    LLM_logger.addHandler(console_handler)
+    LLM_logger.setLevel(logging.INFO)
+
+    if args.offline:
+        factory = offline_planner_factory(args.llm_latency, args.command_latency, args.seed)
+    else:
+        factory = online_planner_factory()
+    service = PlannerService(factory, workers=args.workers, max_queue=args.max_queue)
+    server = PlannerHTTPServer(service, args.host, args.port)
+    log_system.add_handler(server.broadcaster)
+    if args.trace:
+        log_system.add_handler(AsyncHandler(TraceFileHandler(args.trace)))
+
+    service.start()
+    LLM_logger.info(f"serving on http://{args.host}:{server.server_address[1]} (workers={args.workers}, max_queue={args.max_queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.closing = True  # WebSocketの接続を終了させる（serve_foreverは既に終了している為shutdownは呼ばない）
+        server.server_close()
+        service.stop(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,17 +60,48 @@ LLM_logger.addHandler(console_handler)
 
 
 
-from flet import Page, app
+from flet import Page, Tabs, Tab, app
 from gui.view.real_time_info_view import LLMRobotPlannerRealTimeInfoView
+from gui.view.performance_dashboard_view import LLMRobotPlannerDashboardView
 from gui.logger_handler import LoggingGUIHandler
+from logger.async_handler import AsyncHandler
 from logger.logger import LLMRobotPlannerLogSystem
+from logger.trace_file import TraceFileHandler, TraceReader
 log_system = LLMRobotPlannerLogSystem()
 
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("--trace", metavar="PATH", help="ログをPATHに記録する（ローテーションしたファイルはPATH.1, PATH.2, ...）")
+parser.add_argument("--replay", metavar="PATH", help="プランナーを実行せずに、PATHに記録したログをGUIに再生する")
+parser.add_argument("--replay-speed", type=float, default=None, help="記録した時の間隔の何倍の速さで再生するか（省略した場合は待機せずに再生する）")
+args, _ = parser.parse_known_args()
+
 
 def main(page: Page):
-    planner_info = LLMRobotPlannerRealTimeInfoView(page=page)
-    log_system.add_handler(LoggingGUIHandler(planner_info))
-    page.add(planner_info)
+    # 記録したファイルがある場合、メモリから破棄された古いログはファイルから読み込む
+    planner_info = LLMRobotPlannerRealTimeInfoView(page=page, trace_path=args.replay or args.trace)
+    # GUIの更新がプランニングを遅くしないように、別スレッドで処理する
+    gui_handler = AsyncHandler(LoggingGUIHandler(planner_info), overflow="drop_oldest")
+    dashboard = LLMRobotPlannerDashboardView(page=page)
+    page.add(Tabs(
+        expand=True,
+        tabs=[
+            Tab(text="ログ", content=planner_info),
+            Tab(text="パフォーマンス", content=dashboard),
+        ]
+    ))
+
+    if args.replay:
+        # 記録したログの再生
+        replay = threading.Thread(
+            target=lambda: TraceReader(args.replay).replay([gui_handler], speed=args.replay_speed), daemon=True
+        )
+        replay.start()
+        return
+
+    log_system.add_handler(gui_handler)
+    if args.trace:
+        log_system.add_handler(AsyncHandler(TraceFileHandler(args.trace)))
     
     # LLM Robot Planner スレッドの開始
     llm_robot_planner = threading.Thread(target=process_llm_robot_planner, daemon=True)
@@ -1,11 +1,13 @@
+from typing import Optional
 from planner.command.command_base import Command, StateChange, CommandExecutionResult
+from planner.command.simulator import CommandSimulator, default_simulator
 
 import logging
 logger = logging.getLogger("LLMCommand")
 
-import time # TODO: 仮の実装 後で消す
 class MoveCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="move",
             description='ロボットについている台車を動かして<location>に移動するコマンド、ロボット自身が移動するだけで、何か物やオブジェクトを掴む機能は無い',
@@ -15,10 +17,8 @@ class MoveCommand(Command):
     
     def execute(self, location) -> CommandExecutionResult:
         # TODO: 仮の実装　後で修正する
-        import random
-        result = False
-        time.sleep(1) # TODO: 後で消す
-        if result:
+        result = self._simulator.run(self.name)
+        if not result:
             status = "failure"
             message = f"{location}に移動できませんでした"
         else:
@@ -27,11 +27,12 @@ class MoveCommand(Command):
 
         return CommandExecutionResult(
             status=status,
-            details=""
+            details=message
         )
 
 class FindCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="find",
             description='ロボットのカメラを用いて<object>を探すコマンド',
@@ -40,9 +41,7 @@ class FindCommand(Command):
         
     def execute(self, object) -> CommandExecutionResult:
         # TODO: 仮の実装　後で修正する
-        import random
-        result = random.choice([True, False])
-        time.sleep(1) # TODO: 後で消す
+        result = self._simulator.run(self.name)
         
         if not result:
             status = "failure"
@@ -70,7 +69,8 @@ class IntrofuceSelfCommand(Command):
         )
 
 class SpeakMessageCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="speak_message",
             description='ロボットのスピーカーを使用して<message>を発話する。',
@@ -78,13 +78,14 @@ class SpeakMessageCommand(Command):
         )
     
     def execute(self, speak_message) -> CommandExecutionResult:
-        time.sleep(1) # TODO: 後で消す
+        success = self._simulator.run(self.name)
         return CommandExecutionResult(
-            status="success"
+            status="success" if success else "failure"
         )   
 
 class AskQuestionCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="ask_question",
             description='<content>について、ロボットのスピーカーを用いてユーザー質問する。このコマンドを実行するには目の前に人が居る必要がある。',
@@ -92,13 +93,14 @@ class AskQuestionCommand(Command):
         )
     
     def execute(self, question) -> CommandExecutionResult:
-        time.sleep(1) # TODO: 後で消す
+        success = self._simulator.run(self.name)
         return CommandExecutionResult(
-            status="success"
+            status="success" if success else "failure"
         )
 
 class PickUpObjectCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="pick_up_object",
             description='ロボットのカメラとロボットについているアームを使用して物やオブジェクトを掴む',
@@ -108,14 +110,16 @@ class PickUpObjectCommand(Command):
         )
         
     def execute(self, object) -> CommandExecutionResult:
-        time.sleep(1) # TODO: 後で消す
+        if not self._simulator.run(self.name):
+            return CommandExecutionResult(status="failure")
         return CommandExecutionResult(
             status="success",
             state_changes=[StateChange("in_hand", True), StateChange("not_in_hand", False, args={})]
         )
     
 class DropObjectCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="drop_object",
             description='ロボットのカメラとロボットが持っているアームを使用して持っている物やオブジェクトを落とす',
@@ -127,23 +131,25 @@ class DropObjectCommand(Command):
         )
         
     def execute(self, object) -> CommandExecutionResult:
-        time.sleep(1) # TODO: 後で消す
+        if not self._simulator.run(self.name):
+            return CommandExecutionResult(status="failure")
         return CommandExecutionResult(
             status="success",
             state_changes=[StateChange("in_hand", False), StateChange("not_in_hand", True, args={"x": str(object)})]
         )
 
 class RecordCurrentLocationCommand(Command):
-    def __init__(self) -> None:
+    def __init__(self, simulator: Optional[CommandSimulator] = None) -> None:
+        self._simulator = simulator or default_simulator
         super().__init__(
             name="record_current_location",
             description='ロボットの現在位置を記録するコマンド',
         )
         
     def execute(self) -> CommandExecutionResult:
-        time.sleep(1) # TODO: 後で消す
+        success = self._simulator.run(self.name)
         return CommandExecutionResult(
-            status="success"
+            status="success" if success else "failure"
         )
         
 class ErrorCommand(Command):
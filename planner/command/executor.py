@@ -1,11 +1,16 @@
+import inspect
+
 from planner.command.command_base import Command, CommandExecutionResult
 from planner.command.manager import CommandManager
 from planner.database.data_type import CommandRecord
 from utils.utils import to_json_str
+from utils.metrics import default_registry as metrics
 
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
+_COMMAND_SECONDS = metrics.histogram("command_duration_seconds", "コマンドの実行時間（status: success, failure, error）", ("command", "status"))
+
 class CommandExecutor:
     def __init__(self, command_manager: CommandManager):
         self._cmd_manager: CommandManager = command_manager
@@ -29,15 +34,26 @@ class CommandExecutor:
         command_name = command.description
         args = command.args
         
-        with log.action(f"コマンド: {command_name}") as action:
+        with log.action(f"コマンド: {command_name}", tag={"command"}) as action, \
+                _COMMAND_SECONDS.time(command=command_name, status="error") as labels:
             action.input("args: " + to_json_str(args))
             cmd = self._cmd_manager.get_command(command_name)
-            # コマンドの実行
-            cmd.on_enter()
-            exec_result = cmd.execute(**args)
+            try:
+                inspect.signature(cmd.execute).bind(**args)
+            except TypeError as e:
+                # 引数の誤りは生成AIが生成したコマンドの誤りの為、例外にせず失敗としてリプランニングする
+                exec_result = CommandExecutionResult(
+                    status="failure",
+                    details=f"{command_name}コマンドの引数が正しくありません: {e}"
+                )
+            else:
+                # コマンドの実行
+                cmd.on_enter()
+                exec_result = cmd.execute(**args)
+                cmd.on_exit()
             exec_result.cmd_name = command_name
             exec_result.cmd_args = args
-            cmd.on_exit()
+            labels["status"] = exec_result.status
             action.output(f"result: {exec_result}")
 
         return exec_result
\ No newline at end of file
@@ -1,4 +1,6 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
+import copy
+import hashlib
 from planner.command.command_base import Command
 from planner.command.robot_state import RobotState, StateChange
 
@@ -19,6 +21,12 @@ class RobotStateManager():
         # TODO: 改善
         return list(self._states.values())
     
+    def copy(self) -> "RobotStateManager":
+        """現在の状態を複製した、独立したRobotStateManagerを返す（ジョブごとにロボットの状態を分ける為に使用する）"""
+        manager = RobotStateManager()
+        manager.register_states([copy.deepcopy(state) for state in self._states.values()])
+        return manager
+    
     def update(self, changes: List[StateChange]):
         for change in changes:
             if change.name not in self._states:
@@ -34,6 +42,7 @@ class RobotStateManager():
 class CommandManager():
     def __init__(self) -> None:
         self._commands: Dict[str, Command] = {}
+        self._signature: Optional[str] = None
 
     def register_commands(self, commands: List[Command]):
         for command in commands:
@@ -43,6 +52,16 @@ class CommandManager():
             if command_name in self._commands:
                 raise ValueError(f"command: '{command_name}' is already registered. command name must be unique")
             self._commands[command_name] = command
+        self._signature = None
+
+    def signature(self) -> str:
+        """登録されているコマンド（名前と説明）のハッシュ（コマンドの登録が変わった場合にCommandPlanCacheを無効にする為に使用する）"""
+        if self._signature is None:
+            h = hashlib.sha256()
+            for name in sorted(self._commands):
+                h.update(f"{name}\0{self._commands[name].description}\0".encode("utf-8"))
+            self._signature = h.hexdigest()
+        return self._signature
 
     def get_all_command_descriptions(self) -> List[str]:
         # TODO: 改善
@@ -0,0 +1,76 @@
+from typing import Dict, Optional
+import random
+import threading
+import time
+
+
+class CommandSimulator():
+    """
+    ロボットのコマンドの実行を模擬するクラス（実機が無い環境での動作確認、ベンチマーク用）
+
+    実行時間だけ待機し、コマンド名ごとの失敗率に従って成功/失敗を返す
+    seedを指定した場合は、同じ順序で実行すれば同じ結果になる
+
+    Args:
+        latency: float 既定の実行時間[s]
+        latencies: Dict[str, float] コマンド名ごとの実行時間[s]
+        jitter: float 実行時間の揺らぎの割合（0.1の場合は±10%）
+        failure_rates: Dict[str, float] コマンド名ごとの失敗率（0〜1）
+        seed: Optional[int] 乱数のシード（Noneの場合は実行ごとに異なる結果になる）
+    """
+    def __init__(
+        self,
+        latency: float = 1.0,
+        latencies: Dict[str, float] = {},
+        jitter: float = 0.0,
+        failure_rates: Dict[str, float] = {},
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.latencies = dict(latencies)
+        self.jitter = jitter
+        self.failure_rates = dict(failure_rates)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.executed: int = 0  # 実行したコマンドの数
+        self.failed: int = 0  # 失敗したコマンドの数
+        self.simulated_time: float = 0.0  # 待機した時間の合計[s]
+
+    def run(self, command_name: str) -> bool:
+        """
+        コマンドの実行を模擬する
+
+        Args:
+            command_name: str コマンド名
+        Returns:
+            bool 成功した場合はTrue
+        """
+        with self._lock:
+            latency = self.latencies.get(command_name, self.latency)
+            if self.jitter > 0:
+                latency *= 1.0 + self._rng.uniform(-self.jitter, self.jitter)
+            success = self._rng.random() >= self.failure_rates.get(command_name, 0.0)
+            self.executed += 1
+            self.failed += 0 if success else 1
+            self.simulated_time += latency
+        if latency > 0:
+            time.sleep(latency)
+        return success
+
+    def reset_stats(self):
+        with self._lock:
+            self.executed = 0
+            self.failed = 0
+            self.simulated_time = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "executed": self.executed,
+            "failed": self.failed,
+            "simulated_time": self.simulated_time,
+        }
+
+
+# 既定の設定（実行時間1秒、findコマンドは50%の確率で失敗する）
+default_simulator = CommandSimulator(latency=1.0, failure_rates={"find": 0.5})
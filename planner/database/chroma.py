@@ -4,12 +4,16 @@ from chromadb import Client, Collection
 from chromadb import Documents, EmbeddingFunction, Embeddings
 
 from utils.utils import to_json_str
+from utils.single_flight import SingleFlight
+from utils.metrics import default_registry as metrics
 
 import google.generativeai as genai
 
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
+_EMBEDDING_SECONDS = metrics.histogram("embedding_request_duration_seconds", "埋め込みAPIへの1回のリクエストの所要時間", ("model", "task_type", "outcome"))
+
 class GoogleGenerativeAiEmbeddingFunction(EmbeddingFunction[Documents]):
     ############################################
     # google gemini embedding function
@@ -25,6 +29,7 @@ class GoogleGenerativeAiEmbeddingFunction(EmbeddingFunction[Documents]):
         api_key: str,
         model_name: str = "models/embedding-001",
         task_type: str = "RETRIEVAL_DOCUMENT",
+        flight: Optional[SingleFlight] = None,
     ):
         if not api_key:
             raise ValueError("Please provide a Google API key.")
@@ -46,17 +51,27 @@ class GoogleGenerativeAiEmbeddingFunction(EmbeddingFunction[Documents]):
         self._task_title = None
         if self._task_type == "RETRIEVAL_DOCUMENT":
             self._task_title = "Embedding of single string"
+        # 同じ文字列の埋め込みが同時に要求された場合は1回だけAPIを呼び出す
+        self._flight = flight if flight is not None else SingleFlight()
 
     def __call__(self, input: Documents) -> Embeddings:
         return [
-            self._genai.embed_content(
-                model=self._model_name,
-                content=text,
-                task_type=self._task_type,
-                title=self._task_title,
-            )["embedding"]
+            self._flight.do((self._model_name, self._task_type, text), lambda text=text: self._embed(text))
             for text in input
         ]
+
+    def _embed(self, text: str):
+        with _EMBEDDING_SECONDS.time(model=self._model_name, task_type=self._task_type, outcome="success") as labels:
+            try:
+                return self._genai.embed_content(
+                    model=self._model_name,
+                    content=text,
+                    task_type=self._task_type,
+                    title=self._task_title,
+                )["embedding"]
+            except Exception:
+                labels["outcome"] = "error"
+                raise
     
     
 class ChromaDBWithGemini():
@@ -73,8 +88,9 @@ class ChromaDBWithGemini():
             embedding_model_api_key: str
             db_path: Optional[str]  # Not Supported
         """
-        self._retrieval_doc_ef = GoogleGenerativeAiEmbeddingFunction(embedding_model_api_key, embedding_model, task_type="RETRIEVAL_DOCUMENT")
-        self._retrieval_query_ef = GoogleGenerativeAiEmbeddingFunction(embedding_model_api_key, embedding_model, task_type="RETRIEVAL_QUERY")
+        self._embedding_flight = SingleFlight()
+        self._retrieval_doc_ef = GoogleGenerativeAiEmbeddingFunction(embedding_model_api_key, embedding_model, task_type="RETRIEVAL_DOCUMENT", flight=self._embedding_flight)
+        self._retrieval_query_ef = GoogleGenerativeAiEmbeddingFunction(embedding_model_api_key, embedding_model, task_type="RETRIEVAL_QUERY", flight=self._embedding_flight)
         self._client = Client()
         self._collection: Collection = self._client.get_or_create_collection(
             name="local_knowledge", 
@@ -82,13 +98,13 @@ class ChromaDBWithGemini():
         )
     
     def upsert(self, documents: List[str], ids: List[str]):
-        with log.span("ChromaDB upsert") as span:
+        with log.span("ChromaDB upsert", tag={"rag"}) as span:
             span.input(f"{documents}")
             self._collection.add(documents=documents, ids=ids)
             span.output(f"upserted: {to_json_str(documents, ensure_ascii=False, indent=4)}")
             
     def query(self, query_texts: List[str], n_results: int = 1):
-        with log.span("ChromaDB query") as span:
+        with log.span("ChromaDB query", tag={"rag"}) as span:
             span.input(f"{query_texts}")
             r = self._collection.query(query_embeddings=self._retrieval_query_ef(query_texts), n_results=n_results)
             span.output(f"result: {to_json_str(r)}")
@@ -116,6 +116,12 @@ class CommandInfo(TypedDict):
     description: str
     additional_info: str
     args: Dict[str, str]
+
+class CommandPatchOperation(TypedDict):
+    """未実行のコマンドのリスト（残りのプラン）に対する変更（Memory.apply_execution_command_patchを参照）"""
+    op: Literal["insert", "replace", "delete"]
+    index: int  # 残りのプランの1から始まる番号（insertの場合はその番号のコマンドの前に挿入する）
+    command: Optional[CommandInfo]  # deleteの場合はNone
         
 @dataclass
 class CommandRecord(_DataRecordBase):
@@ -259,6 +265,23 @@ class JobRecord(_DataRecordBase):
     execution_result: Optional[ExecutionResultRecord] = None
     timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
         
+
+@dataclass
+class FailureEvaluationRecord(_DataRecordBase):
+    """
+    失敗したコマンドに対する生成AIの評価（EVALUATE_RESULTの応答の1番目）の記録
+    FailureRuleEngineがルールを学習する為に使用する
+    """
+    command_name: str
+    status: str
+    detailed_info: str
+    detail_signature: str  # 引数の値と数値を置き換えたdetailed_info（planner.failure_rules.failure_signatureを参照）
+    error_level: Literal["command_level", "task_level"]
+    cause: str
+    detail: str
+    solution: str
+    uid: Optional[int] = None  # データベースに記録した後に発行される
+        
     
 __all__ = [
     "Position",
@@ -269,5 +292,7 @@ __all__ = [
     "TaskRecord",
     "JobRecord",
     "TaskInfo",
-    "CommandInfo"
+    "CommandInfo",
+    "CommandPatchOperation",
+    "FailureEvaluationRecord"
 ]
\ No newline at end of file
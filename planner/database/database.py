@@ -1,20 +1,42 @@
 from typing import Optional, List, Literal, Dict, Any, Union
-from planner.database.data_type import Location, JobRecord, TaskRecord, CommandRecord, CommandExecutionResultRecord, Object, Location 
+import functools
+from planner.database.data_type import Location, JobRecord, TaskRecord, CommandRecord, CommandExecutionResultRecord, Object, Location, FailureEvaluationRecord
+
+from utils.metrics import default_registry as metrics
 
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
+_DB_SECONDS = metrics.histogram("db_query_duration_seconds", "DatabaseManagerの操作（SQLite）の所要時間", ("operation",))
+_DOCUMENT_QUERY_SECONDS = metrics.histogram("document_query_duration_seconds", "文書データベースの検索の所要時間（埋め込みの計算を含む）")
+
+def _locked(method):
+    """SQLiteの接続を共有する為、メソッドの実行中はSQLiteInterface.lockを取得する（待機時間もdb_query_duration_secondsに含める）"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._sqlite_interface.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class MemoryDatabase():
     def __init__(self):
         self.current_job: Optional[JobRecord] = None
 
 from planner.database.sqlite import SQLiteInterface
-from planner.database.sqlite import LocationKnowledge, ObjectKnowledge, PlanningHistory
-from planner.database.chroma import ChromaDBWithGemini
+from planner.database.sqlite import LocationKnowledge, ObjectKnowledge, PlanningHistory, FailureEvaluationHistory
 
 class DatabaseManager():
-    def __init__(self):
-        db_path = "planner/database/db/test.db"
+    def __init__(
+        self,
+        db_path: str = "planner/database/db/test.db",
+        document_db = None,
+    ):
+        """
+        Args:
+            db_path: str SQLiteのデータベースのパス（":memory:"の場合はメモリ上に作成する）
+            document_db: 文書の検索に使用するデータベース（query(query_texts, n_results)を持つもの）
+                省略した場合はChromaDBWithGemini（key.envのGEMINI_API_KEYを使用する）
+        """
         #self._memory_db = MemoryDatabase()
         self._sqlite_interface = SQLiteInterface(db_path)
         
@@ -22,16 +44,24 @@ class DatabaseManager():
         self._planning_history = PlanningHistory(self._sqlite_interface)
         self._location_knowledge = LocationKnowledge(self._sqlite_interface)
         self._object_knowledge = ObjectKnowledge(self._sqlite_interface)
+        self._failure_evaluations = FailureEvaluationHistory(self._sqlite_interface)
         
         #
-        from utils.utils import read_key_value_pairs
-        self._document_db = ChromaDBWithGemini(
-            embedding_model="models/text-embedding-004",
-            embedding_model_api_key=read_key_value_pairs("key.env")["GEMINI_API_KEY"],
-            db_path=db_path
-        )
+        if document_db is None:
+            from planner.database.chroma import ChromaDBWithGemini
+            from utils.utils import read_key_value_pairs
+            document_db = ChromaDBWithGemini(
+                embedding_model="models/text-embedding-004",
+                embedding_model_api_key=read_key_value_pairs("key.env")["GEMINI_API_KEY"],
+                db_path=db_path
+            )
+        self._document_db = document_db
+        # 知識（ロケーション、オブジェクト）を追加するごとに増える版（PlanCacheのキーに使用する）
+        self.knowledge_version: int = 0
         
                 
+    @_DB_SECONDS.time(operation="add_job")
+    @_locked
     def add_job(self, job: JobRecord) -> JobRecord:
         """
         Args:
@@ -43,6 +73,8 @@ class DatabaseManager():
         job.uid = job_id
         return job
     
+    @_DB_SECONDS.time(operation="add_tasks_to_job")
+    @_locked
     def add_tasks_to_job(self, tasks: List[TaskRecord], job_id: int) -> List[TaskRecord]:
         """
         データーベースにタスクを追加する
@@ -60,6 +92,8 @@ class DatabaseManager():
             task.uid = task_id
         return tasks
     
+    @_DB_SECONDS.time(operation="add_commands_to_task")
+    @_locked
     def add_commands_to_task(self, commands: List[CommandRecord], task_id: int) -> List[CommandRecord]:
         """
         データーベースにコマンドを追加する
@@ -77,6 +111,8 @@ class DatabaseManager():
             cmd.uid = cmd_id
         return commands
     
+    @_DB_SECONDS.time(operation="add_command_execution_result")
+    @_locked
     def add_command_execution_result(
         self,
         command_execution_result_record: CommandExecutionResultRecord,
@@ -89,15 +125,21 @@ class DatabaseManager():
             command_id
         )
     
+    @_DB_SECONDS.time(operation="update_command")
+    @_locked
     def update_command(self, command: CommandRecord):
         self._planning_history.update_command(command)
     
+    @_DB_SECONDS.time(operation="update_task")
+    @_locked
     def update_task(self, task: TaskRecord):
         self._planning_history.update_task(task)
     
     
     # --- Knowledges ---
     
+    @_DB_SECONDS.time(operation="add_location_knowledge")
+    @_locked
     def add_location_knowledge(
         self,
         location_id: str,
@@ -114,9 +156,14 @@ class DatabaseManager():
             x=x,
             y=y,
             z=z)
+        self.knowledge_version += 1
+    @_DB_SECONDS.time(operation="get_all_known_locations")
+    @_locked
     def get_all_known_locations(self) -> List[Location]:
         return self._location_knowledge.get_all()
     
+    @_DB_SECONDS.time(operation="add_object_knowledge")
+    @_locked
     def add_object_knowledge(
         self,
         object_id: str,
@@ -133,10 +180,15 @@ class DatabaseManager():
             x=x,
             y=y,
             z=z)
+        self.knowledge_version += 1
     
+    @_DB_SECONDS.time(operation="get_all_known_objects")
+    @_locked
     def get_all_known_objects(self) -> List[Object]:
         return self._object_knowledge.get_all()
     
+    @_DB_SECONDS.time(operation="get_by_name_from_knowledge")
+    @_locked
     def get_by_name_from_knowledge(self, name: str) -> List[Union[Location, Object]]:
         """
         名前でロケーションやオブジェクトを検索する
@@ -157,11 +209,26 @@ class DatabaseManager():
     
     # --- Planning History ---
     
+    @_DB_SECONDS.time(operation="get_all_actions")
+    @_locked
     def get_all_actions(self) -> List[CommandRecord]:
         return self._planning_history.get_all_executed_commands()
+    
+    @_DB_SECONDS.time(operation="add_failure_evaluation")
+    @_locked
+    def add_failure_evaluation(self, record: FailureEvaluationRecord) -> FailureEvaluationRecord:
+        """失敗したコマンドに対する生成AIの評価を記録する（uidを発行したレコードを返す）"""
+        record.uid = self._failure_evaluations.add(record)
+        return record
+    
+    @_DB_SECONDS.time(operation="get_failure_evaluations")
+    @_locked
+    def get_failure_evaluations(self) -> List[FailureEvaluationRecord]:
+        return self._failure_evaluations.get_all()
 
     
     
+    @_DOCUMENT_QUERY_SECONDS.time()
     def query_document(self, query_text: str, n_results: int = 1, distance_threshold: Optional[float] = 1) -> List[str]:
         query_results = self._document_db.query([query_text], n_results)
         l = []
@@ -176,7 +243,7 @@ class DatabaseManager():
     def init_helper(self):
         """テスト用初期化メソッド"""
         
-        with log.span("Database initialization") as span:
+        with log.span("Database initialization", tag={"db"}) as span:
             span.input("initialize database")
             
             # TODO: あとで削除 テスト用
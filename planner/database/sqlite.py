@@ -1,10 +1,11 @@
 from typing import Literal, Optional, List, Dict, Any, Union, overload
-from datetime import datetime
+from datetime import datetime, timezone
 import sqlite3
+import threading
 import json
 
 from planner.database.data_type import Position, Location, Object
-from planner.database.data_type import JobRecord, TaskRecord, CommandRecord, ExecutionResultRecord, CommandExecutionResultRecord
+from planner.database.data_type import JobRecord, TaskRecord, CommandRecord, ExecutionResultRecord, CommandExecutionResultRecord, FailureEvaluationRecord
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
@@ -12,14 +13,19 @@ import logging
 logger = logging.getLogger("SQLite")
 
 class SQLiteInterface():
+    """
+    1つの接続（とカーソル）を複数のスレッドで共有する
+    並行して実行するジョブから使用する場合は、lockを取得してから操作する（DatabaseManagerが行う）
+    """
     def __init__(self, db_path: str):
         self._conn: sqlite3.Connection
         self._cursor: sqlite3.Cursor
         self._db_path = db_path
+        self.lock = threading.RLock()
         self.connect()
         
     def connect(self):
-        self._conn = sqlite3.connect(self._db_path)
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
         self._cursor = self._conn.cursor()
         
     def close(self):
@@ -293,6 +299,8 @@ class PlanningHistory:
         assert isinstance(execution_result, ExecutionResultRecord) or isinstance(execution_result, CommandExecutionResultRecord), "execution_result は ExecutionResultRecord または CommandExecutionResultRecord のいずれかである必要があります。"
         assert execution_result.uid == -1, "ExecutionResultRecord の UID は -1（未登録を示す）である必要があります。"
         assert entity_id > 0, "entity_id は 1以上の整数である必要があります。"
+        # ExecutionResultRecordはタイムスタンプを持たない為、記録した時刻を使用する
+        timestamp = datetime.now(timezone.utc).isoformat()
         
         if entity_type == 'instruction':
             self._cursor.execute('''
@@ -304,7 +312,7 @@ class PlanningHistory:
                 execution_result.detailed_info,
                 execution_result.start_time.isoformat() if execution_result.start_time else None,
                 execution_result.end_time.isoformat() if execution_result.end_time else None,
-                execution_result.timestamp.isoformat()
+                timestamp
             ))
             logger.info(f"InstructionExecutionResult を Job {entity_id} に追加しました。")
         elif entity_type == 'task':
@@ -317,7 +325,7 @@ class PlanningHistory:
                 execution_result.detailed_info,
                 execution_result.start_time.isoformat() if execution_result.start_time else None,
                 execution_result.end_time.isoformat() if execution_result.end_time else None,
-                execution_result.timestamp.isoformat()
+                timestamp
             ))
             logger.info(f"TaskExecutionResult を Task {entity_id} に追加しました。")
         elif entity_type == 'command' and isinstance(execution_result, CommandExecutionResultRecord):
@@ -333,7 +341,7 @@ class PlanningHistory:
                 execution_result.z,
                 execution_result.start_time.isoformat() if execution_result.start_time else None,
                 execution_result.end_time.isoformat() if execution_result.end_time else None,
-                execution_result.timestamp.isoformat()
+                timestamp
             ))
             logger.info(f"CommandExecutionResult を Command {entity_id} に追加しました。")
         
@@ -390,8 +398,7 @@ class PlanningHistory:
                 y=row[4],
                 z=row[5],
                 start_time=datetime.fromisoformat(row[6]) if row[6] else None,
-                end_time=datetime.fromisoformat(row[7]) if row[7] else None,
-                timestamp=datetime.fromisoformat(row[8])
+                end_time=datetime.fromisoformat(row[7]) if row[7] else None
             ) for row in rows
         ]
         logger.info(f"{len(results)} 件のCommandExecutionResultを取得しました。")
@@ -479,19 +486,19 @@ class PlanningHistory:
                     y=exec_y,
                     z=exec_z,
                     start_time=exec_start_time,
-                    end_time=exec_end_time,
-                    timestamp=exec_timestamp
+                    end_time=exec_end_time
                 )
 
             command = CommandRecord(
                 uid=command_id,
-                status=status,
+                task_uid=task_id,
+                _status=status,
                 description=action,
                 sequence_number=sequence_number,
                 additional_info=command_description,
                 args=args,
                 timestamp=timestamp,
-                execution_result=execution_result
+                execution_result=execution_result or CommandExecutionResultRecord()
             )
 
             commands.append(command)
@@ -543,20 +550,20 @@ class PlanningHistory:
                     status=exec_status,
                     detailed_info=exec_detailed_info,
                     start_time=exec_start_time,
-                    end_time=exec_end_time,
-                    timestamp=exec_timestamp
+                    end_time=exec_end_time
                 )
             else:
                 execution_result = None
 
             task = TaskRecord(
                 uid=task_id,
-                status=status,
+                job_uid=job_id,
+                _status=status,
                 description=name,
                 sequence_number=seq_num,
                 additional_info=details,
                 timestamp=datetime.fromisoformat(ts) if ts else None,
-                execution_result=execution_result
+                execution_result=execution_result or ExecutionResultRecord()
             )
             tasks.append(task)
         logger.info(f"Job {job_id} から {len(tasks)} 件の実行済みTaskを取得しました。")
@@ -619,21 +626,21 @@ class PlanningHistory:
                     y=exec_y,
                     z=exec_z,
                     start_time=exec_start_time,
-                    end_time=exec_end_time,
-                    timestamp=exec_timestamp
+                    end_time=exec_end_time
                 )
             else:
                 execution_result = None
 
             command = CommandRecord(
                 uid=command_id,
-                status=status,
+                task_uid=task_id,
+                _status=status,
                 description=action,
                 sequence_number=seq_num,
                 additional_info=description,
                 args=args,
                 timestamp=timestamp,
-                execution_result=execution_result
+                execution_result=execution_result or CommandExecutionResultRecord()
             )
             commands.append(command)
         logger.info(f"Task {task_id} から {len(commands)} 件の実行済みCommandを取得しました。")
@@ -711,19 +718,19 @@ class PlanningHistory:
                     y=exec_y,
                     z=exec_z,
                     start_time=exec_start_time,
-                    end_time=exec_end_time,
-                    timestamp=exec_timestamp
+                    end_time=exec_end_time
                 )
 
             command = CommandRecord(
                 uid=command_id,
-                status=status,
+                task_uid=task_id,
+                _status=status,
                 description=action,
                 sequence_number=seq_num,
                 additional_info=description,
                 args=args,
                 timestamp=timestamp,
-                execution_result=execution_result
+                execution_result=execution_result or CommandExecutionResultRecord()
             )
             commands.append(command)
         
@@ -776,6 +783,78 @@ class PlanningHistory:
         self._conn.commit()
         logger.info(f"Task {task.uid} の情報を更新しました。")
         
+class FailureEvaluationHistory():
+    """失敗したコマンドに対する生成AIの評価の履歴（ResultEvaluatorがルールの学習に使用する）"""
+    def __init__(self, sqlite_interface: SQLiteInterface):
+        self._sqlite_interface: SQLiteInterface = sqlite_interface
+        self._cursor: sqlite3.Cursor = sqlite_interface._cursor
+        self._conn: sqlite3.Connection = sqlite_interface._conn
+        self._create_table()
+        
+    def _create_table(self):
+        """テーブルを作成（存在しない場合のみ）"""
+        # 過去の実行で学習した内容を引き継ぐ為、他のテーブルと異なり削除しない
+        self._cursor.execute('''
+            CREATE TABLE IF NOT EXISTS FailureEvaluations (
+                evaluation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                command_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detailed_info TEXT,
+                detail_signature TEXT NOT NULL,
+                error_level TEXT NOT NULL,
+                cause TEXT,
+                detail TEXT,
+                solution TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self._conn.commit()
+    
+    def add(self, record: FailureEvaluationRecord) -> int:
+        """
+        評価を追加する
+        
+        Returns:
+            int: 追加した評価のID
+        """
+        self._cursor.execute('''
+            INSERT INTO FailureEvaluations (command_name, status, detailed_info, detail_signature, error_level, cause, detail, solution)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            record.command_name,
+            record.status,
+            record.detailed_info,
+            record.detail_signature,
+            record.error_level,
+            record.cause,
+            record.detail,
+            record.solution
+        ))
+        self._conn.commit()
+        return self._cursor.lastrowid
+    
+    def get_all(self) -> List[FailureEvaluationRecord]:
+        """全ての評価を記録した順に取得する"""
+        self._cursor.execute('''
+            SELECT evaluation_id, command_name, status, detailed_info, detail_signature, error_level, cause, detail, solution
+            FROM FailureEvaluations
+            ORDER BY evaluation_id
+        ''')
+        return [
+            FailureEvaluationRecord(
+                uid=row[0],
+                command_name=row[1],
+                status=row[2],
+                detailed_info=row[3] or "",
+                detail_signature=row[4],
+                error_level=row[5],
+                cause=row[6] or "",
+                detail=row[7] or "",
+                solution=row[8] or ""
+            ) for row in self._cursor.fetchall()
+        ]
+
+        
 # Knowledge
 class Knowledge():
     pass
@@ -995,7 +1074,7 @@ class LocationKnowledge(Knowledge):
         return:
             list: すべてのロケーション情報が含まれたリスト
         """
-        with log.span(name="ロケーション情報を取得") as span:
+        with log.span(name="ロケーション情報を取得", tag={"db"}) as span:
             span.input("get_all_locations")
             
             self._cursor.execute('''
@@ -0,0 +1,259 @@
+"""
+失敗したコマンドの実行結果を、生成AIに問い合わせずにリプランニングデータに分類するルール
+
+ルールはコマンド名、実行結果のstatus、detailed_infoのパターンの組で失敗を識別し、リプランニングのレベルと原因を返す
+    - 組み込みのルール（DEFAULT_RULES）: 対象が見つからない、実行可能なコマンドが無い（errorコマンド）など、レベルが決まっている失敗
+    - 学習したルール: 生成AIの評価の履歴（FailureEvaluationRecord）で、同じシグネチャ（コマンド名、status、detail_signature）の
+      失敗がmin_observations回以上あり、min_agreementの割合以上が同じレベルに評価されている場合に追加する
+
+どのルールにも一致しない失敗のみ生成AIで評価する（ResultEvaluatorが行う）
+
+Example:
+    engine = FailureRuleEngine()
+    engine.observe_all(db.get_failure_evaluations())
+    rule = engine.classify("find", "failure", "椅子 が見つかりません", {"object": "椅子"})
+    if rule is None:
+        ...  # 生成AIで評価して、engine.observe(record)で記録する
+"""
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterable, List, Literal, Mapping, Optional, Pattern, Tuple
+from collections import Counter
+import re
+import threading
+import unicodedata
+
+from planner.database.data_type import FailureEvaluationRecord
+from utils.metrics import default_registry as metrics
+
+_MATCHES = metrics.counter("failure_rule_matches_total", "ルールで分類した失敗の数（source: builtin, learned）", ("source",))
+_LEARNED = metrics.counter("failure_rules_learned_total", "評価の履歴から学習したルールの数")
+
+ErrorLevel = Literal["command_level", "task_level"]
+Signature = Tuple[str, str, str]  # (コマンド名, status, detail_signature)
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_SPACES = re.compile(r"\s+")
+
+
+def failure_signature(detailed_info: str, args: Mapping[str, object] = {}) -> str:
+    """
+    detailed_infoの引数の値を<引数名>に、数値を#に置き換える（引数だけが異なる失敗を同じものとして扱う）
+    例: "椅子 が見つかりません", {"object": "椅子"} -> "<object> が見つかりません"
+    """
+    text = unicodedata.normalize("NFKC", detailed_info or "").strip()
+    # 長い値から置き換える（値が他の値の一部である場合に備える）
+    for name, value in sorted(args.items(), key=lambda item: -len(str(item[1]))):
+        value = unicodedata.normalize("NFKC", str(value)).strip()
+        if value:
+            text = text.replace(value, f"<{name}>")
+    text = _NUMBER.sub("#", text)
+    return _SPACES.sub(" ", text)
+
+
+@dataclass
+class FailureRule():
+    """
+    Args:
+        name: str ルールの名前（ログに使用する）
+        replanning_level: ErrorLevel 一致した場合のリプランニングのレベル
+        cause, detail, solution: str 一致した場合のリプランニングデータ
+        command_name: Optional[str] 対象のコマンド名（Noneの場合は全てのコマンド）
+        status: str 対象の実行結果のstatus
+        detail_pattern: Optional[str] detailed_infoに対する正規表現（re.search、Noneの場合は問わない）
+        detail_signature: Optional[str] failure_signatureの値と完全に一致する場合のみ対象とする（学習したルール）
+    """
+    name: str
+    replanning_level: ErrorLevel
+    cause: str
+    detail: str
+    solution: str
+    command_name: Optional[str] = None
+    status: str = "failure"
+    detail_pattern: Optional[str] = None
+    detail_signature: Optional[str] = None
+    source: Literal["builtin", "learned"] = "builtin"
+    hits: int = 0
+    _pattern: Optional[Pattern] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.detail_pattern is not None:
+            self._pattern = re.compile(self.detail_pattern)
+
+    def matches(self, command_name: str, status: str, detailed_info: str, signature: str) -> bool:
+        if self.status != status:
+            return False
+        if self.command_name is not None and self.command_name != command_name:
+            return False
+        if self.detail_signature is not None and self.detail_signature != signature:
+            return False
+        if self._pattern is not None and not self._pattern.search(detailed_info or ""):
+            return False
+        return True
+
+    def to_replanning_data(self) -> Dict[str, Dict[str, str]]:
+        """EVALUATE_RESULTの応答（REPLANNING_DATA_RESPONSE_SCHEMA）と同じ形式"""
+        return {
+            "1": {
+                "cause": self.cause,
+                "detail": self.detail,
+                "error_level": self.replanning_level,
+                "solution": self.solution,
+            }
+        }
+
+
+# 実行結果からレベルが決まる失敗（標準のコマンド（planner/command/commands/standard_commands.py）と
+# CommandExecutor（引数の誤り）のdetailed_infoに合わせる）
+DEFAULT_RULES: Tuple[FailureRule, ...] = (
+    FailureRule(
+        name="error_command",
+        command_name="error",
+        replanning_level="task_level",
+        cause="タスクを実行できるコマンドが無い",
+        detail="コマンドの生成時に実行可能なコマンドが見つからなかった為、errorコマンドが実行された",
+        solution="タスクの分解を見直し、実行可能なコマンドで達成できるタスクに分割する",
+    ),
+    FailureRule(
+        name="object_not_found",
+        command_name="find",
+        detail_pattern=r"見つかりません|見つからない|not found",
+        replanning_level="command_level",
+        cause="探している物がロボットのカメラの範囲に見つからなかった",
+        detail="findコマンドが対象を見つけられなかった",
+        solution="向きや場所を変えて再度探す",
+    ),
+    FailureRule(
+        name="move_failed",
+        command_name="move",
+        detail_pattern=r"移動できません",
+        replanning_level="command_level",
+        cause="目的地に移動できなかった",
+        detail="moveコマンドが目的地に到達できなかった",
+        solution="既知の場所の名前を確認して再度移動する",
+    ),
+    FailureRule(
+        name="invalid_arguments",
+        detail_pattern=r"引数|argument",
+        replanning_level="command_level",
+        cause="コマンドの引数が正しくない",
+        detail="コマンドが引数の誤りを報告した",
+        solution="コマンドの説明に従って引数を修正したコマンドを生成する",
+    ),
+)
+
+
+class FailureRuleEngine():
+    """
+    Args:
+        rules: Optional[Iterable[FailureRule]] 組み込みのルール（省略した場合はDEFAULT_RULES）
+        learn: bool 評価の履歴からルールを学習する
+        min_observations: int ルールを学習するのに必要な同じシグネチャの評価の数
+        min_agreement: float ルールを学習するのに必要な、最も多いレベルの評価の割合
+    """
+    def __init__(
+        self,
+        rules: Optional[Iterable[FailureRule]] = None,
+        learn: bool = True,
+        min_observations: int = 3,
+        min_agreement: float = 1.0,
+    ):
+        self.learn = learn
+        self.min_observations = min_observations
+        self.min_agreement = min_agreement
+        # ヒット数をエンジンごとに数える為、ルールをコピーする
+        self._rules: List[FailureRule] = [replace(r, hits=0) for r in (DEFAULT_RULES if rules is None else rules)]
+        self._learned: Dict[Signature, FailureRule] = {}
+        self._observations: Dict[Signature, Counter] = {}
+        self._latest: Dict[Tuple[Signature, str], FailureEvaluationRecord] = {}  # (シグネチャ, レベル) -> 最新の評価
+        self._seen: set = set()  # 記録済みの評価のuid（同じ履歴を複数回読み込んだ場合に重複して数えない）
+        self._lock = threading.Lock()
+
+    def add_rule(self, rule: FailureRule):
+        """組み込みのルールを追加する（先に追加したルールを優先する）"""
+        with self._lock:
+            self._rules.append(rule)
+
+    @property
+    def rules(self) -> List[FailureRule]:
+        """学習したルールと組み込みのルール（照合する順）"""
+        with self._lock:
+            return list(self._learned.values()) + list(self._rules)
+
+    def classify(
+        self,
+        command_name: str,
+        status: str,
+        detailed_info: str,
+        args: Mapping[str, object] = {},
+    ) -> Optional[FailureRule]:
+        """
+        一致するルールを返す（無い場合はNone）
+        学習したルール（シグネチャが完全に一致するもの）を組み込みのルールより優先する
+        """
+        signature = failure_signature(detailed_info, args)
+        with self._lock:
+            rule = self._learned.get((command_name, status, signature))
+            if rule is None:
+                rule = next((r for r in self._rules if r.matches(command_name, status, detailed_info, signature)), None)
+            if rule is None:
+                return None
+            rule.hits += 1
+        _MATCHES.inc(source=rule.source)
+        return rule
+
+    def observe(self, record: FailureEvaluationRecord) -> Optional[FailureRule]:
+        """
+        生成AIの評価を記録し、学習の条件を満たした場合はルールを追加する
+
+        Returns:
+            Optional[FailureRule]: この評価で新たに学習したルール
+        """
+        if not self.learn:
+            return None
+        signature: Signature = (record.command_name, record.status, record.detail_signature)
+        with self._lock:
+            if record.uid is not None:
+                if record.uid in self._seen:
+                    return None
+                self._seen.add(record.uid)
+            counts = self._observations.setdefault(signature, Counter())
+            counts[record.error_level] += 1
+            self._latest[(signature, record.error_level)] = record
+
+            level, count = counts.most_common(1)[0]
+            total = sum(counts.values())
+            if total < self.min_observations or count / total < self.min_agreement:
+                # 評価が一致しなくなった場合は学習したルールを取り消す
+                self._learned.pop(signature, None)
+                return None
+            previous = self._learned.get(signature)
+            if previous is not None and previous.replanning_level == level:
+                return None
+            latest = self._latest[(signature, level)]
+            rule = self._learned[signature] = FailureRule(
+                name=f"learned:{record.command_name}:{record.detail_signature}",
+                replanning_level=level,
+                cause=latest.cause,
+                detail=latest.detail,
+                solution=latest.solution,
+                command_name=record.command_name,
+                status=record.status,
+                detail_signature=record.detail_signature,
+                source="learned",
+            )
+        _LEARNED.inc()
+        return rule
+
+    def observe_all(self, records: Iterable[FailureEvaluationRecord]) -> int:
+        """評価の履歴を記録する（学習したルールの数を返す）"""
+        return sum(1 for record in records if self.observe(record) is not None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "builtin_rules": len(self._rules),
+                "learned_rules": len(self._learned),
+                "signatures": len(self._observations),
+                "hits": sum(r.hits for r in list(self._learned.values()) + self._rules),
+            }
+
@@ -0,0 +1,147 @@
+"""
+複数のジョブを1つのプロセスで並行して実行する
+
+ジョブごとにLLMRobotPlanner.fork()で状態（Memory、ロボットの状態）を分離したLLMRobotPlannerを生成し、
+スレッドプールで実行する。生成AIのクライアント（レート制限、キャッシュを含む）とDatabaseManagerは全てのジョブで共有する
+処理時間の大半は生成AIの応答とコマンド（ロボット）の待ち時間の為、スレッドで並行して実行することでスループットが上がる
+
+Example:
+    planner = LLMRobotPlanner(api_keys, commands, states)
+    planner.initialize()
+    with JobManager(planner, max_workers=4) as manager:
+        futures = [manager.submit(instruction) for instruction in instructions]
+        results = [future.result() for future in futures]
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+from planner.llm_robot_planner import LLMRobotPlanner
+from planner.memory import Memory
+from planner.command.command_base import Command
+from planner.command.robot_state import RobotState
+from utils.metrics import default_registry as metrics
+
+import logging
+logger = logging.getLogger("LLMRobotPlanner")
+
+_RUNNING = metrics.gauge("planner_jobs_running", "JobManagerで実行中のジョブ数")
+_JOB_SECONDS = metrics.histogram("planner_job_duration_seconds", "JobManagerで実行したジョブの実行時間（status: success, error）", ("status",))
+
+
+@dataclass
+class JobSpec():
+    """
+    実行するジョブ
+    commands, statesはロボットごとに異なる場合に指定する（LLMRobotPlanner.forkを参照）
+    job_idは呼び出し側がジョブを識別する為のID（JobManagerは使用しない）
+    """
+    instruction: str
+    additional_info: str = ""
+    commands: Optional[List[Command]] = None
+    states: Optional[List[RobotState]] = None
+    job_id: Optional[str] = None
+
+
+@dataclass
+class JobResult():
+    """ジョブの実行結果（errorはprocessが送出した例外、wallは実行時間[s]）"""
+    spec: JobSpec
+    memory: Memory  # ジョブのタスクとコマンドの記録
+    wall: float
+    error: Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class JobManager():
+    """
+    Args:
+        planner: LLMRobotPlanner fork元（初期化済み）のLLMRobotPlanner
+        max_workers: int 同時に実行するジョブの最大数
+        on_start: Optional[Callable[[JobSpec], None]] ジョブの実行を開始する時に、ジョブを実行するスレッドで呼び出す関数
+    """
+    def __init__(
+        self,
+        planner: LLMRobotPlanner,
+        max_workers: int = 4,
+        on_start: Optional[Callable[[JobSpec], None]] = None,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be 1 or more")
+        self.planner = planner
+        self.max_workers = max_workers
+        self.on_start = on_start
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="planner-job")
+        self._lock = threading.Lock()
+        self._running: Dict[int, JobSpec] = {}  # スレッドID -> 実行中のジョブ
+
+    def submit(
+        self,
+        instruction: str,
+        additional_info: str = "",
+        commands: Optional[List[Command]] = None,
+        states: Optional[List[RobotState]] = None,
+    ) -> "Future[JobResult]":
+        """ジョブを実行キューに追加する（processの例外はJobResult.errorに記録し、Futureからは送出しない）"""
+        return self.submit_spec(JobSpec(instruction, additional_info, commands, states))
+
+    def submit_spec(self, spec: JobSpec) -> "Future[JobResult]":
+        return self._executor.submit(self._run, spec)
+
+    def run_all(self, specs: Iterable[JobSpec]) -> List[JobResult]:
+        """全てのジョブを並行して実行し、終了を待って結果をspecsの順に返す"""
+        futures = [self.submit_spec(spec) for spec in specs]
+        return [future.result() for future in futures]
+
+    def job_for_thread(self, thread_id: int) -> Optional[JobSpec]:
+        """スレッドで実行中のジョブ（ログのイベントをジョブに対応付ける為に使用する）"""
+        with self._lock:
+            return self._running.get(thread_id)
+
+    @property
+    def running(self) -> int:
+        """実行中のジョブ数"""
+        with self._lock:
+            return len(self._running)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def __enter__(self) -> "JobManager":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True, cancel_futures=exc_type is not None)
+
+    def _run(self, spec: JobSpec) -> JobResult:
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._running[thread_id] = spec
+        try:
+            if self.on_start is not None:
+                try:
+                    self.on_start(spec)
+                except Exception:
+                    logger.exception("job start callback failed")
+            planner = self.planner.fork(commands=spec.commands, states=spec.states)
+            error = None
+            _RUNNING.inc()
+            start = time.perf_counter()
+            try:
+                planner.process(spec.instruction, spec.additional_info)
+            except Exception as e:
+                logger.exception(f"job failed: {spec.instruction}")
+                error = e
+            finally:
+                wall = time.perf_counter() - start
+                _RUNNING.dec()
+        finally:
+            with self._lock:
+                self._running.pop(thread_id, None)
+        _JOB_SECONDS.observe(wall, status="success" if error is None else "error")
+        return JobResult(spec=spec, memory=planner._memory, wall=wall, error=error)
@@ -0,0 +1,15 @@
+class LLMRequestError(Exception):
+    """生成AIへのリクエストに関連するエラーの基底クラス"""
+    pass
+
+class TransientLLMError(LLMRequestError):
+    """一時的なエラー（レート制限、サーバーの過負荷、通信エラーなど）、再試行で解決する可能性がある"""
+    pass
+
+class LLMTimeoutError(TransientLLMError):
+    """リクエストが期限内に完了しなかった場合のエラー"""
+    pass
+
+class ReplayMissError(LLMRequestError):
+    """記録済みの応答にプロンプトと一致するものが無い場合のエラー"""
+    pass
@@ -1,6 +1,15 @@
-from typing import Union, Dict, Literal, Optional
+from typing import Union, Dict, Literal, Optional, List, Set
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import contextvars
+import threading
+import time
 from planner.llm.wrapper_base import GenAIWrapper
-from planner.llm.wrappers.gemini import GeminiWrapper  # TODO: 後に削除
+from planner.llm.schema import ResponseSchema
+from planner.llm.router import ModelRouter, ModelBackend, PROMPT_MODEL_TIERS
+from planner.llm.request_policy import RequestPolicy, is_transient_error
+from planner.llm.exceptions import LLMTimeoutError
+from utils.single_flight import SingleFlight
+from utils.metrics import default_registry as metrics
 
 import logging
 logger = logging.getLogger("GenAI")
@@ -8,62 +17,256 @@ logger = logging.getLogger("GenAI")
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
+_GENERATION_SECONDS = metrics.histogram("llm_generation_duration_seconds", "generate_contentの所要時間（再試行とその待機を含む）", ("tier", "outcome"))
+_REQUEST_SECONDS = metrics.histogram("llm_request_duration_seconds", "バックエンドへの1回のリクエストの所要時間", ("backend", "outcome"))
+_IN_FLIGHT = metrics.gauge("llm_requests_in_flight", "バックエンドで実行中のリクエスト数", ("backend",))
+_RETRIES = metrics.counter("llm_retries_total", "一時的なエラーによる再試行の回数", ("backend",))
+_HEDGES = metrics.counter("llm_hedged_requests_total", "ヘッジングで送った複製のリクエスト数", ("backend",))
+_TIMEOUTS = metrics.counter("llm_timeouts_total", "期限内に完了しなかったリクエスト数", ("backend",))
+_COALESCED = metrics.counter("llm_coalesced_requests_total", "実行中の同一のリクエストと結果を共有した数")
+
+
+class _Attempt():
+    """1回のリクエスト（ヘッジングで送った複製を含む）の状態"""
+    def __init__(self, backend: ModelBackend):
+        self.backend = backend
+        self.abandoned = False  # 期限切れ、または他の複製が先に完了した
+        self.lock = threading.Lock()
+
+
 class UnifiedAIRequestHandler:
     def __init__(
         self,
         api_keys: Dict[Union[Literal["google"], Literal["openai"]], str],
-        #default_model_name: Optional[str] = None,
+        router: Optional[ModelRouter] = None,
+        policy: Optional[RequestPolicy] = None,
+        max_workers: int = 8,
         ):
-        
-        self._models: dict[str, GenAIWrapper] = {}
+        """
+        Args:
+            api_keys: サービス名とAPI Keyの辞書、routerを省略した場合は対応するモデルを登録する
+                "google": gemini-1.5-flash-002
+                "openai": gpt-4o-mini
+            router: 使用するModelRouter（省略した場合はapi_keysから生成する）
+            policy: リクエストの期限、再試行、ヘッジングの既定の設定
+            max_workers: リクエストを実行するスレッド数
+        """
         self.api_keys = api_keys
-        #self.default_model_name = default_model_name
-        
-        # # check api_keys and get model_lists
-        # for service_name, api_key in api_keys.items():
-        #     if service_name == "google":
-        #         genai.configure(api_key=api_key)
-        #         s = ""
-        #         for m in genai.list_models():
-        #             s += m.name + "\n" 
-        #         logger.debug(s)
-        #     elif service_name == "openai":
-        #         raise NotImplementedError("openai is not supported yet")
-        #     else:
-        #         raise ValueError(f"service_name {service_name} is not supported")
-                
+        if router is None:
+            router = ModelRouter()
+            for service_name, api_key in api_keys.items():
+                if service_name == "google":
+                    from planner.llm.wrappers.gemini import GeminiWrapper
+                    router.register("gemini-1.5-flash-002", GeminiWrapper(api_key, "gemini-1.5-flash-002"))
+                elif service_name == "openai":
+                    from planner.llm.wrappers.open_ai import OpenAIWrapper
+                    router.register("gpt-4o-mini", OpenAIWrapper(api_key, "gpt-4o-mini"))
+                else:
+                    raise ValueError(f"service_name {service_name} is not supported")
+        self._router = router
+        self._policy = policy if policy is not None else RequestPolicy()
+        # 同時に発行された同一のリクエストは1回だけ送信し、結果を共有する
+        self._flight = SingleFlight()
+        # 期限を過ぎたリクエストは中断できない為、呼び出し元とは別のスレッドで実行する
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-request")
+
+    @property
+    def router(self) -> ModelRouter:
+        return self._router
+
+    @property
+    def flight(self) -> SingleFlight:
+        return self._flight
+
     def generate_content(
-        self, 
-        prompt: str, 
+        self,
+        prompt: str,
         model_name: Optional[str] = None,
         *args,
+        response_schema: Optional[ResponseSchema] = None,
+        prompt_name: Optional[str] = None,
+        policy: Optional[RequestPolicy] = None,
         **kwargs
     ) -> str:
         """
         生成コンテンツを取得し、必要に応じて変換します。
 
+        一時的なエラー（期限切れを含む）の場合は指数バックオフで再試行する。
+        再試行ごとにバックエンドを選択し直すため、障害の発生したバックエンドは自動的に回避される
+        同一のリクエストが実行中の場合は新たに送信せず、その結果（または例外）を共有する
+
         Args:
             prompt: 生成のためのプロンプト
-            model_name: 生成に使用するモデル（オプション）
+            model_name: 生成に使用するモデル（オプション、省略した場合はprompt_nameの階層から選択する）
             response_type: 予想される生成結果の形式 ("json" または "any")
             convert_type: 変換後の形式 ("dict", "list", または "none")
+            response_schema: 応答の形式の定義（指定した場合はJSONモードで生成する）
+            prompt_name: プロンプト名（PROMPT_MODEL_TIERSからモデルの階層を決定する）
+            policy: このリクエストの期限、再試行、ヘッジングの設定（省略した場合は既定の設定）
 
         Returns:
             生成結果（文字列、リスト、または辞書）
+
+        Raises:
+            LLMTimeoutError: 全ての試行が期限内に完了しなかった場合
         """
-        
-        with log.span("LLM Generation",metadata={"model": "gemini-1.5-flash"}) as span:
+        policy = policy if policy is not None else self._policy
+        tier = PROMPT_MODEL_TIERS.get(prompt_name) if prompt_name is not None else None
+        key = (
+            prompt, model_name, tier, policy,
+            response_schema.name if response_schema is not None else None,
+            repr(args), repr(sorted(kwargs.items())),
+        )
+
+        with log.span("LLM Generation", tag={"llm"}, metadata={"tier": tier or ""}) as span, \
+                _GENERATION_SECONDS.time(tier=tier or "default", outcome="success") as timer_labels:
             span.input(prompt)
-            response_text = self._get_model(model_name, "generate_content").generate_content(prompt, *args, **kwargs)
+            executed = False
+
+            def generate() -> str:
+                nonlocal executed
+                executed = True
+                return self._generate(span, tier, model_name, policy, prompt, args, dict(kwargs, response_schema=response_schema))
+
+            try:
+                response_text = self._flight.do(key, generate)
+            except Exception:
+                timer_labels["outcome"] = "error"
+                raise
+            if not executed:
+                _COALESCED.inc()
+                span.feedback("coalesced with an identical in-flight request")
             span.output(response_text)
-            
+
             return response_text
 
+    def _generate(self, span, tier: Optional[str], model_name: Optional[str], policy: RequestPolicy, prompt: str, args: tuple, kwargs: dict) -> str:
+        """一時的なエラーの場合は、失敗したバックエンド以外から選択し直して再試行する"""
+        failed: Set[str] = set()
+        for attempt in range(1, policy.max_attempts + 1):
+            backend = self._router.select(tier, model_name, exclude=failed)
+            try:
+                return self._request(backend, tier, policy, prompt, args, dict(kwargs))
+            except Exception as e:
+                if attempt >= policy.max_attempts or not is_transient_error(e):
+                    raise
+                failed.add(backend.name)
+                delay = policy.backoff(attempt)
+                logger.warning(
+                    f"LLM request to '{backend.name}' failed ({attempt}/{policy.max_attempts}): {e!r}. retry in {delay:.2f}s"
+                )
+                span.feedback(f"retry {attempt}/{policy.max_attempts - 1}: {e!r}")
+                _RETRIES.inc(backend=backend.name)
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def _request(
+        self,
+        backend: ModelBackend,
+        tier: Optional[str],
+        policy: RequestPolicy,
+        prompt: str,
+        args: tuple,
+        kwargs: dict,
+    ) -> str:
+        """期限付きで1回リクエストする（ヘッジングが有効な場合は複製を1つまで送る）"""
+        # リクエスト数の制限による待機は期限に含めない
+        backend.wrapper.reserve_request_slot()
+        deadline = time.monotonic() + policy.timeout if policy.timeout is not None else None
+        if policy.timeout is not None:
+            kwargs["timeout"] = policy.timeout
+
+        attempts: Dict[Future, _Attempt] = {}
+        self._submit(attempts, backend, prompt, args, kwargs)
+
+        hedge_at: Optional[float] = None
+        if policy.hedge:
+            hedge_delay = policy.hedge_delay if policy.hedge_delay is not None else backend.stats.p95
+            hedge_at = time.monotonic() + max(policy.min_hedge_delay, hedge_delay or 0.0)
+
+        pending = set(attempts)
+        last_error: Optional[BaseException] = None
+        while pending:
+            wake_times = [t for t in (deadline, hedge_at) if t is not None]
+            timeout = max(0.0, min(wake_times) - time.monotonic()) if wake_times else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                self._abandon(attempts, pending)
+                return result
+
+            if not pending:
+                break
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                self._abandon(attempts, pending)
+                for future in pending:
+                    self._router.record(attempts[future].backend, policy.timeout, ok=False)
+                    _TIMEOUTS.inc(backend=attempts[future].backend.name)
+                raise LLMTimeoutError(f"LLM request did not complete within {policy.timeout}s")
+
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                hedge_backend = self._select_hedge_backend(tier, backend)
+                if not hedge_backend.wrapper.reserve_request_slot(block=False):
+                    # 制限の枠が空くのを待つと複製が遅れる為、送らない
+                    logger.debug(f"skipped hedging LLM request: '{hedge_backend.name}' is rate limited")
+                    continue
+                logger.debug(f"hedging LLM request: '{backend.name}' -> '{hedge_backend.name}'")
+                _HEDGES.inc(backend=hedge_backend.name)
+                pending.add(self._submit(attempts, hedge_backend, prompt, args, kwargs))
+
+        assert last_error is not None
+        raise last_error
+
+    def _submit(self, attempts: Dict[Future, _Attempt], backend: ModelBackend, prompt: str, args: tuple, kwargs: dict) -> Future:
+        # ログのスタックなどのコンテキストを引き継いで実行する
+        attempt = _Attempt(backend)
+        ctx = contextvars.copy_context()
+        future = self._executor.submit(ctx.run, self._call, attempt, prompt, args, kwargs)
+        attempts[future] = attempt
+        return future
+
+    def _call(self, attempt: _Attempt, prompt: str, args: tuple, kwargs: dict) -> str:
+        """
+        バックエンドにリクエストし、レイテンシと成否をルーターに記録する
+        放棄された後の結果は記録しない（期限切れは_requestが失敗として記録済みの為、遅れた成功で除外を解除しない）
+        """
+        start = time.perf_counter()
+        ok = False
+        try:
+            with _IN_FLIGHT.track_inprogress(backend=attempt.backend.name):
+                result = attempt.backend.wrapper.generate_content(prompt, *args, **kwargs)
+            ok = True
+            return result
+        finally:
+            latency = time.perf_counter() - start
+            with attempt.lock:
+                if not attempt.abandoned:
+                    self._router.record(attempt.backend, latency, ok=ok)
+                outcome = "abandoned" if attempt.abandoned else ("success" if ok else "error")
+            _REQUEST_SECONDS.observe(latency, backend=attempt.backend.name, outcome=outcome)
+
+    def _abandon(self, attempts: Dict[Future, _Attempt], pending):
+        """未完了のリクエストを放棄する（開始前であれば取り消し、実行中であれば結果を破棄する）"""
+        for future in pending:
+            attempt = attempts[future]
+            with attempt.lock:
+                attempt.abandoned = True
+            future.cancel()
 
-    def _get_model(self, model_name, supported_generation_methods) -> GenAIWrapper:
-        # TODO: 後で実装
-        model_name = "gemini-1.5-flash-002"
-        if not self._models:
-            logger.debug(f"initializing models: '{model_name}'") # TODO: 後で削除
-            self._models[model_name] = GeminiWrapper(self.api_keys["google"], model_name)
-        return self._models[model_name]
+    def _select_hedge_backend(self, tier: Optional[str], primary: ModelBackend) -> ModelBackend:
+        """ヘッジングに使用するバックエンド（同じ階層で正常な別のバックエンドがあればそれを優先する）"""
+        others: List[ModelBackend] = [
+            b for b in self._router.get_all()
+            if b is not primary and (tier is None or tier in b.tiers) and self._router.is_healthy(b)
+        ]
+        if others:
+            return min(others, key=lambda b: b.stats.p50 if b.stats.p50 is not None else float("inf"))
+        return primary
@@ -1,6 +1,17 @@
 from typing import Union, Dict, Literal, Optional, overload
 import json
 from utils.json_utils import fix_and_parse_json
+from planner.llm.schema import ResponseSchema
+
+class ResponseParseError(ValueError):
+    """生成AIの応答を指定された形式に変換できなかった場合のエラー
+
+    Attributes:
+        reason: str 変換に失敗した理由（応答の本文を含まない）
+    """
+    def __init__(self, reason: str, text: str):
+        self.reason = reason
+        super().__init__(f"{reason}\nresponse_text:{text}")
 
 class Parser():
     pass
@@ -15,6 +26,7 @@ class JsonParser(Parser):
         text: str, 
         response_type: None = None,
         convert_type: None = None,
+        schema: Optional[ResponseSchema] = None,
     ) -> str: ...
 
     @overload
@@ -23,6 +35,7 @@ class JsonParser(Parser):
         text: str, 
         response_type: Literal["json"] = "json",
         convert_type: Literal["dict"] = "dict",
+        schema: Optional[ResponseSchema] = None,
     ) -> dict: ...
 
     @overload
@@ -31,25 +44,37 @@ class JsonParser(Parser):
         text: str,
         response_type: Literal["json"] = "json",
         convert_type: Literal["list"] = "list",
+        schema: Optional[ResponseSchema] = None,
     ) -> list: ...
     
     def parse(
         self,
         text: str,
         response_type: Optional[Literal["json", "any"]] = None,
-        convert_type: Optional[Literal["dict", "list", "none"]] = None
+        convert_type: Optional[Literal["dict", "list", "none"]] = None,
+        schema: Optional[ResponseSchema] = None,
     ):
+        """
+        生成AIの応答を解析する
+
+        Args:
+            text: 生成AIの応答
+            response_type: 応答の形式 ("json" または "any")
+            convert_type: 変換後の形式 ("dict", "list", または "none")
+            schema: 応答の形式の定義（指定した場合は変換後に検証する）
+
+        Raises:
+            ResponseParseError: JSONとして解析できない、またはconvert_typeと型が一致しない場合
+            SchemaValidationError: schemaと一致しない場合
+        """
         if (convert_type is not None and convert_type.lower() != "none" 
             and response_type is not None and response_type.lower() != "any"):
                 # convert 
                 if response_type.lower() == "json":
                     try:
-                        py_obj = json.loads(text)
-                    except json.JSONDecodeError:
-                        try:
-                            py_obj = fix_and_parse_json(text)
-                        except Exception as e:
-                            raise Exception(f"{str(e)}\nresponse_text:{text}")
+                        py_obj = fix_and_parse_json(text)
+                    except Exception as e:
+                        raise ResponseParseError(str(e), text)
                 else:
                     raise ValueError(f"response type: '{response_type}' is not supported")
                 # response type check
@@ -57,15 +82,17 @@ class JsonParser(Parser):
                     if isinstance(py_obj, dict):
                         pass
                     else:
-                        raise ValueError(f"response type: '{type(py_obj)}' is not dict\n{text}")
+                        raise ResponseParseError(f"response type: '{type(py_obj)}' is not dict", text)
                 elif convert_type.lower() == "list":
-                    if isinstance(convert_type, list):
+                    if isinstance(py_obj, list):
                         pass
                     else:
-                        raise ValueError()
+                        raise ResponseParseError(f"response type: '{type(py_obj)}' is not list", text)
                 else:
                     raise ValueError()
                 
+                if schema is not None:
+                    schema.validate(py_obj)
                 response = py_obj
         else:
             response = text
@@ -0,0 +1,114 @@
+from typing import Literal, Optional, Union
+
+from planner.llm.gen_ai import UnifiedAIRequestHandler as LLM
+from planner.llm.parser import JsonParser, ResponseParseError
+from planner.llm.schema import ResponseSchema, SchemaValidationError
+from prompts.utils import get_prompt
+from utils.metrics import default_registry as metrics
+
+from logger.logger import LLMRobotPlannerLogSystem
+log = LLMRobotPlannerLogSystem()
+import logging
+logger = logging.getLogger("LLMRobotPlanner")
+
+
+# 修正の成功率は llm_json_repairs_total{result="repaired"} / llm_json_repairs_total で求める
+_REPAIRS = metrics.counter(
+    "llm_json_repairs_total",
+    "解析に失敗した応答の修正の結果（result: repaired, unrepaired 上限回数まで修正しても解析できなかった, error 修正の問い合わせが失敗した）",
+    ("result",),
+)
+_REPAIR_REQUESTS = metrics.counter("llm_json_repair_requests_total", "応答の修正のために生成AIへ問い合わせた回数")
+
+
+class RepairingJsonParser(JsonParser):
+    """
+    解析に失敗した応答を生成AIに修正させるJsonParser
+
+    解析（またはスキーマの検証）に失敗した場合、元のプロンプト全体を再送して再生成するのではなく、
+    壊れた応答とエラー内容だけを含む短いプロンプト(REPAIR_JSON)で修正を依頼する
+    """
+    def __init__(
+        self,
+        llm: LLM,
+        max_repair_attempts: int = 2,
+        repair_model_name: Optional[str] = None,
+    ):
+        """
+        Args:
+            llm: UnifiedAIRequestHandler
+            max_repair_attempts: int 修正を依頼する最大回数
+            repair_model_name: Optional[str] 修正に使用するモデル（省略した場合はREPAIR_JSONの階層(fast)から選択する）
+        """
+        super().__init__()
+        self._llm = llm
+        self._max_repair_attempts = max_repair_attempts
+        self._repair_model_name = repair_model_name
+
+    def parse(
+        self,
+        text: str,
+        response_type: Optional[Literal["json", "any"]] = None,
+        convert_type: Optional[Literal["dict", "list", "none"]] = None,
+        schema: Optional[ResponseSchema] = None,
+    ):
+        try:
+            return super().parse(text, response_type, convert_type, schema)
+        except (ResponseParseError, SchemaValidationError) as e:
+            error = e
+
+        result = "error"
+        try:
+            response = self._repair(text, response_type, convert_type, schema, error)
+            result = "repaired"
+            return response
+        except (ResponseParseError, SchemaValidationError):
+            result = "unrepaired"
+            raise
+        finally:
+            _REPAIRS.inc(result=result)
+
+    def _repair(
+        self,
+        text: str,
+        response_type: Optional[Literal["json", "any"]],
+        convert_type: Optional[Literal["dict", "list", "none"]],
+        schema: Optional[ResponseSchema],
+        error: Union[ResponseParseError, SchemaValidationError],
+    ):
+        """修正を依頼し、解析できた応答を返す（上限回数まで修正しても解析できない場合は最後のエラーを送出する）"""
+        with log.span(name="JSONの修正：") as span:
+            span.input(f"error:\n{self._describe_error(error)}")
+            for attempt in range(1, self._max_repair_attempts + 1):
+                prompt = get_prompt(
+                    prompt_name="REPAIR_JSON",
+                    replacements={
+                        "error": self._describe_error(error),
+                        "response": text,
+                    },
+                    symbol=("{{", "}}")
+                )
+                _REPAIR_REQUESTS.inc()
+                text = self._llm.generate_content(
+                    prompt=prompt,
+                    model_name=self._repair_model_name,
+                    response_schema=schema,
+                    prompt_name="REPAIR_JSON"
+                )
+                try:
+                    response = super().parse(text, response_type, convert_type, schema)
+                except (ResponseParseError, SchemaValidationError) as e:
+                    logger.debug(f"JSONの修正に失敗しました ({attempt}/{self._max_repair_attempts}): {e}")
+                    error = e
+                    continue
+                span.output(f"{attempt}回目の修正で成功")
+                return response
+
+            span.output(f"{self._max_repair_attempts}回修正しましたが失敗")
+        raise error
+
+    def _describe_error(self, error: Union[ResponseParseError, SchemaValidationError]) -> str:
+        """修正プロンプトに含めるエラー内容（応答の本文は含めない）"""
+        if isinstance(error, SchemaValidationError):
+            return "\n".join(f"- {e}" for e in error.errors)
+        return f"- {error.reason}"
@@ -0,0 +1,40 @@
+from dataclasses import dataclass
+from typing import Optional
+import random
+
+from planner.llm.exceptions import TransientLLMError
+
+
+@dataclass(frozen=True)
+class RequestPolicy():
+    """
+    生成AIへのリクエストの期限、再試行、ヘッジングの設定
+
+    Attributes:
+        timeout: 1回のリクエストの期限[s]（Noneの場合は無期限）
+        max_attempts: 一時的なエラーの場合の最大試行回数（初回を含む）
+        backoff_base: 再試行までの待機時間の基準[s]（試行ごとに2倍にする）
+        backoff_max: 再試行までの待機時間の上限[s]
+        jitter: 待機時間をランダム化する（Full Jitter）
+        hedge: ヘッジングを行う（応答がhedge_delay秒以内に無い場合、同じリクエストをもう1つ送り、先に返った結果を使用する）
+        hedge_delay: ヘッジングを行うまでの待機時間[s]（Noneの場合はバックエンドのレイテンシのp95）
+        min_hedge_delay: hedge_delayの下限[s]（p95の計測回数が少ない場合に過剰なヘッジングを防ぐ）
+    """
+    timeout: Optional[float] = 60.0
+    max_attempts: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 20.0
+    jitter: bool = True
+    hedge: bool = False
+    hedge_delay: Optional[float] = None
+    min_hedge_delay: float = 0.5
+
+    def backoff(self, attempt: int) -> float:
+        """attempt回目（1始まり）の試行が失敗した後の待機時間[s]"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """再試行で解決する可能性のあるエラーか"""
+    return isinstance(e, (TransientLLMError, TimeoutError, ConnectionError))
@@ -0,0 +1,214 @@
+from typing import Dict, List, Optional, Set, Iterable, Literal
+from collections import deque
+import threading
+import time
+
+from planner.llm.wrapper_base import GenAIWrapper
+
+import logging
+logger = logging.getLogger("GenAI")
+
+ModelTier = Literal["fast", "strong"]
+
+# プロンプトごとに使用するモデルの階層
+#   fast: 出力が短く、精度よりも応答速度とコストを優先するプロンプト
+#   strong: プランニングの品質に直結するプロンプト
+PROMPT_MODEL_TIERS: Dict[str, ModelTier] = {
+    "GENERATE_QUERY": "fast",
+    "EVALUATE_RESULT": "fast",
+    "REPAIR_JSON": "fast",
+    "GENERATE_TASKS": "strong",
+    "REGENERATE_TASKS": "strong",
+    "generate_commands_from_task": "strong",
+    "REGENERATE_COMMANDS_FROM_TASK": "strong",
+    "REGENERATE_COMMANDS_PATCH": "strong",
+}
+
+
+class BackendStats():
+    """
+    バックエンドの直近のリクエストのレイテンシとエラー率を保持するクラス
+
+    Args:
+        window: int 集計する直近のリクエスト数
+    """
+    def __init__(self, window: int = 100):
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window)  # 成功したリクエストのレイテンシ[s]
+        self._results: deque = deque(maxlen=window)  # 成功: True, 失敗: False
+        self.consecutive_failures: int = 0
+        self.last_failure_time: Optional[float] = None
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._results.append(ok)
+            if ok:
+                self._latencies.append(latency)
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+                self.last_failure_time = time.monotonic()
+
+    def reset(self):
+        """エラー率の集計をリセットする（レイテンシの記録は残す）"""
+        with self._lock:
+            self._results.clear()
+            self.consecutive_failures = 0
+
+    @property
+    def count(self) -> int:
+        return len(self._results)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._results:
+                return 0.0
+            return self._results.count(False) / len(self._results)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """成功したリクエストのレイテンシのq分位点（0 <= q <= 1, 記録が無い場合はNone）"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "p50": self.p50,
+            "p95": self.p95,
+            "error_rate": self.error_rate,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class ModelBackend():
+    """ルーターに登録されたバックエンド（モデル）"""
+    def __init__(self, name: str, wrapper: GenAIWrapper, tiers: Iterable[ModelTier], window: int = 100):
+        self.name = name
+        self.wrapper = wrapper
+        self.tiers: Set[str] = set(tiers)
+        self.stats = BackendStats(window)
+
+
+class ModelRouter():
+    """
+    複数のGenAIWrapperを登録し、プロンプトの階層に応じて最も高速で正常なバックエンドを選択するクラス
+
+    選択の規則
+        1. model_nameが指定され、登録されている場合はそのバックエンド
+        2. 階層に対応するバックエンドのうち、正常なもの（excludeに含まれるもの以外、全て含まれる場合は除外しない）
+            - 計測回数がmin_samples未満のものがあれば優先して計測する
+            - それ以外はレイテンシのp50が最も小さいもの
+        3. 正常なバックエンドが無い場合は、最後に失敗してから最も時間が経過したもの
+
+    正常の判定: 連続失敗回数がmax_consecutive_failures未満、かつエラー率がmax_error_rate以下
+    （エラー率は計測回数がmin_samples以上の場合のみ判定する）
+    除外されたバックエンドは最後の失敗からcooldown秒経過すると再び試す（half-open、他の正常なバックエンドより優先する）
+    再試行に成功した場合はエラー率の集計をリセットし、失敗した場合は再びcooldown秒除外する
+    """
+    def __init__(
+        self,
+        max_error_rate: float = 0.5,
+        max_consecutive_failures: int = 3,
+        cooldown: float = 30.0,
+        min_samples: int = 3,
+        window: int = 100,
+    ):
+        self._backends: Dict[str, ModelBackend] = {}
+        self._max_error_rate = max_error_rate
+        self._max_consecutive_failures = max_consecutive_failures
+        self._cooldown = cooldown
+        self._min_samples = min_samples
+        self._window = window
+
+    def register(self, name: str, wrapper: GenAIWrapper, tiers: Iterable[ModelTier] = ("fast", "strong")) -> ModelBackend:
+        """
+        バックエンドを登録する
+
+        Args:
+            name: str バックエンド名（generate_contentのmodel_nameで指定する名前）
+            wrapper: GenAIWrapper
+            tiers: Iterable[ModelTier] このバックエンドが担当する階層
+        """
+        if name in self._backends:
+            raise ValueError(f"backend: '{name}' is already registered. backend name must be unique")
+        backend = ModelBackend(name, wrapper, tiers, self._window)
+        self._backends[name] = backend
+        return backend
+
+    def get_all(self) -> List[ModelBackend]:
+        return list(self._backends.values())
+
+    def _is_tripped(self, stats: BackendStats) -> bool:
+        """連続失敗回数またはエラー率が除外の条件を満たしている"""
+        if stats.consecutive_failures >= self._max_consecutive_failures:
+            return True
+        return stats.count >= self._min_samples and stats.error_rate > self._max_error_rate
+
+    def is_half_open(self, backend: ModelBackend) -> bool:
+        """除外の条件を満たしているが、cooldown秒経過した為に再び試す状態"""
+        stats = backend.stats
+        return (
+            self._is_tripped(stats)
+            and stats.last_failure_time is not None
+            and time.monotonic() - stats.last_failure_time >= self._cooldown
+        )
+
+    def is_healthy(self, backend: ModelBackend) -> bool:
+        return not self._is_tripped(backend.stats) or self.is_half_open(backend)
+
+    def select(
+        self,
+        tier: Optional[str] = None,
+        model_name: Optional[str] = None,
+        exclude: Iterable[str] = (),
+    ) -> ModelBackend:
+        """
+        リクエストを送るバックエンドを選択する
+
+        Args:
+            tier: Optional[str] プロンプトの階層（Noneの場合は全てのバックエンドが対象）
+            model_name: Optional[str] 使用するバックエンド名
+            exclude: Iterable[str] 選択しないバックエンド名（同じリクエストの再試行で、失敗したバックエンドを再び選択しない為）
+        """
+        if not self._backends:
+            raise ValueError("no backend is registered")
+        if model_name is not None:
+            if model_name in self._backends:
+                return self._backends[model_name]
+            logger.warning(f"model: '{model_name}' is not registered. select a backend by tier")
+
+        candidates = [b for b in self._backends.values() if tier is None or tier in b.tiers]
+        if not candidates:
+            candidates = list(self._backends.values())
+        exclude = set(exclude)
+        remaining = [b for b in candidates if b.name not in exclude]
+        if remaining:
+            # 計測回数が少ないバックエンドを優先する為、失敗したバックエンドを除外しないと再試行が全て同じバックエンドに送られる
+            candidates = remaining
+
+        healthy = [b for b in candidates if self.is_healthy(b)]
+        if not healthy:
+            return min(candidates, key=lambda b: b.stats.last_failure_time or 0.0)
+
+        for backend in healthy:
+            if self.is_half_open(backend) or backend.stats.count < self._min_samples:
+                return backend
+        return min(healthy, key=lambda b: b.stats.p50 if b.stats.p50 is not None else float("inf"))
+
+    def record(self, backend: ModelBackend, latency: float, ok: bool):
+        if ok and self._is_tripped(backend.stats):
+            # 除外していたバックエンドの再試行に成功した為、過去の失敗を集計から除く
+            backend.stats.reset()
+        backend.stats.record(latency, ok)
@@ -0,0 +1,345 @@
+"""
+生成AIの応答（JSON）の形式を宣言的に定義し、検証するモジュール
+
+スキーマはJSON Schema（OpenAPI Schema）のサブセットで記述する
+    type: "object" | "array" | "string" | "integer" | "number" | "boolean" | "null"（リストで複数指定可）
+    properties / required / additionalProperties / minProperties: object用
+    items / minItems: array用
+    enum: 値の候補
+スキーマは生成時に一度だけ検証関数（クロージャ）にコンパイルされるため、検証時にスキーマの解釈は行わない
+必須ではないプロパティの値がnullの場合は省略されたものとして扱う
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+JsonPath = Tuple[Union[str, int], ...]
+_Validator = Callable[[Any, JsonPath, List["SchemaError"]], None]
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+class SchemaError():
+    """スキーマとの不一致1件分の情報"""
+    def __init__(self, path: JsonPath, message: str):
+        self.path = path
+        self.message = message
+
+    @property
+    def path_str(self) -> str:
+        s = "$"
+        for p in self.path:
+            s += f"[{p}]" if isinstance(p, int) else f".{p}"
+        return s
+
+    def __str__(self) -> str:
+        return f"{self.path_str}: {self.message}"
+
+    def __repr__(self) -> str:
+        return f"SchemaError({self.path_str!r}, {self.message!r})"
+
+
+class SchemaValidationError(ValueError):
+    """生成AIの応答がスキーマと一致しない場合のエラー"""
+    def __init__(self, schema_name: str, errors: List[SchemaError]):
+        self.schema_name = schema_name
+        self.errors = errors
+        super().__init__(f"response does not match schema '{schema_name}':\n" + "\n".join(f"- {e}" for e in errors))
+
+
+def _compile(schema: Dict[str, Any]) -> _Validator:
+    checks: List[_Validator] = []
+
+    types = schema.get("type")
+    if types is not None:
+        type_list = [types] if isinstance(types, str) else list(types)
+        type_funcs = [_TYPE_CHECKS[t] for t in type_list]
+        expected = " or ".join(type_list)
+
+        def check_type(value, path, errors):
+            for f in type_funcs:
+                if f(value):
+                    return
+            errors.append(SchemaError(path, f"expected {expected}, got {type(value).__name__}"))
+        checks.append(check_type)
+
+    if "enum" in schema:
+        enum = tuple(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value not in enum:
+                errors.append(SchemaError(path, f"expected one of {list(enum)}, got {value!r}"))
+        checks.append(check_enum)
+
+    properties = {k: _compile(v) for k, v in schema.get("properties", {}).items()}
+    required = tuple(schema.get("required", ()))
+    additional = schema.get("additionalProperties")
+    additional_validator = _compile(additional) if isinstance(additional, dict) else None
+    min_properties = schema.get("minProperties")
+    if properties or required or additional_validator or min_properties:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for key in required:
+                if key not in value:
+                    errors.append(SchemaError(path, f"missing required property '{key}'"))
+            if min_properties is not None and len(value) < min_properties:
+                errors.append(SchemaError(path, f"expected at least {min_properties} properties, got {len(value)}"))
+            for key, v in value.items():
+                validator = properties.get(key, additional_validator)
+                if validator is not None and not (v is None and key not in required):
+                    validator(v, path + (key,), errors)
+        checks.append(check_object)
+
+    items = schema.get("items")
+    items_validator = _compile(items) if items is not None else None
+    min_items = schema.get("minItems")
+    if items_validator is not None or min_items:
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return
+            if min_items is not None and len(value) < min_items:
+                errors.append(SchemaError(path, f"expected at least {min_items} items, got {len(value)}"))
+            if items_validator is not None:
+                for i, v in enumerate(value):
+                    items_validator(v, path + (i,), errors)
+        checks.append(check_array)
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def check_all(value, path, errors):
+        for check in checks:
+            check(value, path, errors)
+    return check_all
+
+
+def _to_gemini_schema(schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    GeminiのGenerationConfig.response_schemaに渡せる形式に変換する
+    Geminiが対応していない指定（additionalPropertiesによる任意のキー、null以外の複数の型）を含む場合はNoneを返す
+    """
+    if isinstance(schema.get("additionalProperties"), dict):
+        return None
+    s: Dict[str, Any] = {}
+    types = schema.get("type")
+    if types is not None:
+        type_list = [types] if isinstance(types, str) else [t for t in types if t != "null"]
+        if len(type_list) != 1:
+            # 最初の型のみに制限すると、他の型の値を生成できなくなる為
+            return None
+        s["type"] = type_list[0].upper()
+        if "null" in (types if not isinstance(types, str) else ()):
+            s["nullable"] = True
+    if "enum" in schema:
+        s["enum"] = list(schema["enum"])
+    if "properties" in schema:
+        properties = {}
+        for k, v in schema["properties"].items():
+            p = _to_gemini_schema(v)
+            if p is None:
+                return None
+            properties[k] = p
+        s["properties"] = properties
+    if "required" in schema:
+        s["required"] = list(schema["required"])
+    if "items" in schema:
+        items = _to_gemini_schema(schema["items"])
+        if items is None:
+            return None
+        s["items"] = items
+    return s
+
+
+class ResponseSchema():
+    """
+    プロンプトごとの応答形式の定義
+
+    Attributes:
+        name: str スキーマ名（エラーメッセージに使用）
+        schema: dict スキーマの定義
+        gemini_schema: Optional[dict] Geminiのresponse_schemaに渡す形式（非対応の場合はNone, JSONモードのみ使用する）
+    """
+    def __init__(self, name: str, schema: Dict[str, Any]):
+        self.name = name
+        self.schema = schema
+        self.gemini_schema = _to_gemini_schema(schema)
+        self._validator = _compile(schema)
+
+    def errors(self, value: Any) -> List[SchemaError]:
+        """スキーマとの不一致のリストを返す（一致する場合は空のリスト）"""
+        errors: List[SchemaError] = []
+        self._validator(value, (), errors)
+        return errors
+
+    def validate(self, value: Any) -> Any:
+        """
+        スキーマと一致するか検証する
+
+        Raises:
+            SchemaValidationError: スキーマと一致しない場合
+        """
+        errors = self.errors(value)
+        if errors:
+            raise SchemaValidationError(self.name, errors)
+        return value
+
+
+# --- 各プロンプトの応答形式 ---
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+_ID = {"type": ["integer", "string"]}
+_ID_LIST = {"type": "array", "items": _ID}
+
+# GENERATE_TASKS, REGENERATE_TASKS
+TASKS_RESPONSE_SCHEMA = ResponseSchema("tasks", {
+    "type": "object",
+    "required": ["tasks"],
+    "properties": {
+        "tasks": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["task_description", "task_reason", "task_outcome"],
+                "properties": {
+                    "task_sequence_number": _ID,
+                    "task_description": {"type": "string"},
+                    "task_additional_info": {"type": ["string", "null"]},
+                    "task_dependencies": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["dependency_task_sequence_number", "reason"],
+                            "properties": {
+                                "dependency_task_sequence_number": _ID,
+                                "reason": {"type": "string"},
+                                "required_outcome_desired_information_uids": _ID_LIST,
+                                "required_outcome_desired_robot_state_uids": _ID_LIST,
+                            },
+                        },
+                    },
+                    "task_environmental_conditions": {
+                        "type": "object",
+                        "properties": {
+                            "required_physical_conditions": _STRING_LIST,
+                            "required_information_conditions": {
+                                "type": "object",
+                                "properties": {
+                                    "required_information_locations": _STRING_LIST,
+                                    "required_information_objects": _STRING_LIST,
+                                },
+                            },
+                        },
+                    },
+                    "task_reason": {"type": "string"},
+                    "task_outcome": {
+                        "type": "object",
+                        "properties": {
+                            "desired_information": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "required": ["uid", "description"],
+                                    "properties": {
+                                        "uid": _ID,
+                                        "description": {"type": "string"},
+                                    },
+                                },
+                            },
+                            "desired_robot_state": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "required": ["uid", "state_name"],
+                                    "properties": {
+                                        "uid": _ID,
+                                        "state_name": {"type": "string"},
+                                        "state_args": _STRING_LIST,
+                                    },
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+})
+
+# generate_commands_from_task, REGENERATE_COMMANDS_FROM_TASK
+# {"command1": {"name": "move", "args": {"location": "机"}}, ...}
+COMMANDS_RESPONSE_SCHEMA = ResponseSchema("commands", {
+    "type": "object",
+    "minProperties": 1,
+    "additionalProperties": {
+        "type": "object",
+        "required": ["name", "args"],
+        "properties": {
+            "name": {"type": "string"},
+            "args": {"type": "object"},
+        },
+    },
+})
+
+# REGENERATE_COMMANDS_PATCH（indexは残りのプラン（未実行のコマンド）の1から始まる番号）
+# {"operations": [{"op": "insert", "index": 1, "command": {"name": "find", "args": {"object": "椅子"}}}, {"op": "delete", "index": 2}]}
+COMMAND_PATCH_RESPONSE_SCHEMA = ResponseSchema("command_patch", {
+    "type": "object",
+    "required": ["operations"],
+    "properties": {
+        "operations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["op", "index"],
+                "properties": {
+                    "op": {"type": "string", "enum": ["insert", "replace", "delete"]},
+                    "index": {"type": "integer"},
+                    "command": {
+                        "type": "object",
+                        "required": ["name", "args"],
+                        "properties": {
+                            "name": {"type": "string"},
+                            # 引数はコマンドごとに異なる（任意のキーを許可する為、JSONモードのみ使用する）
+                            "args": {"type": "object", "additionalProperties": {}},
+                        },
+                    },
+                },
+            },
+        },
+    },
+})
+
+# EVALUATE_RESULT
+# {"1": {"cause": "...", "detail": "...", "error_level": "command_level", "solution": "..."}, ...}
+REPLANNING_DATA_RESPONSE_SCHEMA = ResponseSchema("replanning_data", {
+    "type": "object",
+    "minProperties": 1,
+    "additionalProperties": {
+        "type": "object",
+        "required": ["cause", "detail", "error_level", "solution"],
+        "properties": {
+            "cause": {"type": "string"},
+            "detail": {"type": "string"},
+            "error_level": {"type": "string", "enum": ["command_level", "task_level"]},
+            "solution": {"type": "string"},
+        },
+    },
+})
+
+# GENERATE_QUERY
+RAG_QUERY_RESPONSE_SCHEMA = ResponseSchema("rag_query", {
+    "type": "object",
+    "required": ["query"],
+    "properties": {
+        "query": _STRING_LIST,
+    },
+})
@@ -3,4 +3,26 @@ from abc import ABC, abstractmethod
 class GenAIWrapper(ABC):
     @abstractmethod
     def generate_content(self, prompt, model=None, *args, **kwargs) -> str:
-        pass
\ No newline at end of file
+        """
+        Args:
+            prompt: プロンプト
+            response_schema: Optional[ResponseSchema] (キーワード引数) 応答の形式の定義
+                対応しているモデルはJSONモード（および構造化出力）で生成する。非対応のモデルは無視してよい
+            timeout: Optional[float] (キーワード引数) リクエストの期限[s]
+        Raises:
+            TransientLLMError: 再試行で解決する可能性のあるエラー（レート制限、過負荷、通信エラー）
+            LLMTimeoutError: 期限内に応答が無い場合
+        """
+        pass
+
+    def reserve_request_slot(self, block: bool = True) -> bool:
+        """
+        リクエスト数の制限がある場合に、1回分の枠を予約する（UnifiedAIRequestHandlerがgenerate_contentの前に呼び出す）
+        制限による待機をリクエストの期限に含めない為、generate_contentの中では待機しない
+
+        Args:
+            block: bool 枠が空くまで待機する（Falseの場合は空いていなければ予約せずにFalseを返す）
+        Returns:
+            bool: 予約できたか
+        """
+        return True
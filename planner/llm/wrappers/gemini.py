@@ -1,38 +1,82 @@
 import time
+import threading
 from collections import deque
 import google.generativeai as genai
 from google.generativeai import GenerationConfig
-from planner.llm.gen_ai import GenAIWrapper
+from google.api_core import exceptions as google_exceptions
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.exceptions import TransientLLMError, LLMTimeoutError
+from utils.metrics import default_registry as metrics
+
+_TOKENS = metrics.counter("gemini_tokens_total", "Geminiのトークン数（kind: prompt, completion）", ("model", "kind"))
+_TOKENS_PER_REQUEST = metrics.histogram("gemini_tokens_per_request", "1回のリクエストのGeminiのトークン数（kind: prompt, completion）", ("model", "kind"))
+_THROTTLE_SECONDS = metrics.counter("gemini_throttle_wait_seconds_total", "無料枠のリクエスト数の制限で待機した時間[s]", ("model",))
+
+# 再試行で解決する可能性のあるエラー
+_TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
 
 class GeminiWrapper(GenAIWrapper):
+    """
+    Geminiの無料枠を超えない為に、60秒間のリクエストを15回に制限する
+    generate_contentは制限しない為、呼び出し側（UnifiedAIRequestHandler）がreserve_request_slotで枠を予約してから呼び出す
+    """
     def __init__(self, api_key, model_name, *args, **kwargs):
         genai.configure(api_key=api_key, *args, **kwargs)
         config = GenerationConfig(temperature=0.0)
         self.model = genai.GenerativeModel(model_name, generation_config=config)
+        self._model_name = model_name
 
-        self._request_times = deque(maxlen=15)  # 直近15回のリクエスト時間を保持
-        
-    def generate_content(self, prompt, *args, **kwargs) -> str:
-        self._throttle_requests()  # リクエスト制御
-        
-        response = self.model.generate_content(prompt, *args, **kwargs)
+        self._request_times = deque(maxlen=15)  # 直近15回のリクエスト（予約した枠）の時間を保持
+        self._request_lock = threading.Lock()
+
+    def generate_content(self, prompt, *args, response_schema=None, timeout=None, **kwargs) -> str:
+        if response_schema is not None:
+            # JSONモード、Geminiが対応している形式であれば構造化出力で生成する
+            kwargs["generation_config"] = GenerationConfig(
+                temperature=0.0,
+                response_mime_type="application/json",
+                response_schema=response_schema.gemini_schema,
+            )
+        if timeout is not None:
+            kwargs["request_options"] = {"timeout": timeout}
+        try:
+            response = self.model.generate_content(prompt, *args, **kwargs)
+        except google_exceptions.DeadlineExceeded as e:
+            raise LLMTimeoutError(str(e)) from e
+        except _TRANSIENT_ERRORS as e:
+            raise TransientLLMError(str(e)) from e
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            _TOKENS.inc(usage.prompt_token_count or 0, model=self._model_name, kind="prompt")
+            _TOKENS.inc(usage.candidates_token_count or 0, model=self._model_name, kind="completion")
+            _TOKENS_PER_REQUEST.observe(usage.prompt_token_count or 0, model=self._model_name, kind="prompt")
+            _TOKENS_PER_REQUEST.observe(usage.candidates_token_count or 0, model=self._model_name, kind="completion")
         return response.text
     
-    def _throttle_requests(self):
+    def reserve_request_slot(self, block: bool = True) -> bool:
         """
-        リクエストを制御する
-        15回のリクエストが60秒以内に行われた場合、Geminiの無料枠を超えない為に待機する
+        リクエストの枠を予約する
+        15回のリクエストが60秒以内に行われた場合、Geminiの無料枠を超えない為に最も古いリクエストから60秒後まで待機する
+        複数のスレッドが同じ枠を使用しないように、待機する前にロックの中で枠の時間を履歴に追加する
         """
-        # 現在の時間を取得
-        current_time = time.time()
-        
-        # リクエストの履歴を更新
-        if len(self._request_times) == 15:
-            # 15回分の記録がある場合、最初のリクエスト時間を確認
-            if current_time - self._request_times[0] < 60:
-                wait_time = 60 - (current_time - self._request_times[0])
-                print(f"Rate limit reached. Waiting for {wait_time:.2f} seconds.")
-                time.sleep(wait_time)
-        
-        # 現在の時間をリクエスト履歴に追加
-        self._request_times.append(current_time)
+        with self._request_lock:
+            current_time = time.time()
+            slot_time = current_time
+            if len(self._request_times) == self._request_times.maxlen:
+                # 15回分の記録がある場合、最初のリクエストから60秒後まで次の枠は無い
+                slot_time = max(current_time, self._request_times[0] + 60)
+            if slot_time > current_time and not block:
+                return False
+            self._request_times.append(slot_time)
+
+        wait_time = slot_time - current_time
+        if wait_time > 0:
+            print(f"Rate limit reached. Waiting for {wait_time:.2f} seconds.")
+            _THROTTLE_SECONDS.inc(wait_time, model=self._model_name)
+            time.sleep(wait_time)
+        return True
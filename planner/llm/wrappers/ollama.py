@@ -1,5 +1,52 @@
-import ollama
+from typing import Optional
+import json
+import socket
+import urllib.error
+import urllib.request
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.exceptions import TransientLLMError, LLMTimeoutError
+
 
 class OllamaWrapper(GenAIWrapper):
-    def __init__(self) -> None:
-        pass
\ No newline at end of file
+    """
+    OllamaのREST API(/api/generate)を使用するラッパー
+
+    Args:
+        model_name: str Ollamaのモデル名 (例: "llama3.1:8b")
+        host: str OllamaサーバーのURL
+        timeout: Optional[float] HTTPリクエストのタイムアウト[s]
+    """
+    def __init__(self, model_name: str, host: str = "http://localhost:11434", timeout: Optional[float] = None) -> None:
+        self.model_name = model_name
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+
+    def generate_content(self, prompt, *args, response_schema=None, timeout=None, **kwargs) -> str:
+        body = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": 0.0},
+        }
+        if response_schema is not None:
+            body["format"] = "json"
+        request = urllib.request.Request(
+            f"{self.host}/api/generate",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout if timeout is not None else self.timeout) as response:
+                return json.loads(response.read().decode("utf-8"))["response"]
+        except urllib.error.HTTPError as e:
+            # 429（レート制限）と5xx（サーバーの過負荷など）は一時的なエラー
+            if e.code == 429 or e.code >= 500:
+                raise TransientLLMError(f"ollama returned HTTP {e.code}") from e
+            raise
+        except socket.timeout as e:
+            raise LLMTimeoutError(str(e)) from e
+        except urllib.error.URLError as e:
+            if isinstance(e.reason, socket.timeout):
+                raise LLMTimeoutError(str(e.reason)) from e
+            raise TransientLLMError(str(e.reason)) from e
@@ -0,0 +1,96 @@
+from typing import Callable, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+
+class OllamaStubServer():
+    """
+    Ollama互換のREST API(/api/generate, /api/tags)を提供するローカルのスタンドインサーバー
+
+    ネットワークやGPUが無い環境でOllamaWrapperやModelRouterを動作させる為に使用する
+
+    Args:
+        responder: Callable[[dict], str] リクエストボディ(dict)を受け取り、生成結果の文字列を返す関数
+        latency: float 応答までの擬似的な遅延[s]
+        host: str 待ち受けるアドレス
+        port: int 待ち受けるポート（0の場合は空いているポートを使用する）
+
+    Example:
+        with OllamaStubServer(lambda body: '{"query": []}') as server:
+            llm = OllamaWrapper("stub", host=server.url)
+    """
+    def __init__(
+        self,
+        responder: Callable[[dict], str],
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.responder = responder
+        self.latency = latency
+        self.request_count = 0
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "OllamaStubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "OllamaStubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "stub"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length).decode("utf-8"))
+                stub.request_count += 1
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+                self._send_json({
+                    "model": body.get("model", ""),
+                    "response": stub.responder(body),
+                    "done": True,
+                })
+
+            def _send_json(self, obj):
+                data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,2 +1,34 @@
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.exceptions import TransientLLMError, LLMTimeoutError
+
+
 class OpenAIWrapper(GenAIWrapper):
-    pass
\ No newline at end of file
+    def __init__(self, api_key, model_name, *args, **kwargs):
+        try:
+            from openai import OpenAI
+        except ImportError:
+            raise ValueError(
+                "The openai python package is not installed. Please install it with `pip install openai`"
+            )
+        self._client = OpenAI(api_key=api_key, *args, **kwargs)
+        self.model_name = model_name
+
+    def generate_content(self, prompt, *args, response_schema=None, timeout=None, **kwargs) -> str:
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        if response_schema is not None:
+            # JSONモード
+            kwargs["response_format"] = {"type": "json_object"}
+        import openai
+        try:
+            response = self._client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                **kwargs
+            )
+        except openai.APITimeoutError as e:
+            raise LLMTimeoutError(str(e)) from e
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            raise TransientLLMError(str(e)) from e
+        return response.choices[0].message.content or ""
@@ -0,0 +1,250 @@
+from typing import Dict, List, Literal, Optional, Set
+from abc import ABC, abstractmethod
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from planner.llm.wrapper_base import GenAIWrapper
+from planner.llm.exceptions import ReplayMissError, LLMTimeoutError
+
+import logging
+logger = logging.getLogger("GenAI")
+
+
+# --- 擬似的なレイテンシ ---
+
+class LatencyModel(ABC):
+    """リプレイ時の擬似的なレイテンシの分布"""
+    @abstractmethod
+    def sample(self, rng: random.Random, recorded: Optional[float]) -> float:
+        """
+        Args:
+            rng: random.Random シード付きの乱数生成器
+            recorded: Optional[float] 記録時の実際のレイテンシ[s]（記録が無い場合はNone）
+        """
+        pass
+
+class ConstantLatency(LatencyModel):
+    """常に一定のレイテンシ"""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def sample(self, rng: random.Random, recorded: Optional[float]) -> float:
+        return self.seconds
+
+class LogNormalLatency(LatencyModel):
+    """
+    対数正規分布のレイテンシ（LLM APIの応答時間は右に裾の長い分布になる）
+
+    Args:
+        median: float 中央値[s]
+        sigma: float log(レイテンシ)の標準偏差（大きいほど裾が長い）
+        max_seconds: Optional[float] 上限[s]
+    """
+    def __init__(self, median: float, sigma: float = 0.5, max_seconds: Optional[float] = None):
+        self.median = median
+        self.sigma = sigma
+        self.max_seconds = max_seconds
+
+    def sample(self, rng: random.Random, recorded: Optional[float]) -> float:
+        seconds = rng.lognormvariate(math.log(self.median), self.sigma)
+        if self.max_seconds is not None:
+            seconds = min(seconds, self.max_seconds)
+        return seconds
+
+class RecordedLatency(LatencyModel):
+    """
+    記録時の実際のレイテンシをscale倍したもの（記録が無い場合はdefault）
+    """
+    def __init__(self, scale: float = 1.0, default: float = 0.0):
+        self.scale = scale
+        self.default = default
+
+    def sample(self, rng: random.Random, recorded: Optional[float]) -> float:
+        if recorded is None:
+            return self.default
+        return recorded * self.scale
+
+
+# --- 記録と再生 ---
+
+def prompt_key(prompt: str, schema_name: Optional[str] = None) -> str:
+    """プロンプト（と応答のスキーマ名）から記録のキーを生成する"""
+    h = hashlib.sha256(prompt.encode("utf-8"))
+    if schema_name is not None:
+        h.update(b"\0" + schema_name.encode("utf-8"))
+    return h.hexdigest()
+
+def _shingles(text: str, n: int = 3) -> Set[str]:
+    """近いプロンプトの検索に使用する文字n-gramの集合（日本語は単語で区切れない為、文字単位にする）"""
+    text = re.sub(r"\s+", " ", text).strip()
+    if len(text) < n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _Entry():
+    def __init__(self, record: dict):
+        self.key: str = record["key"]
+        self.prompt: str = record["prompt"]
+        self.schema: Optional[str] = record.get("schema")
+        self.response: str = record["response"]
+        self.latency: Optional[float] = record.get("latency")
+
+
+class RecordReplayWrapper(GenAIWrapper):
+    """
+    プロンプトと応答の組を記録し、再生するGenAIWrapper
+
+    ネットワークやAPI Keyの無い環境でLLMRobotPlanner.processを決定的に実行する（ベンチマークなど）為に使用する
+
+    記録形式: gzip圧縮したJSON Lines（1行1リクエスト）
+        {"key": sha256(prompt, schema), "prompt": str, "schema": Optional[str], "response": str, "latency": float}
+
+    mode
+        "record": innerにリクエストし、結果を記録する
+        "replay": 記録から応答を返す（innerは使用しない）
+            - キーが一致する記録が複数ある場合は記録順に返す（最後の記録は繰り返し返す）
+            - 一致する記録が無い場合はnearest=Trueであれば、スキーマ名が一致する記録のうち文字3-gramのJaccard係数が最も大きい記録を返す
+              （スキーマ名が一致する記録が無い場合、類似度がmin_similarity未満の場合はReplayMissError）
+
+    Args:
+        archive_path: str 記録ファイルのパス
+        mode: Literal["record", "replay"]
+        inner: Optional[GenAIWrapper] 記録時にリクエストするラッパー
+        latency: Optional[LatencyModel] 再生時の擬似的なレイテンシ（Noneの場合は待機しない）
+        nearest: bool 一致する記録が無い場合に近いプロンプトの記録を使用する
+        min_similarity: float nearestで使用する類似度の下限
+        seed: int レイテンシの乱数のシード
+    """
+    def __init__(
+        self,
+        archive_path: str,
+        mode: Literal["record", "replay"] = "replay",
+        inner: Optional[GenAIWrapper] = None,
+        latency: Optional[LatencyModel] = None,
+        nearest: bool = True,
+        min_similarity: float = 0.2,
+        seed: int = 0,
+    ):
+        if mode == "record" and inner is None:
+            raise ValueError("inner wrapper is required in record mode")
+        if mode not in ("record", "replay"):
+            raise ValueError(f"invalid mode: {mode}")
+        self.archive_path = archive_path
+        self.mode = mode
+        self._inner = inner
+        self._latency = latency
+        self._nearest = nearest
+        self._min_similarity = min_similarity
+        self._seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._entries: Dict[str, List[_Entry]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._shingles: Dict[str, Set[str]] = {}
+        self.hits: int = 0
+        self.nearest_hits: int = 0
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.archive_path):
+            raise FileNotFoundError(f"replay archive not found: {self.archive_path}")
+        with gzip.open(self.archive_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._add_entry(_Entry(json.loads(line)))
+
+    def _add_entry(self, entry: _Entry):
+        self._entries.setdefault(entry.key, []).append(entry)
+        if entry.key not in self._shingles:
+            self._shingles[entry.key] = _shingles(entry.prompt)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def reserve_request_slot(self, block: bool = True) -> bool:
+        # 再生時はinnerにリクエストしない為、制限は無い
+        if self.mode == "record":
+            assert self._inner is not None
+            return self._inner.reserve_request_slot(block)
+        return True
+
+    def generate_content(self, prompt, *args, response_schema=None, timeout=None, **kwargs) -> str:
+        schema_name = response_schema.name if response_schema is not None else None
+        if self.mode == "record":
+            return self._record(prompt, schema_name, args, dict(kwargs, response_schema=response_schema, timeout=timeout))
+
+        with self._lock:
+            entry = self._lookup(prompt, schema_name)
+            delay = self._latency.sample(self._rng, entry.latency) if self._latency is not None else 0.0
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise LLMTimeoutError(f"replayed latency {delay:.2f}s exceeds timeout {timeout}s")
+        if delay > 0:
+            time.sleep(delay)
+        return entry.response
+
+    def _record(self, prompt: str, schema_name: Optional[str], args: tuple, kwargs: dict) -> str:
+        assert self._inner is not None
+        start = time.perf_counter()
+        response = self._inner.generate_content(prompt, *args, **kwargs)
+        record = {
+            "key": prompt_key(prompt, schema_name),
+            "prompt": prompt,
+            "schema": schema_name,
+            "response": response,
+            "latency": round(time.perf_counter() - start, 4),
+        }
+        with self._lock:
+            # 追記ごとにgzipのメンバーが増えるが、gzip.openはそのまま連続して読み込める
+            with gzip.open(self.archive_path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._add_entry(_Entry(record))
+        return response
+
+    def _lookup(self, prompt: str, schema_name: Optional[str]) -> _Entry:
+        key = prompt_key(prompt, schema_name)
+        if key in self._entries:
+            self.hits += 1
+            return self._next(key)
+        if not self._nearest or not self._entries:
+            raise ReplayMissError(f"no recorded response for prompt (key={key[:12]})")
+
+        # 応答の形式が異なる記録は使用できない為、スキーマ名が一致する記録から探す
+        target = _shingles(prompt)
+        best_key, similarity = None, -1.0
+        for k, shingles in self._shingles.items():
+            if self._entries[k][0].schema != schema_name:
+                continue
+            union = len(target | shingles)
+            score = len(target & shingles) / union if union else 1.0
+            if score > similarity:
+                best_key, similarity = k, score
+        if best_key is None:
+            raise ReplayMissError(f"no recorded response for schema '{schema_name}' (key={key[:12]})")
+        if similarity < self._min_similarity:
+            raise ReplayMissError(f"no recorded response similar to prompt (key={key[:12]}, best similarity={similarity:.2f})")
+        logger.debug(f"replay: exact match not found, use nearest prompt (similarity={similarity:.2f})")
+        self.nearest_hits += 1
+        return self._next(best_key)
+
+    def _next(self, key: str) -> _Entry:
+        entries = self._entries[key]
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        return entries[min(cursor, len(entries) - 1)]
+
+    def reset(self):
+        """再生位置とレイテンシの乱数を初期状態に戻す"""
+        with self._lock:
+            self._cursors.clear()
+            self._rng = random.Random(self._seed)
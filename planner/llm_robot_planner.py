@@ -1,5 +1,6 @@
 from typing import List, Union, Dict, Tuple, Optional, Literal
 from datetime import datetime, timezone
+import copy
 
 from planner.llm.gen_ai import UnifiedAIRequestHandler
 from planner.memory import Memory
@@ -10,15 +11,21 @@ from planner.command.manager import CommandManager, RobotStateManager
 from planner.database.database import DatabaseManager
 from planner.database.data_type import TaskInfo, TaskRecord, CommandRecord, JobRecord, CommandExecutionResultRecord
 from planner.task_service import TaskService
+from planner.plan_cache import PlanCache, PlanKey, CommandPlanCache, CommandPlanKey
 from planner.result_evaluator import ResultEvaluator, EvaluatorResult, ReplanningData
+from planner.failure_rules import FailureRuleEngine
 
 from utils.utils import to_json_str
+from utils.metrics import default_registry as metrics
 
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 import logging
 logger = logging.getLogger("LLMRobotPlanner")
 
+_PATCH_REPLANS = metrics.counter("command_patch_replans_total", "パッチによるコマンドレベルのリプランニング（result: applied, fallback）", ("result",))
+_PATCH_KEPT = metrics.counter("command_patch_kept_commands_total", "パッチによるリプランニングで生成し直さずに残した未実行のコマンド数")
+
 
 class LLMRobotPlanner():
     """
@@ -28,7 +35,13 @@ class LLMRobotPlanner():
         self, 
         api_keys: dict, 
         commands: List[Command], 
-        states: List[RobotState]
+        states: List[RobotState],
+        llm: Optional[UnifiedAIRequestHandler] = None,
+        db: Optional[DatabaseManager] = None,
+        plan_cache: Optional[PlanCache] = None,
+        command_plan_cache: Optional[CommandPlanCache] = None,
+        incremental_replanning: bool = False,
+        failure_rules: Optional[FailureRuleEngine] = None,
     ):
         """
         
@@ -36,18 +49,29 @@ class LLMRobotPlanner():
             api_keys: dict
             commands: List[Command]
             states: List[RobotState]
+            llm: Optional[UnifiedAIRequestHandler] 使用するUnifiedAIRequestHandler（省略した場合はapi_keysから生成する）
+                RecordReplayWrapperを登録したものを渡すとAPI Keyが無くても実行できる
+            db: Optional[DatabaseManager] 使用するDatabaseManager（省略した場合は既定の設定で生成する）
+            plan_cache: Optional[PlanCache] 以前に成功したタスクの分解を再利用するキャッシュ（省略した場合は毎回生成する）
+            command_plan_cache: Optional[CommandPlanCache] 以前に成功したタスクのコマンドのプランを再利用するキャッシュ（省略した場合は毎回生成する）
+            incremental_replanning: bool コマンドレベルのリプランニングで、コマンドのリスト全体ではなく未実行のコマンドに対する変更（パッチ）のみを生成する
+                パッチを生成できない、または不正な場合はコマンドのリスト全体を生成し直す
+            failure_rules: Optional[FailureRuleEngine] 失敗したコマンドを生成AIに問い合わせずに分類するルール（省略した場合は全て生成AIで評価する）
         """ 
-        self._llm = UnifiedAIRequestHandler(
+        self._llm = llm if llm is not None else UnifiedAIRequestHandler(
             api_keys=api_keys
         )
         
-        self._db: DatabaseManager = DatabaseManager()
+        self._db: DatabaseManager = db if db is not None else DatabaseManager()
         self._memory: Memory = Memory()
         self._task_service = TaskService(self._llm, self._db)
         self._cmd_manager = CommandManager()
         self._cmd_executor = CommandExecutor(self._cmd_manager)
         self._state_manager = RobotStateManager()
-        self._result_evaluator = ResultEvaluator(self._db, self._llm)
+        self._result_evaluator = ResultEvaluator(self._db, self._llm, failure_rules)
+        self._plan_cache = plan_cache
+        self._command_plan_cache = command_plan_cache
+        self._incremental_replanning = incremental_replanning
         
         #  TODO: テスト
         from planner.rag import RAG
@@ -56,6 +80,39 @@ class LLMRobotPlanner():
         self._cmd_manager.register_commands(commands)
         self._state_manager.register_states(states)
         
+    def fork(
+        self,
+        commands: Optional[List[Command]] = None,
+        states: Optional[List[RobotState]] = None,
+    ) -> "LLMRobotPlanner":
+        """
+        ジョブの状態（Memory、ロボットの状態）を分離したLLMRobotPlannerを生成する
+        
+        生成AI（レート制限、キャッシュを含む）、DatabaseManager、TaskService、ResultEvaluator、RAG、PlanCache、CommandPlanCacheは共有する為、
+        forkしたLLMRobotPlannerは別のスレッドで同時にprocessを実行できる（JobManagerを参照）
+        初期化（initialize）はfork元で1回だけ行う
+        
+        Args:
+            commands: Optional[List[Command]] ジョブで使用するコマンド（省略した場合はfork元のコマンドを共有する）
+                シミュレーターなど、ロボットごとに異なるコマンドを使用する場合に指定する
+            states: Optional[List[RobotState]] ジョブのロボットの状態（省略した場合はfork元の現在の状態を複製する）
+        
+        Returns:
+            LLMRobotPlanner
+        """
+        planner = copy.copy(self)
+        planner._memory = Memory()
+        if states is None:
+            planner._state_manager = self._state_manager.copy()
+        else:
+            planner._state_manager = RobotStateManager()
+            planner._state_manager.register_states(states)
+        if commands is not None:
+            planner._cmd_manager = CommandManager()
+            planner._cmd_manager.register_commands(commands)
+            planner._cmd_executor = CommandExecutor(planner._cmd_manager)
+        return planner
+        
     def init_helper(self):
         """テスト用初期化メソッド"""
         self._db.init_helper()
@@ -91,22 +148,38 @@ class LLMRobotPlanner():
     def _generate_tasks(
         self,
         job: JobRecord,
-        states: List[RobotState]
-    ) -> List[TaskInfo]:
+        states: List[RobotState],
+        plan_key: Optional[PlanKey] = None
+    ) -> Tuple[List[TaskInfo], Optional[PlanKey]]:
+        """
+        Returns:
+            Tuple[List[TaskInfo], Optional[PlanKey]]: (タスク, プランキャッシュから返した場合は一致したエントリのキー)
+        """
         with log.span(name="タスクの生成：") as span:
             span.input(f"指示: {job.description}")
             
-            # タスクの生成
-            tasks = self._task_service.generate_tasks(
-                job.description, 
-                states
-            )
+            hit = self._plan_cache.lookup(plan_key) if self._plan_cache is not None and plan_key is not None else None
+            if hit is not None:
+                # 以前に成功したタスクの分解を再利用する
+                cached_key, tasks = hit
+                log.event(
+                    name="プランキャッシュ：",
+                    context=f"以前に成功したタスクを再利用（{'一致' if cached_key == plan_key else '類似'}）",
+                    tag={"plan_cache"},
+                )
+            else:
+                cached_key = None
+                # タスクの生成
+                tasks = self._task_service.generate_tasks(
+                    job.description, 
+                    states
+                )
             
             # TODO: 後で消す
             logger.debug(to_json_str(tasks))
                         
             span.output("\n".join(f"タスク{i}:\n    タスクの説明: {task['description']}\n    タスクの詳細: {task['additional_info']}" for i, task in enumerate(tasks, 1)))
-        return tasks
+        return tasks, cached_key
     
     
     def _regenerate_tasks(
@@ -133,13 +206,21 @@ class LLMRobotPlanner():
     def _generate_commands(
         self,
         task: TaskRecord,
+        plan_key: Optional[CommandPlanKey] = None,
     ):
         # taskからCommand listの生成（コマンドプランニング）
         with log.span(name="コマンドプランニング：") as span:
             span.input(f"task: {task.description}\ntask detail: {task.additional_info}")
             
+            commands = self._command_plan_cache.lookup(plan_key) if self._command_plan_cache is not None and plan_key is not None else None
+            if commands is not None:
+                # 以前に同じ条件で成功したコマンドのプランを再利用する（RAGの検索と生成を省略する）
+                log.event(name="コマンドのプランキャッシュ：", context="以前に成功したコマンドを再利用", tag={"plan_cache"})
+                span.output(f"plan: {to_json_str(commands)}")
+                return commands
+            
             # TODO: RAGテスト
-            with log.span(name="RAGのテスト：") as span:
+            with log.span(name="RAGのテスト：", tag={"rag"}) as span:
                 span.input(f"task: {task.description}")   
                 doc = self._rag._retrieval_document(task.description)
                 span.output(f"result: {to_json_str(doc)}")
@@ -167,7 +248,7 @@ class LLMRobotPlanner():
             span.input(f"task: {task.description}\ntask detail: {task.additional_info}")
             
             # TODO: RAGテスト
-            with log.span(name="RAGのテスト：") as span:
+            with log.span(name="RAGのテスト：", tag={"rag"}) as span:
                 span.input(f"task: {task.description}")   
                 doc = self._rag._retrieval_document(task.description)
                 span.output(f"result: {to_json_str(doc)}")
@@ -185,6 +266,47 @@ class LLMRobotPlanner():
             span.output(f"plan: {to_json_str(commands)}")
         return commands
     
+    def regenerate_command_patch(
+        self,
+        task: TaskRecord,
+        replanning_data: ReplanningData
+    ) -> Optional[List[CommandRecord]]:
+        """
+        未実行のコマンド（残りのプラン）に対する変更（パッチ）を生成してメモリーに適用する
+        
+        Returns:
+            Optional[List[CommandRecord]]: パッチを適用した後の残りのプラン（パッチを生成できない、または不正な場合はNone）
+        """
+        with log.span(name="コマンドプランのパッチ：") as span:
+            span.input(f"task: {task.description}\ntask detail: {task.additional_info}")
+            executed = [cmd for cmd in self._memory.get_execution_commands() if cmd.status != "pending"]
+            remaining = self._memory.get_pending_execution_commands()
+            doc = self._rag._retrieval_document(task.description)
+            try:
+                operations = self._task_service.regenerate_command_patch(
+                    task=task,
+                    replanning_data=replanning_data,
+                    command_description_list=self._cmd_manager.get_all_command_descriptions(),
+                    command_history=self._memory.get_all_actions(),
+                    failed_command=executed[-1] if executed else None,
+                    remaining_commands=remaining,
+                    knowledge=doc
+                )
+                commands = self._memory.apply_execution_command_patch(task, operations)
+            except ValueError as e:
+                # 応答の解析に失敗した、またはパッチが不正（メモリーは変更されていない）
+                logger.warning(f"コマンドプランのパッチを適用できない為、コマンドのリストを生成し直します: {e}")
+                span.output(f"失敗: {e}")
+                _PATCH_REPLANS.inc(result="fallback")
+                return None
+            
+            remaining_uids = {cmd.uid for cmd in remaining}
+            kept = sum(1 for cmd in commands if cmd.uid in remaining_uids)
+            _PATCH_REPLANS.inc(result="applied")
+            _PATCH_KEPT.inc(kept)
+            span.output(f"operations: {to_json_str(operations)}\nplan: {to_json_str(commands)}\nkept: {kept}/{len(remaining)}")
+        return commands
+    
     def _execute_command(self, command: CommandRecord) -> Tuple[CommandRecord, List[StateChange]]:
         """
         引数に与えられたCommandRecordに対応するコマンドを実行して、そのコマンド実行結果を記録する
@@ -254,8 +376,11 @@ class LLMRobotPlanner():
                         raise ValueError("情報が足りません")
                     
                 
-                # コマンドリストの生成
-                commands = self._generate_commands(task)
+                # コマンドリストの生成（プランキャッシュのキーは実行で状態が変わる前に作る）
+                plan_key = self._command_plan_cache.make_key(
+                    task, self._cmd_manager.signature(), self._state_manager.get_all(), self._db.knowledge_version
+                ) if self._command_plan_cache is not None else None
+                commands = self._generate_commands(task, plan_key)
                 # コマンドリストをメモリーに登録
                 self._memory.add_execution_commands(task, commands)
                 # コマンドリストの実行
@@ -263,6 +388,12 @@ class LLMRobotPlanner():
                     task=task, 
                     commands=self._memory.get_execution_commands()
                 )
+                # 最初のプランの実行結果を記録する（成功したプランのみ再利用する）
+                if self._command_plan_cache is not None and plan_key is not None:
+                    if is_successful:
+                        self._command_plan_cache.record_success(plan_key, commands)
+                    else:
+                        self._command_plan_cache.record_failure(plan_key)
                 
                 while True:
                     if is_successful and evaluate_result is None:
@@ -279,23 +410,28 @@ class LLMRobotPlanner():
                         replanning_data = evaluate_result["replanning_data"]["1"]
             
                         # -- リプランニング --
-                        # 未実行のコマンドのstatusを"canceled"に変更
-                        self._memory.cleanup_pending_execution_commands()
-                        
                         if replanning_data["replanning_level"] == "task_level":
                             # タスクレベルのリプランニング
+                            # 未実行のコマンドのstatusを"canceled"に変更
+                            self._memory.cleanup_pending_execution_commands()
                             action.output("失敗")
                             exec_task.change_execution_result("failure")
                             return (False, evaluate_result)
                         elif replanning_data["replanning_level"] == "command_level":
                             # コマンドレベルのリプランニング
-                            commands = self.regenerate_commands(task, replanning_data)
-                            # コマンドリストをメモリーに登録
-                            self._memory.add_execution_commands(task, commands)
+                            # パッチを適用した場合は、残りのプランのみを実行する
+                            pending = self.regenerate_command_patch(task, replanning_data) if self._incremental_replanning else None
+                            if pending is None:
+                                # 未実行のコマンドのstatusを"canceled"に変更
+                                self._memory.cleanup_pending_execution_commands()
+                                commands = self.regenerate_commands(task, replanning_data)
+                                # コマンドリストをメモリーに登録
+                                self._memory.add_execution_commands(task, commands)
+                                pending = self._memory.get_execution_commands()
                             # コマンドリストの実行
                             is_successful, evaluate_result = self._execute_command_list(
                                 task=task, 
-                                commands=self._memory.get_execution_commands()
+                                commands=pending
                             )
                         else:
                             raise ValueError(f"invalid replanning level: {replanning_data['replanning_level']}")
@@ -333,39 +469,53 @@ class LLMRobotPlanner():
         Returns:
             None
         """
-        # ジョブの開始
-        job = self._start_job(instruction, additional_info)
-        # タスクリストの生成
-        tasks = self._generate_tasks(job, self._state_manager.get_all())
-        # タスクをメモリーに登録
-        self._memory.add_execution_tasks(tasks)
-        # タスクリストの実行
-        is_successful, evaluate_result = self._execute_task_list(
-            tasks=self._memory.get_execution_tasks()
-        )
+        with log.trace(name="ジョブ：", metadata={"instruction": instruction}) as trace:
+            trace.input(f"指示: {instruction}")
+            # ジョブの開始
+            job = self._start_job(instruction, additional_info)
+            # タスクリストの生成（プランキャッシュのキーは実行で状態が変わる前に作る）
+            states = self._state_manager.get_all()
+            plan_key = self._plan_cache.make_key(instruction, states, self._db.knowledge_version) if self._plan_cache is not None else None
+            tasks, cached_key = self._generate_tasks(job, states, plan_key)
+            planned_tasks = tasks
+            replanned = False
+            # タスクをメモリーに登録
+            self._memory.add_execution_tasks(tasks)
+            # タスクリストの実行
+            is_successful, evaluate_result = self._execute_task_list(
+                tasks=self._memory.get_execution_tasks()
+            )
         
-        while True:
-            if is_successful:
-                return  # 完了
-            else:
-                # -- タスクリプランニングと実行 --
-                # 未実行のタスクのstatusを"canceled"に変更して、execution_tasksから削除
-                self._memory.cleanup_pending_execution_tasks()
+            while True:
+                if is_successful:
+                    if self._plan_cache is not None and plan_key is not None and not replanned:
+                        # リプランニングせずに成功したタスクの分解を登録する
+                        self._plan_cache.store(plan_key, planned_tasks, instruction)
+                    trace.output("完了")
+                    return  # 完了
+                else:
+                    if self._plan_cache is not None and cached_key is not None and not replanned:
+                        # キャッシュから返したタスクの実行に失敗した為、再利用しない
+                        self._plan_cache.discard(cached_key)
+                    replanned = True
+                    # -- タスクリプランニングと実行 --
+                    # 未実行のタスクのstatusを"canceled"に変更して、execution_tasksから削除
+                    self._memory.cleanup_pending_execution_tasks()
                         
-                # リプランニングデータの選択
-                assert evaluate_result is not None
-                replanning_data = evaluate_result["replanning_data"]["1"]
+                    # リプランニングデータの選択
+                    assert evaluate_result is not None
+                    replanning_data = evaluate_result["replanning_data"]["1"]
                                 
-                # タスクリストの生成
-                tasks = self._regenerate_tasks(
-                    job=job,
-                    states=self._state_manager.get_all(), 
-                    executed_tasks=self._memory.get_last_executed_tasks(),
-                    replanning_data=replanning_data
-                )
-                # タスクをメモリーに登録
-                self._memory.add_execution_tasks(tasks)
-                # タスクリストの実行
-                is_successful, evaluate_result = self._execute_task_list(
-                    tasks=self._memory.get_execution_tasks()
-                )
\ No newline at end of file
+                    # タスクリストの生成
+                    tasks = self._regenerate_tasks(
+                        job=job,
+                        states=self._state_manager.get_all(), 
+                        executed_tasks=self._memory.get_last_executed_tasks(),
+                        replanning_data=replanning_data
+                    )
+                    # タスクをメモリーに登録
+                    self._memory.add_execution_tasks(tasks)
+                    # タスクリストの実行
+                    is_successful, evaluate_result = self._execute_task_list(
+                        tasks=self._memory.get_execution_tasks()
+                    )
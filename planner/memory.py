@@ -2,7 +2,12 @@ from planner.database.data_type import *
 from typing import Dict, Optional, List
 from datetime import datetime, timezone
 from contextlib import contextmanager
+import itertools
 UniqueID = int
+
+# ジョブのIDはプロセス内で一意にする（ジョブごとにMemoryを生成して並行して実行する場合がある為）
+# タスクとコマンドのIDはMemory（ジョブ）の中で一意
+_job_uids = itertools.count(1)
     
 class Memory():
     """現在実行中のJob, Tasks, Commandsの情報を保持するクラス"""
@@ -19,7 +24,6 @@ class Memory():
         self._last_exec_commands_view: List[CommandRecord] = []  # 最後に実行したコマンドのリストのビュー（self._commandsの値を直接参照する）
         
         # ユニークID生成用
-        self._count_job: UniqueID = 0
         self._count_task: UniqueID = 0
         self._count_command: UniqueID = 0
     
@@ -106,11 +110,7 @@ class Memory():
         if task not in self._exec_tasks_view:
             raise ValueError(f"Task {task.uid} must be executed before adding a command.")
         
-        command_uid = self._generate_command_uid()
-        command = self._create_command(task.uid, command_uid, command_info)
-        
-        self._commands[command_uid] = command
-        self._exec_commands_view.append(command)
+        self._exec_commands_view.append(self._register_command(task, command_info))
     
     def add_execution_commands(self, task: TaskRecord, command_info_list: List[CommandInfo]) -> None:
         # TODO: 処理の高速化
@@ -126,6 +126,9 @@ class Memory():
         return self._exec_commands_view  # TODO: コピーを返すように変更する
     def get_last_executed_commands(self):
         return self._last_exec_commands_view  # TODO: コピーを返すように変更する
+    def get_pending_execution_commands(self) -> List[CommandRecord]:
+        """実行中のコマンドリストのうち未実行のもの（残りのプラン）"""
+        return [command for command in self._exec_commands_view if command.status == "pending"]
     
     def get_all_actions(self) -> List[CommandRecord]:
         # for task in self._exec_tasks_view:
@@ -184,6 +187,69 @@ class Memory():
         # リストを縮小
         del self._exec_commands_view[new_index:]
     
+    def apply_execution_command_patch(self, task: TaskRecord, operations: List[CommandPatchOperation]) -> List[CommandRecord]:
+        """
+        未実行のコマンド（残りのプラン）に変更（insert/replace/delete）を適用する
+        1. 全ての変更のindexを検証する（不正な場合は何も変更せずにValueErrorを送出する）
+        2. last_executed_commandsを更新する
+        3. 置き換え、削除したコマンドのstatusを"canceled"にし、変更の無いコマンドはそのまま残す
+        4. 挿入、置き換えたコマンドのsequence_numberは実行済みと未実行のコマンドの続きの番号にする（失敗したコマンドと重複させない）
+        5. _exec_commands_viewを実行済みのコマンドとパッチを適用した残りのプランに更新する
+        
+        indexは全て変更前の残りのプランの1から始まる番号（同じ番号のinsertは指定した順に挿入する）
+        
+        Returns:
+            List[CommandRecord]: パッチを適用した後の残りのプラン（次に実行するコマンド）
+        """
+        if task not in self._exec_tasks_view:
+            raise ValueError(f"Task {task.uid} must be executed before adding a command.")
+        
+        executed = [command for command in self._exec_commands_view if command.status != "pending"]
+        pending = self.get_pending_execution_commands()
+        inserts: Dict[int, List[CommandInfo]] = {}
+        changes: Dict[int, Optional[CommandInfo]] = {}  # index -> 置き換えるコマンド（削除の場合はNone）
+        for operation in operations:
+            op, index = operation["op"], operation["index"]
+            if op == "insert":
+                if not 1 <= index <= len(pending) + 1:
+                    raise ValueError(f"insert index {index} is out of range (1-{len(pending) + 1})")
+                inserts.setdefault(index, []).append(operation["command"])
+            elif op in ("replace", "delete"):
+                if not 1 <= index <= len(pending):
+                    raise ValueError(f"{op} index {index} is out of range (1-{len(pending)})")
+                if index in changes:
+                    raise ValueError(f"command {index} is replaced or deleted more than once")
+                changes[index] = operation["command"] if op == "replace" else None
+            else:
+                raise ValueError(f"invalid patch operation: {op}")
+            if op != "delete" and operation["command"] is None:
+                raise ValueError(f"command is required for '{op}' (index: {index})")
+        
+        # last_executed_commandsを更新
+        self._last_exec_commands_view = self._exec_commands_view.copy()
+        
+        # CommandRecordは変更できない為、残すコマンドの番号はそのままにする
+        next_number = itertools.count(max((command.sequence_number for command in executed + pending), default=-1) + 1)
+        remaining: List[CommandRecord] = []
+        def add(command_info: CommandInfo):
+            remaining.append(self._register_command(task, {**command_info, "sequence_number": next(next_number)}))
+        
+        for index in range(1, len(pending) + 2):
+            for command_info in inserts.get(index, []):
+                add(command_info)
+            if index > len(pending):
+                break
+            command = pending[index - 1]
+            if index in changes:
+                command._status = "canceled"
+                if changes[index] is not None:
+                    add(changes[index])
+            else:
+                remaining.append(command)
+        
+        self._exec_commands_view[:] = executed + remaining
+        return remaining
+    
     def cleanup_execution_commands(self):
         self._exec_commands_view = []
         
@@ -201,6 +267,13 @@ class Memory():
             outcome=task_info["outcome"],
         )
         
+    def _register_command(self, task: TaskRecord, command_info: CommandInfo) -> CommandRecord:
+        """CommandRecordを生成して登録する（_exec_commands_viewには追加しない）"""
+        command_uid = self._generate_command_uid()
+        command = self._create_command(task.uid, command_uid, command_info)
+        self._commands[command_uid] = command
+        return command
+        
     def _create_command(self, task_uid: UniqueID, command_uid: UniqueID, command_info: CommandInfo) -> CommandRecord:
         """CommandRecordを生成する"""
         return CommandRecord(
@@ -213,8 +286,7 @@ class Memory():
         )
         
     def _generate_job_uid(self):
-        self._count_job += 1
-        return self._count_job
+        return next(_job_uids)
     def _generate_task_uid(self):
         self._count_task += 1
         return self._count_task
@@ -0,0 +1,317 @@
+"""
+以前に成功したタスクの分解（List[TaskInfo]）とコマンドのプラン（List[CommandInfo]）を再利用するキャッシュ
+
+PlanCache: 指示 -> タスクの分解
+
+キーは正規化した指示、ロボットの状態のシグネチャ、知識（DatabaseManager.knowledge_version）の版の組
+similarity_thresholdを指定した場合のみ、キーが一致しなければ状態と知識の版が一致するエントリの中から指示が似ているもの（近い重複）を探す
+    - embedを指定した場合は埋め込みのコサイン類似度
+    - 指定しない場合は文字n-gramの出現回数のベクトルのコサイン類似度（埋め込みAPIを使用しない）
+    - 類似度が高くても、丁寧さなどを表す表現（「ください」など）と語順以外の語が異なる場合は使用しない
+      （対象の物や人、動作だけが異なる指示に、別の指示のタスクを返さない為）
+
+ジョブがタスクレベルのリプランニングをせずに成功した場合にのみ登録し（LLMRobotPlanner.processが行う）、
+キャッシュから返したタスクの実行に失敗した場合はエントリを破棄する
+
+Example:
+    cache = PlanCache()
+    key = cache.make_key("リモコンを持ってきて", states, db.knowledge_version)
+    hit = cache.lookup(key)
+    if hit is None:
+        tasks = task_service.generate_tasks(instruction, states)
+        ...  # 実行して成功した場合
+        cache.store(key, tasks)
+    else:
+        matched_key, tasks = hit
+        ...  # 実行して失敗した場合
+        cache.discard(matched_key)
+
+CommandPlanCache: タスク -> コマンドのプラン
+    キーはタスクの説明と追加情報、登録されているコマンド（CommandManager.signature）、ロボットの状態のシグネチャ、
+    知識の版の組で、全てが一致する場合のみ再利用する（近い重複は検索しない）
+    コマンドの登録、知識（既知の場所の名前など）、ロボットの状態のいずれかが変わるとキーが変わる為、古いプランは使用されない
+    コマンドリストの実行に成功した場合に登録し、失敗した場合は破棄する
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from collections import Counter, OrderedDict
+import copy
+import math
+import re
+import threading
+import time
+import unicodedata
+
+from planner.database.data_type import TaskInfo, CommandInfo, TaskRecord
+from planner.command.robot_state import RobotState
+from utils.metrics import default_registry as metrics
+
+_LOOKUPS = metrics.counter("plan_cache_lookups_total", "プランキャッシュの検索（result: hit, near_hit, miss）", ("result",))
+_INVALIDATIONS = metrics.counter("plan_cache_invalidations_total", "実行に失敗した為に破棄したエントリ数（cache: task, command）", ("cache",))
+_COMMAND_LOOKUPS = metrics.counter("command_plan_cache_lookups_total", "コマンドのプランキャッシュの検索（result: hit, miss）", ("result",))
+_COMMAND_RESULTS = metrics.counter("command_plan_cache_results_total", "コマンドのプランキャッシュに記録した実行結果（status: success, failure）", ("status",))
+
+# 埋め込みの関数（ChromaDBのEmbeddingFunctionと同じ形式: 文字列のリスト -> ベクトルのリスト）
+EmbedFunction = Callable[[List[str]], Sequence[Sequence[float]]]
+Vector = Union[Dict[str, float], Tuple[float, ...]]
+
+# 意味を変えない記号と空白（指示の正規化で取り除く）
+_IGNORED = re.compile(r"[\s、。，．,.!?！？・「」『』（）()\"'`]+")
+# 近い重複で異なってもよい表現（丁寧さや呼びかけで、対象や動作を変えないもの）
+_FILLERS = re.compile(r"ください|下さい|お願いします|おねがいします|お願い|おねがい|ちょっと|すみません|すいません|please")
+# 語の区切り（漢字、カタカナ、ひらがな、英数字の連続をそれぞれ1語とする簡易的な分割）
+_TOKEN = re.compile(r"[\u4e00-\u9fff々〆]+|[\u30a0-\u30ffー]+|[\u3040-\u309f]+|[a-z0-9]+")
+
+
+def normalize_instruction(instruction: str) -> str:
+    """全角/半角と大文字/小文字を揃え、記号と空白を取り除く"""
+    text = unicodedata.normalize("NFKC", instruction).lower()
+    return _IGNORED.sub("", text)
+
+
+def state_signature(states: List[RobotState]) -> str:
+    """ロボットの状態（有効/無効と引数）を表す文字列（状態の登録順に依存しない）"""
+    parts = []
+    for state in sorted(states, key=lambda s: s.name):
+        args = ",".join(f"{k}={v}" for k, v in sorted(state.args.items()))
+        parts.append(f"{state.name}:{int(state.active)}:{args}")
+    return "|".join(parts)
+
+
+def _content_tokens(normalized: str) -> Counter:
+    """正規化した指示から丁寧さなどを表す表現を除いた語"""
+    return Counter(_TOKEN.findall(_FILLERS.sub(" ", normalized)))
+
+
+def _same_content(a: str, b: str) -> bool:
+    """片方にのみ含まれる語が無いか（語順と丁寧さなどを表す表現の違いのみか）"""
+    return _content_tokens(a) == _content_tokens(b)
+
+
+def _ngram_vector(text: str, n: int) -> Dict[str, float]:
+    """文字n-gramの出現回数を正規化したベクトル（疎）"""
+    grams = Counter(text[i:i + n] for i in range(max(1, len(text) - n + 1)))
+    norm = math.sqrt(sum(c * c for c in grams.values()))
+    return {g: c / norm for g, c in grams.items()} if norm else {}
+
+
+def _dense_vector(values: Sequence[float]) -> Tuple[float, ...]:
+    norm = math.sqrt(sum(v * v for v in values))
+    return tuple(v / norm for v in values) if norm else tuple(values)
+
+
+def _cosine(a: Vector, b: Vector) -> float:
+    """正規化済みのベクトルのコサイン類似度"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(v * b.get(k, 0.0) for k, v in a.items())
+    if isinstance(a, tuple) and isinstance(b, tuple) and len(a) == len(b):
+        return sum(x * y for x, y in zip(a, b))
+    return 0.0
+
+
+@dataclass(frozen=True)
+class PlanKey():
+    instruction: str  # 正規化した指示
+    state_signature: str
+    knowledge_version: int
+
+
+@dataclass
+class PlanCacheEntry():
+    key: PlanKey
+    original_instruction: str
+    tasks: List[TaskInfo]
+    vector: Vector
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class PlanCache():
+    """
+    Args:
+        max_entries: int 保持するエントリの最大数（最も長く使用されていないものから破棄する）
+        similarity_threshold: Optional[float] 近い重複とみなす類似度の下限（Noneの場合は近い重複を検索しない）
+            類似度が下限以上でも、片方にのみ含まれる語がある場合は近い重複としない
+            （文字2-gramの場合、「リモコンを持ってきて」と「リモコンを持ってきてください」は約0.83で近い重複となり、
+            「りんごを取ってきて」と「みかんを取ってきて」は約0.81だが語が異なる為、近い重複としない）
+        embed: Optional[EmbedFunction] 指示の埋め込みを計算する関数（省略した場合は文字n-gramを使用する）
+        ngram: int 文字n-gramのn
+    """
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        similarity_threshold: Optional[float] = None,
+        embed: Optional[EmbedFunction] = None,
+        ngram: int = 2,
+    ):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.ngram = ngram
+        self._entries: "OrderedDict[PlanKey, PlanCacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, instruction: str, states: List[RobotState], knowledge_version: int) -> PlanKey:
+        """タスクを生成する時点の状態でキーを作る（実行中に状態が変わる為、生成の前に呼び出す）"""
+        return PlanKey(normalize_instruction(instruction), state_signature(states), knowledge_version)
+
+    def _vector(self, normalized: str) -> Vector:
+        if self.embed is not None:
+            return _dense_vector(self.embed([normalized])[0])
+        return _ngram_vector(normalized, self.ngram)
+
+    def lookup(self, key: PlanKey) -> Optional[Tuple[PlanKey, List[TaskInfo]]]:
+        """(一致したエントリのキー, キャッシュしたタスクのコピー)を返す（無い場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                _LOOKUPS.inc(result="hit")
+                return key, copy.deepcopy(entry.tasks)
+            candidates = [
+                e for e in self._entries.values()
+                if e.key.state_signature == key.state_signature and e.key.knowledge_version == key.knowledge_version
+            ]
+        if self.similarity_threshold is None or not candidates:
+            _LOOKUPS.inc(result="miss")
+            return None
+
+        # 埋め込みの計算はロックの外で行う
+        vector = self._vector(key.instruction)
+        best, best_score = None, self.similarity_threshold
+        for e in candidates:
+            score = _cosine(vector, e.vector)
+            if score >= best_score and _same_content(key.instruction, e.key.instruction):
+                best, best_score = e, score
+        if best is None:
+            _LOOKUPS.inc(result="miss")
+            return None
+        with self._lock:
+            if best.key in self._entries:
+                self._entries.move_to_end(best.key)
+            best.hits += 1
+        _LOOKUPS.inc(result="near_hit")
+        return best.key, copy.deepcopy(best.tasks)
+
+    def store(self, key: PlanKey, tasks: List[TaskInfo], instruction: str = ""):
+        """成功したタスクの分解を登録する"""
+        if self.max_entries <= 0:
+            return
+        entry = PlanCacheEntry(key=key, original_instruction=instruction, tasks=copy.deepcopy(tasks), vector=self._vector(key.instruction))
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                entry.created_at, entry.hits = previous.created_at, previous.hits
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: PlanKey) -> bool:
+        """キャッシュから返したタスクの実行に失敗した場合にエントリを破棄する（keyはlookupが返したキー）"""
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+        if removed:
+            _INVALIDATIONS.inc(cache="task")
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": sum(e.hits for e in self._entries.values()),
+            }
+
+
+@dataclass(frozen=True)
+class CommandPlanKey():
+    task_description: str
+    task_additional_info: str
+    command_signature: str
+    state_signature: str
+    knowledge_version: int
+
+
+@dataclass
+class CommandPlanEntry():
+    commands: List[CommandInfo]
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+    successes: int = 0
+
+
+class CommandPlanCache():
+    """
+    Args:
+        max_entries: int 保持するエントリの最大数（最も長く使用されていないものから破棄する）
+    """
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CommandPlanKey, CommandPlanEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.failures = 0
+
+    def make_key(self, task: TaskRecord, command_signature: str, states: List[RobotState], knowledge_version: int) -> CommandPlanKey:
+        """コマンドを生成する時点の状態でキーを作る"""
+        return CommandPlanKey(task.description, task.additional_info, command_signature, state_signature(states), knowledge_version)
+
+    def lookup(self, key: CommandPlanKey) -> Optional[List[CommandInfo]]:
+        """以前に成功したコマンドのプランのコピーを返す（無い場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                _COMMAND_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            _COMMAND_LOOKUPS.inc(result="hit")
+            return copy.deepcopy(entry.commands)
+
+    def record_success(self, key: CommandPlanKey, commands: List[CommandInfo]):
+        """コマンドリストの実行に成功したプランを登録する"""
+        _COMMAND_RESULTS.inc(status="success")
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = CommandPlanEntry(commands=copy.deepcopy(commands))
+            entry.successes += 1
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_failure(self, key: CommandPlanKey) -> bool:
+        """コマンドリストの実行に失敗した場合にプランを破棄する（破棄した場合はTrue）"""
+        _COMMAND_RESULTS.inc(status="failure")
+        with self._lock:
+            self.failures += 1
+            removed = self._entries.pop(key, None) is not None
+        if removed:
+            _INVALIDATIONS.inc(cache="command")
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": sum(e.hits for e in self._entries.values()),
+                "failures": self.failures,
+            }
@@ -1,7 +1,8 @@
 from typing import List, Union
 from planner.database.database import DatabaseManager
 from planner.llm.gen_ai import UnifiedAIRequestHandler
-from planner.llm.parser import JsonParser
+from planner.llm.repair import RepairingJsonParser
+from planner.llm.schema import RAG_QUERY_RESPONSE_SCHEMA
 from planner.database.data_type import Location, Object, Position
 from prompts.utils import get_prompt
 
@@ -19,7 +20,7 @@ class RAG():
         """    
         self._db: DatabaseManager = db
         self._llm: UnifiedAIRequestHandler = llm
-        self._json_parser: JsonParser = JsonParser()
+        self._json_parser: RepairingJsonParser = RepairingJsonParser(llm)
         
     def query(self, query: str):
         """
@@ -46,9 +47,10 @@ class RAG():
         )
         
         response = self._json_parser.parse(
-            text=self._llm.generate_content(prompt),
+            text=self._llm.generate_content(prompt, response_schema=RAG_QUERY_RESPONSE_SCHEMA, prompt_name="GENERATE_QUERY"),
             response_type="json",
-            convert_type="dict"
+            convert_type="dict",
+            schema=RAG_QUERY_RESPONSE_SCHEMA
         )
 
         l = []
@@ -1,15 +1,24 @@
-from planner.database.data_type import CommandExecutionResultRecord, TaskRecord, CommandRecord
+from planner.database.data_type import CommandExecutionResultRecord, TaskRecord, CommandRecord, FailureEvaluationRecord
 from planner.database.database import DatabaseManager
 from planner.llm.gen_ai import UnifiedAIRequestHandler as LLM
-from planner.llm.parser import JsonParser
+from planner.llm.repair import RepairingJsonParser
+from planner.llm.schema import REPLANNING_DATA_RESPONSE_SCHEMA
+from planner.failure_rules import FailureRuleEngine, failure_signature
 from prompts.utils import get_prompt
 from utils.utils import to_json_str
+from utils.metrics import default_registry as metrics
 
-from typing import TypedDict, Literal, Union, Dict, List
+from typing import TypedDict, Literal, Union, Dict, List, Optional
 
 from logger.logger import LLMRobotPlannerLogSystem
 log = LLMRobotPlannerLogSystem()
 
+# リプランニングの発生率は replanning_total / command_evaluations_total で求める
+_EVALUATIONS = metrics.counter("command_evaluations_total", "コマンドの実行結果を評価した回数", ("status",))
+_REPLANNING = metrics.counter("replanning_total", "評価の結果必要となったリプランニングの回数", ("level",))
+_EVALUATE_SECONDS = metrics.histogram("result_evaluation_duration_seconds", "失敗したコマンドのリプランニングデータの生成の所要時間")
+_FAILURE_EVALUATIONS = metrics.counter("failure_evaluations_total", "失敗したコマンドの評価の方法（source: rule, llm）", ("source",))
+
 class ReplanningData(TypedDict):
     replanning_level: Literal["task", "command"]
     cause: str
@@ -23,10 +32,20 @@ class EvaluatorResult(TypedDict):
     replanning_data: Dict[str, ReplanningData]
     
 class ResultEvaluator:
-    def __init__(self, db_manager: DatabaseManager, llm: LLM):
+    def __init__(self, db_manager: DatabaseManager, llm: LLM, failure_rules: Optional[FailureRuleEngine] = None):
+        """
+        Args:
+            db_manager: DatabaseManager
+            llm: LLM
+            failure_rules: Optional[FailureRuleEngine] 失敗したコマンドを生成AIに問い合わせずに分類するルール（省略した場合は全て生成AIで評価する）
+                生成AIの評価はデータベースに記録し、生成時に過去の評価からルールを学習する
+        """
         self._db: DatabaseManager = db_manager
         self._llm: LLM = llm
-        self._json_parser = JsonParser()
+        self._json_parser = RepairingJsonParser(llm)
+        self._failure_rules = failure_rules
+        if self._failure_rules is not None:
+            self._failure_rules.observe_all(self._db.get_failure_evaluations())
         
     def evaluate_execution_command_result(
         self,
@@ -35,17 +54,28 @@ class ResultEvaluator:
     ) -> EvaluatorResult:
         
         r_data = {}
+        _EVALUATIONS.inc(status=current_command.status)
         if current_command.status == "failure":
-            replanning_datas = self._generate_replanning_data(current_task, current_command)
-            for i in range(len(replanning_datas)):
-                r_data[f"{i+1}"] = ReplanningData(
-                    replanning_level=replanning_datas[f"{i+1}"]["error_level"],
-                    cause=replanning_datas[f"{i+1}"]["cause"],
-                    detail=replanning_datas[f"{i+1}"]["detail"],
-                    solution=replanning_datas[f"{i+1}"]["solution"],
+            replanning_datas = self._classify_by_rules(current_command)
+            if replanning_datas is None:
+                with _EVALUATE_SECONDS.time():
+                    replanning_datas = self._generate_replanning_data(current_task, current_command)
+                _FAILURE_EVALUATIONS.inc(source="llm")
+                self._record_evaluation(current_command, replanning_datas)
+            else:
+                _FAILURE_EVALUATIONS.inc(source="rule")
+            # 応答のキーに関わらず、可能性の高い順に"1"から番号を振り直す
+            for i, data in enumerate(replanning_datas.values(), 1):
+                r_data[f"{i}"] = ReplanningData(
+                    replanning_level=data["error_level"],
+                    cause=data["cause"],
+                    detail=data["detail"],
+                    solution=data["solution"],
                     failed_task_sequence_number=current_task.sequence_number,
                     failed_command_sequence_number=current_command.sequence_number
                 )
+            if r_data:
+                _REPLANNING.inc(level=r_data["1"]["replanning_level"])
             
         return EvaluatorResult(
             is_replanning_needed=(current_command.status == "failure"),
@@ -65,6 +95,45 @@ class ResultEvaluator:
         # current_task.outcome.desired_robot_state
     
     
+    def _classify_by_rules(self, current_command: CommandRecord) -> Optional[Dict[str, Dict[str, str]]]:
+        """ルールに一致する場合はEVALUATE_RESULTの応答と同じ形式のリプランニングデータを返す（無い場合はNone）"""
+        if self._failure_rules is None:
+            return None
+        rule = self._failure_rules.classify(
+            command_name=current_command.description,
+            status=current_command.status,
+            detailed_info=current_command.execution_result.detailed_info,
+            args=current_command.args,
+        )
+        if rule is None:
+            return None
+        log.event(
+            name="Evaluate Result (rule)",
+            context=f"ルール {rule.name} で分類（{rule.replanning_level}）",
+            tag={"failure_rule"},
+        )
+        return rule.to_replanning_data()
+    
+    def _record_evaluation(self, current_command: CommandRecord, replanning_datas: Dict[str, Dict[str, str]]):
+        """生成AIの評価（最も可能性の高いもの）をデータベースに記録し、ルールを学習する"""
+        if self._failure_rules is None or not replanning_datas:
+            return
+        data = next(iter(replanning_datas.values()))
+        detailed_info = current_command.execution_result.detailed_info or ""
+        record = self._db.add_failure_evaluation(FailureEvaluationRecord(
+            command_name=current_command.description,
+            status=current_command.status,
+            detailed_info=detailed_info,
+            detail_signature=failure_signature(detailed_info, current_command.args),
+            error_level=data["error_level"],
+            cause=data["cause"],
+            detail=data["detail"],
+            solution=data["solution"],
+        ))
+        rule = self._failure_rules.observe(record)
+        if rule is not None:
+            log.event(name="Evaluate Result (rule)", context=f"ルール {rule.name} を学習（{rule.replanning_level}）", tag={"failure_rule"})
+    
     def _generate_replanning_data(
         self,
         current_task: TaskRecord, 
@@ -91,12 +160,15 @@ class ResultEvaluator:
                 symbol=("{{", "}}")
             )
             response = self._llm.generate_content(
-                prompt=prompt
+                prompt=prompt,
+                response_schema=REPLANNING_DATA_RESPONSE_SCHEMA,
+                prompt_name="EVALUATE_RESULT"
             )
             r = self._json_parser.parse(
                 response,
                 response_type="json",
-                convert_type="dict"
+                convert_type="dict",
+                schema=REPLANNING_DATA_RESPONSE_SCHEMA
             )
             span.output(to_json_str(r))
         return r
\ No newline at end of file
@@ -1,12 +1,13 @@
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Optional
 from planner.llm.gen_ai import UnifiedAIRequestHandler as LLM
-from planner.llm.parser import JsonParser
+from planner.llm.repair import RepairingJsonParser
+from planner.llm.schema import TASKS_RESPONSE_SCHEMA, COMMANDS_RESPONSE_SCHEMA, COMMAND_PATCH_RESPONSE_SCHEMA
 from planner.database.database import DatabaseManager
 from prompts.utils import get_prompt
 from utils.utils import to_json_str
 
 from planner.database.data_type import (
-    TaskInfo, CommandInfo,
+    TaskInfo, CommandInfo, CommandPatchOperation,
     TaskRecord, CommandRecord,
     DesiredInformation, DesiredRobotState, 
     Dependencies, EnvironmentalConditions, InformationConditions, TaskOutcome
@@ -20,7 +21,7 @@ log = LLMRobotPlannerLogSystem()
 class TaskService():
     def __init__(self, llm: LLM, db: DatabaseManager):
         self._llm: LLM = llm
-        self._json_parser = JsonParser()
+        self._json_parser = RepairingJsonParser(llm)
         self._db = db
         
     # 後で削除
@@ -30,6 +31,56 @@ class TaskService():
     def _get_all_location_knowledge_names(self) -> List[str]:
         return list(set([location.name for location in self._db.get_all_known_locations()]))
 
+    def _to_task_infos(self, response: dict) -> List[TaskInfo]:
+        """
+        TASKS_RESPONSE_SCHEMAで検証済みの応答からTaskInfoのリストを生成する
+        必須のプロパティは検証済みの為、任意のプロパティのみ既定値を使用する
+        """
+        task_infos = []
+        for i, task in enumerate(response["tasks"], 1):
+            env = task.get("task_environmental_conditions") or {}
+            info_conditions = env.get("required_information_conditions") or {}
+            outcome = task["task_outcome"]
+            task_infos.append(
+                TaskInfo(
+                    sequence_number=i,
+                    description=task["task_description"],
+                    additional_info=task.get("task_additional_info") or "",
+                    dependencies=tuple(
+                        Dependencies(
+                            dependency_sequence_number=dep["dependency_task_sequence_number"],
+                            reason=dep["reason"],
+                            required_outcome_desired_robot_state_uids=tuple(dep.get("required_outcome_desired_robot_state_uids") or ()),
+                            required_outcome_desired_information_uids=tuple(dep.get("required_outcome_desired_information_uids") or ()),
+                        ) for dep in task.get("task_dependencies") or ()
+                    ),
+                    environmental_conditions=EnvironmentalConditions(
+                        physical=tuple(env.get("required_physical_conditions") or ()),
+                        information=InformationConditions(
+                            locations=tuple(info_conditions.get("required_information_locations") or ()),
+                            objects=tuple(info_conditions.get("required_information_objects") or ()),
+                        ),
+                    ),
+                    reason=task["task_reason"],
+                    outcome=TaskOutcome(
+                        desired_information=tuple(
+                            DesiredInformation(
+                                uid=info["uid"],
+                                description=info["description"]
+                            ) for info in outcome.get("desired_information") or ()
+                        ),
+                        desired_robot_state=tuple(
+                            DesiredRobotState(
+                                uid=state["uid"],
+                                name=state["state_name"],
+                                args=tuple(state.get("state_args") or ())
+                            ) for state in outcome.get("desired_robot_state") or ()
+                        )
+                    )
+                )
+            )
+        return task_infos
+
     def generate_tasks(self, instruction: str, states: List[RobotState]) -> List[TaskInfo]:
         state_descriptions = ""
         for state in states:
@@ -48,52 +99,17 @@ class TaskService():
         response = self._json_parser.parse(
             text=self._llm.generate_content(
                 prompt=prompt, 
-                model_name=None
+                model_name=None,
+                response_schema=TASKS_RESPONSE_SCHEMA,
+                prompt_name="GENERATE_TASKS"
             ),
             response_type="json",
-            convert_type="dict"
+            convert_type="dict",
+            schema=TASKS_RESPONSE_SCHEMA
         )
         
-        # TODO: ここでresponseの内容と形式が合っているか確認する処理の追加
         # TODO: taskの依存関係を解析する処理の追加
-        return [
-            TaskInfo(
-                sequence_number=i,
-                description=task["task_description"], 
-                additional_info=task.get("task_additional_info") if task.get("task_additional_info") is not None else "",
-                dependencies=tuple(
-                    Dependencies(
-                        dependency_sequence_number=dep["dependency_task_sequence_number"],
-                        reason=dep["reason"],
-                        required_outcome_desired_robot_state_uids=dep.get("required_outcome_desired_robot_state_uids", []),
-                        required_outcome_desired_information_uids=dep.get("required_outcome_desired_information_uids", []),
-                    ) for dep in task.get("task_dependencies", [])
-                ),
-                environmental_conditions=EnvironmentalConditions(
-                    physical=task.get("task_environmental_conditions", {}).get("required_physical_conditions", []),
-                    information=InformationConditions(
-                        locations=task.get("task_environmental_conditions", {}).get("required_information_conditions", {}).get("required_information_locations", []),
-                        objects=task.get("task_environmental_conditions", {}).get("required_information_conditions", {}).get("required_information_objects", [])
-                    ),
-                ),      
-                reason=task["task_reason"],
-                outcome=TaskOutcome(
-                    desired_information=tuple(
-                        DesiredInformation(
-                            uid=info["uid"],
-                            description=info["description"]
-                        ) for info in task.get("task_outcome", []).get("desired_information", [])
-                    ),
-                    desired_robot_state=tuple(
-                        DesiredRobotState(
-                            uid=state["uid"],
-                            name=state["state_name"],
-                            args=state.get("arg", [])
-                        ) for state in task.get("task_outcome", []).get("desired_robot_state", [])
-                    ) 
-                )
-            ) for i, task in enumerate(response["tasks"], 1)
-        ]
+        return self._to_task_infos(response)
         
         
     def regenerate_tasks(
@@ -174,52 +190,17 @@ class TaskService():
         response = self._json_parser.parse(
             text=self._llm.generate_content(
                 prompt=prompt, 
-                model_name=None
+                model_name=None,
+                response_schema=TASKS_RESPONSE_SCHEMA,
+                prompt_name="REGENERATE_TASKS"
             ),
             response_type="json",
-            convert_type="dict"
+            convert_type="dict",
+            schema=TASKS_RESPONSE_SCHEMA
         )
         
-        # TODO: ここでresponseの内容と形式が合っているか確認する処理の追加
         # TODO: taskの依存関係を解析する処理の追加
-        return [
-            TaskInfo(
-                sequence_number=i,
-                description=task["task_description"], 
-                additional_info=task.get("task_additional_info") if task.get("task_additional_info") is not None else "",
-                dependencies=tuple(
-                    Dependencies(
-                        dependency_sequence_number=dep["dependency_task_sequence_number"],
-                        reason=dep["reason"],
-                        required_outcome_desired_robot_state_uids=dep.get("required_outcome_desired_robot_state_uids", []),
-                        required_outcome_desired_information_uids=dep.get("required_outcome_desired_information_uids", []),
-                    ) for dep in task.get("task_dependencies", [])
-                ),
-                environmental_conditions=EnvironmentalConditions(
-                    physical=task.get("task_environmental_conditions", {}).get("required_physical_conditions", []),
-                    information=InformationConditions(
-                        locations=task.get("task_environmental_conditions", {}).get("required_information_conditions", {}).get("required_information_locations", []),
-                        objects=task.get("task_environmental_conditions", {}).get("required_information_conditions", {}).get("required_information_objects", [])
-                    ),
-                ),      
-                reason=task["task_reason"],
-                outcome=TaskOutcome(
-                    desired_information=tuple(
-                        DesiredInformation(
-                            uid=info["uid"],
-                            description=info["description"]
-                        ) for info in task.get("task_outcome", []).get("desired_information", [])
-                    ),
-                    desired_robot_state=tuple(
-                        DesiredRobotState(
-                            uid=state["uid"],
-                            name=state["state_name"],
-                            args=state.get("arg", [])
-                        ) for state in task.get("task_outcome", []).get("desired_robot_state", [])
-                    )
-                )
-            ) for i, task in enumerate(response["tasks"], 1)
-        ]
+        return self._to_task_infos(response)
         
         
     def generate_command_calls(
@@ -277,10 +258,13 @@ class TaskService():
         response = self._json_parser.parse(
             text=self._llm.generate_content(
                 prompt=prompt, 
-                model_name=None
+                model_name=None,
+                response_schema=COMMANDS_RESPONSE_SCHEMA,
+                prompt_name="generate_commands_from_task"
             ),
             response_type="json",
-            convert_type="dict"
+            convert_type="dict",
+            schema=COMMANDS_RESPONSE_SCHEMA
         )
         
         return [
@@ -351,10 +335,13 @@ class TaskService():
         response = self._json_parser.parse(
             text=self._llm.generate_content(
                 prompt=prompt, 
-                model_name=None
+                model_name=None,
+                response_schema=COMMANDS_RESPONSE_SCHEMA,
+                prompt_name="REGENERATE_COMMANDS_FROM_TASK"
             ),
             response_type="json",
-            convert_type="dict"
+            convert_type="dict",
+            schema=COMMANDS_RESPONSE_SCHEMA
         )
         
         return [
@@ -365,6 +352,89 @@ class TaskService():
                 args=d["args"]
             ) for i, d in enumerate(response.values())
         ]
+
+    def regenerate_command_patch(
+        self,
+        task: TaskRecord,
+        replanning_data: ReplanningData,
+        command_description_list: List[str],
+        command_history: List[CommandRecord],
+        failed_command: Optional[CommandRecord],
+        remaining_commands: List[CommandRecord],
+        knowledge: List[str]
+    ) -> List[CommandPatchOperation]:
+        """
+        コマンドの実行に失敗した場合に、未実行のコマンドのリスト（残りのプラン）に対する変更（パッチ）を生成する
+        コマンドのリスト全体を生成し直すregenerate_command_callsより応答が短い
+        
+        Args:
+            task TaskRecord: 実行中のタスク
+            replanning_data ReplanningData: 失敗の原因
+            command_description_list List[str]: コマンドの説明のリスト
+            command_history List[CommandRecord]: アクション履歴
+            failed_command Optional[CommandRecord]: 失敗したコマンド
+            remaining_commands List[CommandRecord]: 残りのプラン（indexはこのリストの1から始まる番号）
+            knowledge List[str]: 知識のリスト
+        
+        Returns:
+            List[CommandPatchOperation]: 変更のリスト（番号の範囲はMemory.apply_execution_command_patchが検証する）
+        """
+        command_description = "\n".join(f"        {idx}: {action}" for idx, action in enumerate(command_description_list, 1))
+        k = "\n".join([f'       ・{s}' for s in knowledge]) if knowledge else "       取得した情報はありません"
+        action_history_json = "\n".join(" "*8 + line for line in to_json_str(command_history).splitlines())
+        # コマンドは1行のJSON（名前と引数）で示す
+        failed = to_json_str({"name": failed_command.description, "args": failed_command.args}, indent=None) if failed_command is not None else "なし"
+        remaining = "\n".join(
+            f"        {idx}: " + to_json_str({"name": cmd.description, "args": cmd.args}, indent=None)
+            for idx, cmd in enumerate(remaining_commands, 1)
+        ) if remaining_commands else "        なし"
+        
+        prompt = get_prompt(
+            prompt_name="REGENERATE_COMMANDS_PATCH",
+            replacements={
+                "task_description": task.description,
+                "task_detail": task.additional_info,
+                "task_cause": replanning_data["cause"],
+                "task_cause_detail": replanning_data["detail"],
+                "command_description": command_description,
+                "action_history": action_history_json,
+                "failed_command": failed,
+                "remaining_commands": remaining,
+                "knowledge": k, 
+                "location_info": str(self._get_all_location_knowledge_names())
+            },
+            symbol=("{{", "}}")
+        )
+        
+        # response = {"operations": [{"op": "insert", "index": 1, "command": {"name": "command_name", "args": {...}}}, ...]}
+        response = self._json_parser.parse(
+            text=self._llm.generate_content(
+                prompt=prompt, 
+                model_name=None,
+                response_schema=COMMAND_PATCH_RESPONSE_SCHEMA,
+                prompt_name="REGENERATE_COMMANDS_PATCH"
+            ),
+            response_type="json",
+            convert_type="dict",
+            schema=COMMAND_PATCH_RESPONSE_SCHEMA
+        )
+        
+        operations: List[CommandPatchOperation] = []
+        for op in response["operations"]:
+            command = op.get("command")
+            if op["op"] != "delete" and command is None:
+                raise ValueError(f"command is required for '{op['op']}' (index: {op['index']})")
+            operations.append(CommandPatchOperation(
+                op=op["op"],
+                index=op["index"],
+                command=CommandInfo(
+                    sequence_number=0,  # Memory.apply_execution_command_patchが振り直す
+                    description=command["name"],
+                    additional_info="",
+                    args=command["args"]
+                ) if op["op"] != "delete" else None
+            ))
+        return operations
             
 
     
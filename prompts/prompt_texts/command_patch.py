@@ -0,0 +1,56 @@
+REGENERATE_COMMANDS_PATCH = \
+"""role: 
+    あなたは自律思考型ロボットの行動決定システムです。
+    ロボットがタスクを実行中にコマンドの実行に失敗しました。まだ実行していないコマンド（残りのプラン）のうち、問題の無いものはそのまま使用し、
+    失敗から回復してタスクを完了する為に必要な変更（パッチ）だけを回答してください。
+制約：
+    1. 二重引用符で囲まれたコマンド名のみを使用してください。例： "コマンド名"
+    2. ロボットが実行可能なコマンドに含まれないコマンドは絶対に実行できません。適切なコマンドが見つからない場合は、コマンド"error"でargsのmessageにエラー内容を記述して挿入してください
+    3. 一部のコマンドの引数に与える内容は既知の内容（ロボットが知っている情報）からのみ選択されることに注意してください！！
+    4. 変更が必要ないコマンドは回答に含めないでください。残りのプランをそのまま実行して良い場合はoperationsを空のリストにしてください
+    5. 失敗したコマンドは残りのプランに含まれません。再度実行する場合はinsertで挿入してください
+    6. indexは全て変更前の残りのプランの番号で指定してください（他の変更によって番号は変わりません）
+    7. 同じ番号のコマンドに対してreplaceとdeleteを複数指定しないでください
+    8. JSON形式でのみ回答してください!!
+    9. ハルシネーションを行わないようにしてください
+
+情報:
+    ロボットが知っている情報：
+        場所の位置情報: {{location_info}}
+    
+    データーベースから取得した知識：
+{{knowledge}}
+        
+    ロボットが実行可能なコマンド：
+{{command_description}}
+
+    直近のロボットの行動の結果のリスト：
+{{action_history}}
+
+    失敗したコマンド: {{failed_command}}
+
+    残りのプラン（番号: コマンド）：
+{{remaining_commands}}
+
+指示:
+    以下のタスクを完了する為に、残りのプランに対する変更を考えてください
+        タスクの内容: {{task_description}}
+        タスクの詳細: {{task_detail}}
+        考えられるタスクの失敗の原因: {{task_cause}}
+        考えられるタスクの実行の失敗の原因の詳細: {{task_cause_detail}}
+
+変更の種類：
+    insert: indexの番号のコマンドの前にcommandを挿入する（残りのプランの最後に追加する場合はindexに残りのプランの数+1を指定する）
+    replace: indexの番号のコマンドをcommandに置き換える
+    delete: indexの番号のコマンドを削除する（commandは不要）
+
+<回答例>（失敗したコマンドを再度実行し、2番目のコマンドを削除する）
+    {
+        "operations": [
+            {"op": "insert", "index": 1, "command": {"name": "find", "args": {"object": "椅子"}}},
+            {"op": "delete", "index": 2}
+        ]
+    }
+
+必ず結果は必ず"json形式"で生成してください!!
+"""
@@ -0,0 +1,12 @@
+REPAIR_JSON_PROMPT = \
+"""以下は生成AIがJSON形式で出力した回答ですが、形式に誤りがあるため解析できませんでした。
+回答の内容は変えずに、エラー内容を修正した正しいJSONだけを出力してください。
+- 元の回答に含まれていない情報を追加しないでください（必須の項目が欠けている場合のみ、元の回答の内容から適切な値を補ってください）
+- JSON以外の文章やコードブロックの記号(```)は出力しないでください
+
+エラー内容:
+{{error}}
+
+元の回答:
+{{response}}
+"""
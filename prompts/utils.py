@@ -5,6 +5,8 @@ from prompts.prompt_texts.system_prompt import *
 from prompts.prompt_texts.retrieval_doc import *
 from prompts.prompt_texts.result_evaluate import *
 from prompts.prompt_texts.generate_tasks import *
+from prompts.prompt_texts.repair_json import *
+from prompts.prompt_texts.command_patch import *
 
 def get_prompt(
     prompt_name: str,
@@ -33,10 +35,14 @@ def get_prompt(
         prompt = RESULT_EVALUATE_PROMPT
     elif prompt_name == "REGENERATE_COMMANDS_FROM_TASK":
         prompt = regenerate_commands_from_task_prompt
+    elif prompt_name == "REGENERATE_COMMANDS_PATCH":
+        prompt = REGENERATE_COMMANDS_PATCH
     elif prompt_name == "GENERATE_TASKS":
         prompt = GENERATE_TASKS
     elif prompt_name == "REGENERATE_TASKS":
         prompt = REGENERATE_TASKS
+    elif prompt_name == "REPAIR_JSON":
+        prompt = REPAIR_JSON_PROMPT
     else:
         raise ValueError(f"prompt_name {prompt_name} is not supported")
     
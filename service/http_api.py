@@ -0,0 +1,322 @@
+"""
+PlannerServiceをローカルのHTTP APIとWebSocketで操作する（標準ライブラリのみを使用する）
+
+エンドポイント:
+    POST   /jobs            {"instruction": str, "additional_info": str} ジョブを追加する
+                            202: ジョブ, 429: キューが一杯（Retry-Afterヘッダーに再試行までの秒数）
+    GET    /jobs            ジョブの一覧（?status=queued などで絞り込む）
+    GET    /jobs/{id}       ジョブ（?wait=秒 を指定した場合は終了するまで最大その時間待つ）
+    DELETE /jobs/{id}       キューで待機中のジョブを取り消す（409: 実行中または終了済み）
+    GET    /health          サービスの状態
+    GET    /metrics         メトリクス（Prometheusのテキスト形式）
+    GET    /events          WebSocket ログのイベントとジョブの状態の変化を配信する（?job={id} で絞り込む）
+
+WebSocketのメッセージ（JSON）:
+    {"kind": "job", "job": {...}}
+    {"kind": "log", "job_id": id, "event": "begin"|"update"|"end", "type": "trace"|..., "uid": ..., "parent": ..., ...}
+        begin: name, tag, metadata, start_time / update: changes / end: end_time, duration（イベントはcontext）
+クライアントの受信が遅れた場合、クライアントごとのキュー（max_client_queue）の古いメッセージから破棄する
+"""
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import base64
+import hashlib
+import json
+import re
+import select
+import struct
+import threading
+
+from logger.logger import RealTimeHandler, LogEvent, LogEventType, DurationLogRecord
+from service.planner_service import PlannerService, ServiceJob, QueueFullError, JobNotFoundError
+from utils.metrics import default_registry as metrics
+
+import logging
+logger = logging.getLogger("LLMRobotPlanner")
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_MAX_BODY = 1024 * 1024
+
+_WS_CLIENTS = metrics.gauge("service_websocket_clients", "接続中のWebSocketのクライアント数")
+_WS_DROPPED = metrics.counter("service_websocket_dropped_total", "クライアントの受信が遅れた為に破棄したメッセージ数")
+
+
+class _Subscription():
+    """1つのWebSocketのクライアントに送るメッセージのキュー"""
+    def __init__(self, job_id: Optional[str], maxsize: int):
+        self.job_id = job_id
+        self.maxsize = maxsize
+        self.queue: Deque[bytes] = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, message: bytes):
+        with self.cond:
+            if len(self.queue) >= self.maxsize:
+                self.queue.popleft()
+                self.dropped += 1
+                _WS_DROPPED.inc()
+            self.queue.append(message)
+            if len(self.queue) == 1:
+                self.cond.notify()
+
+    def get_all(self, timeout: float) -> List[bytes]:
+        with self.cond:
+            if not self.queue:
+                self.cond.wait(timeout)
+            messages = list(self.queue)
+            self.queue.clear()
+            return messages
+
+
+class EventBroadcaster(RealTimeHandler):
+    """
+    ログのイベントとジョブの状態の変化をWebSocketのクライアントに配信するハンドラー
+
+    イベントはPlannerServiceのワーカーのスレッドで呼び出される為、そのスレッドで実行中のジョブに対応付ける
+    （別のスレッドで開始したレコードは、親のレコードのジョブに対応付ける）
+    クライアントが接続していない場合は何もしない
+    """
+    def __init__(self, service: PlannerService, max_client_queue: int = 1000):
+        self.service = service
+        self.max_client_queue = max_client_queue
+        self._lock = threading.Lock()
+        self._subscriptions: List[_Subscription] = []
+        self._job_by_uid: Dict[str, Optional[str]] = {}  # 終了していないレコードのジョブ
+        service.add_listener(self._on_job)
+
+    def subscribe(self, job_id: Optional[str] = None) -> _Subscription:
+        subscription = _Subscription(job_id, self.max_client_queue)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        _WS_CLIENTS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: _Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+        _WS_CLIENTS.dec()
+
+    def _publish(self, job_id: Optional[str], message: Dict[str, Any]):
+        subscriptions = self._subscriptions
+        data = None
+        for subscription in subscriptions:
+            if subscription.job_id is None or subscription.job_id == job_id:
+                if data is None:
+                    data = json.dumps(message, ensure_ascii=False, default=str).encode("utf-8")
+                subscription.put(data)
+
+    def _on_job(self, job: ServiceJob):
+        if self._subscriptions:
+            self._publish(job.id, {"kind": "job", "job": job.to_dict()})
+
+    def handle(self, log: LogEvent):
+        record = log.record
+        # クライアントが接続していない場合もジョブの対応付けは維持する
+        if log.event_type == LogEventType.BEGIN:
+            job_id = self._job_by_uid.get(record.parent) if record.parent is not None else None
+            if job_id is None:
+                job_id = self.service.job_for_thread(threading.get_ident())
+            self._job_by_uid[record.uid] = job_id
+        elif log.event_type == LogEventType.END and isinstance(record, DurationLogRecord):
+            job_id = self._job_by_uid.pop(record.uid, None)
+        else:
+            job_id = self._job_by_uid.get(record.uid if isinstance(record, DurationLogRecord) else record.parent)
+            if job_id is None:
+                job_id = self.service.job_for_thread(threading.get_ident())
+        if not self._subscriptions:
+            return
+
+        message: Dict[str, Any] = {
+            "kind": "log", "job_id": job_id, "event": log.event_type.value, "type": record.type.value,
+            "uid": record.uid, "parent": record.parent,
+        }
+        if log.event_type == LogEventType.BEGIN:
+            message.update(
+                name=record.name, tag=sorted(record.tag), metadata=dict(record.metadata),
+                start_time=record.start_time.timestamp(),
+            )
+        elif log.event_type == LogEventType.UPDATE:
+            message["changes"] = dict(log.changes or {})
+        elif isinstance(record, DurationLogRecord):
+            message.update(
+                end_time=record.end_time.timestamp() if record.end_time is not None else None,
+                duration=record.duration,
+            )
+        else:
+            message.update(
+                name=record.name, tag=sorted(record.tag), metadata=dict(record.metadata),
+                timestamp=record.timestamp, context=getattr(record, "context", ""),
+            )
+        self._publish(job_id, message)
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _read_ws_frame(rfile) -> Tuple[int, bytes]:
+    """クライアントからのフレームを読み込む（opcode, payload）、接続が閉じられた場合はopcode=0x8"""
+    header = rfile.read(2)
+    if len(header) < 2:
+        return 0x8, b""
+    opcode = header[0] & 0x0F
+    masked = header[1] & 0x80
+    length = header[1] & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", rfile.read(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", rfile.read(8))
+    mask = rfile.read(4) if masked else b""
+    payload = rfile.read(length)
+    if masked:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: 'PlannerHTTPServer'
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("service: " + format % args)
+
+    def _send_json(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _route(self) -> Tuple[str, Optional[str], Dict[str, List[str]]]:
+        url = urlparse(self.path)
+        match = re.fullmatch(r"/jobs/([^/]+)", url.path)
+        if match:
+            return "/jobs/{id}", match.group(1), parse_qs(url.query)
+        return url.path.rstrip("/") or "/", None, parse_qs(url.query)
+
+    def do_POST(self):
+        path, _, _ = self._route()
+        if path != "/jobs":
+            return self._error(404, "not found")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > _MAX_BODY:
+            return self._error(413, "request body is too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            instruction = body["instruction"]
+            additional_info = body.get("additional_info", "")
+            if not isinstance(instruction, str) or not instruction or not isinstance(additional_info, str):
+                raise ValueError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self._error(400, 'body must be {"instruction": str, "additional_info": str}')
+        try:
+            job = self.server.service.submit(instruction, additional_info)
+        except QueueFullError as e:
+            return self._error(429, str(e), {"Retry-After": str(int(e.retry_after + 0.5))})
+        except RuntimeError as e:
+            return self._error(503, str(e))
+        self._send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        path, job_id, query = self._route()
+        service = self.server.service
+        if path == "/jobs":
+            status = query.get("status", [None])[0]
+            return self._send_json(200, [job.to_dict() for job in service.list(status)])  # type: ignore
+        if path == "/jobs/{id}":
+            try:
+                wait = float(query["wait"][0]) if "wait" in query else None
+                job = service.wait(job_id, wait) if wait is not None else service.get(job_id)
+            except JobNotFoundError:
+                return self._error(404, f"job {job_id} not found")
+            except ValueError:
+                return self._error(400, "wait must be a number")
+            return self._send_json(200, job.to_dict())
+        if path == "/health":
+            return self._send_json(200, {"status": "ok", **service.stats()})
+        if path == "/metrics":
+            data = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if path == "/events":
+            return self._websocket(query.get("job", [None])[0])
+        self._error(404, "not found")
+
+    def do_DELETE(self):
+        path, job_id, _ = self._route()
+        if path != "/jobs/{id}":
+            return self._error(404, "not found")
+        try:
+            canceled = self.server.service.cancel(job_id)
+        except JobNotFoundError:
+            return self._error(404, f"job {job_id} not found")
+        if not canceled:
+            return self._error(409, f"job {job_id} is not queued")
+        self._send_json(200, self.server.service.get(job_id).to_dict())
+
+    def _websocket(self, job_id: Optional[str]):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            return self._error(400, "websocket upgrade required")
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+
+        broadcaster = self.server.broadcaster
+        subscription = broadcaster.subscribe(job_id)
+        try:
+            while not self.server.closing:
+                for message in subscription.get_all(timeout=1.0):
+                    self.wfile.write(_ws_frame(message))
+                self.wfile.flush()
+                # クライアントからのフレーム（close, ping）を確認する
+                readable, _, _ = select.select([self.connection], [], [], 0)
+                if readable:
+                    opcode, payload = _read_ws_frame(self.rfile)
+                    if opcode == 0x8:
+                        self.wfile.write(_ws_frame(payload[:2], opcode=0x8))
+                        break
+                    if opcode == 0x9:
+                        self.wfile.write(_ws_frame(payload, opcode=0xA))
+        except (ConnectionError, OSError):
+            pass  # クライアントが切断した
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+
+class PlannerHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service: PlannerService, host: str = "127.0.0.1", port: int = 8765, max_client_queue: int = 1000):
+        super().__init__((host, port), _RequestHandler)
+        self.service = service
+        self.broadcaster = EventBroadcaster(service, max_client_queue=max_client_queue)
+        self.closing = False
+
+    def shutdown(self):
+        self.closing = True
+        super().shutdown()
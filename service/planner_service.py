@@ -0,0 +1,288 @@
+"""
+LLMRobotPlannerを常駐させ、キューに追加された指示を順に処理するサービス
+
+開始時にLLMRobotPlannerを1つ生成して初期化し、キューのジョブを実行中のジョブがworkers個未満になるようにJobManagerに渡して実行する
+（ジョブの実行とその計測はJobManagerが行い、このサービスはキュー、受け付けの制限、ジョブの状態の通知のみを行う）
+キューが一杯の場合、submitはQueueFullErrorを送出する（HTTP APIでは429 Too Many Requestsを返す）
+
+Example:
+    service = PlannerService(planner_factory, workers=2, max_queue=100)
+    service.start()
+    job = service.submit("キッチンに移動して", "")
+    service.wait(job.id)
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Deque, Dict, List, Literal, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import itertools
+import threading
+import time
+
+from planner.job_manager import JobManager, JobSpec, JobResult
+from planner.llm_robot_planner import LLMRobotPlanner
+from utils.metrics import default_registry as metrics
+
+import logging
+logger = logging.getLogger("LLMRobotPlanner")
+
+JobStatus = Literal["queued", "running", "succeeded", "failed", "canceled"]
+
+# 実行中のジョブ数と実行時間はJobManagerが記録する（planner_jobs_running, planner_job_duration_seconds）
+_QUEUE_LENGTH = metrics.gauge("service_queue_length", "キューで待機しているジョブ数")
+_JOBS = metrics.counter("service_jobs_total", "終了したジョブ数（status: succeeded, failed, canceled）", ("status",))
+_REJECTED = metrics.counter("service_rejected_total", "キューが一杯の為に受け付けなかったジョブ数")
+_QUEUE_WAIT_SECONDS = metrics.histogram("service_queue_wait_seconds", "ジョブがキューで待機した時間")
+
+
+class QueueFullError(Exception):
+    """キューが一杯の為にジョブを受け付けられない"""
+    def __init__(self, max_queue: int, retry_after: float):
+        super().__init__(f"job queue is full (max_queue={max_queue})")
+        self.retry_after = retry_after
+
+
+class JobNotFoundError(KeyError):
+    pass
+
+
+@dataclass
+class ServiceJob():
+    """サービスが受け付けたジョブ（時刻はUNIX時間[s]）"""
+    id: str
+    instruction: str
+    additional_info: str = ""
+    status: JobStatus = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    worker: Optional[str] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "canceled")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class PlannerService():
+    """
+    Args:
+        planner_factory: Callable[[], LLMRobotPlanner] fork元のLLMRobotPlannerを生成する関数（start()で1回だけ呼び出す）
+        workers: int ワーカー（同時に処理するジョブ）の数
+        max_queue: int キューで待機できるジョブの最大数
+        max_finished: int 保持する終了したジョブの最大数（古いものから破棄する）
+        initialize: bool 開始時にLLMRobotPlanner.initialize()を呼び出すか
+    """
+    def __init__(
+        self,
+        planner_factory: Callable[[], LLMRobotPlanner],
+        workers: int = 1,
+        max_queue: int = 100,
+        max_finished: int = 1000,
+        initialize: bool = True,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be 1 or more")
+        self.planner_factory = planner_factory
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.initialize = initialize
+
+        self._cond = threading.Condition()
+        self._queue: Deque[ServiceJob] = deque()
+        self._jobs: "OrderedDict[str, ServiceJob]" = OrderedDict()
+        self._finished: Deque[str] = deque()
+        self._ids = itertools.count(1)
+        self._planner: Optional[LLMRobotPlanner] = None
+        self._manager: Optional[JobManager] = None
+        self._dispatched: Dict[str, ServiceJob] = {}  # JobManagerに渡して終了していないジョブ
+        self._listeners: List[Callable[[ServiceJob], None]] = []
+        self._stopping = False
+        self._job_seconds_ema: Optional[float] = None  # Retry-Afterの見積もりに使用する
+
+    def start(self):
+        with self._cond:
+            if self._manager is not None:
+                return
+            self._stopping = False
+        if self._planner is None:
+            self._planner = self.planner_factory()
+            if self.initialize:
+                self._planner.initialize()
+        with self._cond:
+            self._manager = JobManager(self._planner, max_workers=self.workers, on_start=self._on_job_start)
+        self._dispatch()
+
+    def stop(self, timeout: Optional[float] = None):
+        """新しいジョブの受け付けを停止し、キューのジョブを取り消して、実行中のジョブの終了を待つ"""
+        with self._cond:
+            self._stopping = True
+            canceled = list(self._queue)
+            self._queue.clear()
+            _QUEUE_LENGTH.set(0)
+            manager, self._manager = self._manager, None
+        for job in canceled:
+            self._finish(job, "canceled", "service stopped")
+        if manager is None:
+            return
+        manager.shutdown(wait=False)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._dispatched:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def add_listener(self, listener: Callable[[ServiceJob], None]):
+        """ジョブの状態が変化した時に呼び出す関数を登録する（状態を変更したスレッドで呼び出す）"""
+        self._listeners.append(listener)
+
+    def submit(self, instruction: str, additional_info: str = "") -> ServiceJob:
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("service is stopped")
+            if len(self._queue) >= self.max_queue:
+                _REJECTED.inc()
+                raise QueueFullError(self.max_queue, self._retry_after())
+            job = ServiceJob(id=f"job-{next(self._ids)}", instruction=instruction, additional_info=additional_info)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            _QUEUE_LENGTH.set(len(self._queue))
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def _retry_after(self) -> float:
+        """キューの先頭のジョブが実行を開始するまでの見積もりの時間[s]"""
+        per_job = self._job_seconds_ema if self._job_seconds_ema is not None else 1.0
+        return max(1.0, per_job / self.workers)
+
+    def get(self, job_id: str) -> ServiceJob:
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    def list(self, status: Optional[JobStatus] = None) -> List[ServiceJob]:
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if status is None or job.status == status]
+
+    def cancel(self, job_id: str) -> bool:
+        """キューで待機中のジョブを取り消す（実行中または終了したジョブの場合はFalse）"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobNotFoundError(job_id)
+            if job.status != "queued" or job.id in self._dispatched:
+                return False
+            self._queue.remove(job)
+            _QUEUE_LENGTH.set(len(self._queue))
+        self._finish(job, "canceled")
+        return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> ServiceJob:
+        """ジョブの終了を待つ"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    raise JobNotFoundError(job_id)
+                if job.is_finished:
+                    return job
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._cond.wait(remaining)
+
+    def job_for_thread(self, thread_id: int) -> Optional[str]:
+        """スレッドで実行中のジョブのID（ログのイベントをジョブに対応付ける為に使用する）"""
+        manager = self._manager
+        spec = manager.job_for_thread(thread_id) if manager is not None else None
+        return spec.job_id if spec is not None else None
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "workers": self.workers,
+                "queue_length": len(self._queue),
+                "max_queue": self.max_queue,
+                "running": sum(1 for job in self._dispatched.values() if job.status == "running"),
+                "jobs": counts,
+            }
+
+    def _dispatch(self):
+        """実行中のジョブがworkers個未満の間、キューの先頭のジョブをJobManagerに渡す（JobManagerの中では待機させない）"""
+        submitted = []
+        with self._cond:
+            while self._queue and self._manager is not None and not self._stopping and len(self._dispatched) < self.workers:
+                job = self._queue.popleft()
+                self._dispatched[job.id] = job
+                spec = JobSpec(job.instruction, job.additional_info, job_id=job.id)
+                submitted.append((job, self._manager.submit_spec(spec)))
+            _QUEUE_LENGTH.set(len(self._queue))
+        # 既に終了している場合はadd_done_callbackがこのスレッドで呼び出す為、ロックの外で登録する
+        for job, future in submitted:
+            future.add_done_callback(lambda f, job=job: self._on_job_done(job, f))
+
+    def _on_job_start(self, spec: JobSpec):
+        """JobManagerのジョブを実行するスレッドで呼び出される"""
+        with self._cond:
+            job = self._dispatched[spec.job_id]  # type: ignore
+            job.status = "running"
+            job.started_at = time.time()
+            job.worker = threading.current_thread().name
+        _QUEUE_WAIT_SECONDS.observe(job.started_at - job.submitted_at)
+        self._notify(job)
+
+    def _on_job_done(self, job: ServiceJob, future: "Future[JobResult]"):
+        error: Optional[BaseException]
+        if future.cancelled():
+            status, message = "canceled", "service stopped"
+        else:
+            # processの例外はJobResult.errorに記録される（fork()などの例外のみFutureから送出される）
+            error = future.exception()
+            if error is None:
+                error = future.result().error
+            if error is None:
+                status, message = "succeeded", None
+            else:
+                status, message = "failed", f"{type(error).__name__}: {error}"
+        self._finish(job, status, message)
+        with self._cond:
+            self._dispatched.pop(job.id, None)
+            self._cond.notify_all()
+        self._dispatch()
+
+    def _finish(self, job: ServiceJob, status: JobStatus, error: Optional[str] = None):
+        with self._cond:
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+            if job.started_at is not None:
+                duration = job.finished_at - job.started_at
+                ema = self._job_seconds_ema
+                self._job_seconds_ema = duration if ema is None else ema * 0.8 + duration * 0.2
+            self._finished.append(job.id)
+            while len(self._finished) > self.max_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+            self._cond.notify_all()
+        _JOBS.inc(status=status)
+        self._notify(job)
+
+    def _notify(self, job: ServiceJob):
+        for listener in list(self._listeners):
+            try:
+                listener(job)
+            except Exception:
+                logger.exception("service job listener failed")
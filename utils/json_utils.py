@@ -1,142 +1,217 @@
-from typing import Any, Dict, Union, Optional
+from typing import Any, Dict, Iterator, List, Union, Optional
 
 import re
 import json
 
-def extract_char_position(error_message: str) -> int:
-    """Extract the character position from the JSONDecodeError message.
 
-    Args:
-        error_message (str): The error message from the JSONDecodeError
-          exception.
-
-    Returns:
-        int: The character position.
+class LenientJSONDecodeError(ValueError):
+    """寛容なJSONパーサーでも解析できなかった場合のエラー"""
+    def __init__(self, msg: str, doc: str, pos: int):
+        self.msg = msg
+        self.doc = doc
+        self.pos = pos
+        super().__init__(f"{msg}: (char {pos})")
+
+
+# 文字列内で特別な処理が必要な文字（引用符、バックスラッシュ）までを一度に読み進める為の正規表現
+_DOUBLE_QUOTED_CHUNK = re.compile(r'[^"\\]*')
+_SINGLE_QUOTED_CHUNK = re.compile(r"[^'\\]*")
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?')
+# 引用符で囲まれていないプロパティ名 (例: {name: "move"})
+_BARE_KEY = re.compile(r'[^\s:,{}\[\]"\']+')
+_WHITESPACE = re.compile(r'\s*')
+_START = re.compile(r'[{\[]')
+_VALID_ESCAPES = {
+    '"': '"', "'": "'", '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+_LITERALS = (
+    ("true", True), ("false", False), ("null", None),
+    ("True", True), ("False", False), ("None", None),
+)
+
+
+class LenientJsonParser():
     """
-    import re
-
-    char_pattern = re.compile(r'\(char (\d+)\)')
-    if match := char_pattern.search(error_message):
-        return int(match[1])
-    else:
-        raise ValueError("Character position not found in the error message.")
-
-
-def add_quotes_to_property_names(json_string: str) -> str:
+    生成AIが出力した壊れたJSONを1回の走査で解析するパーサー
+
+    json.loadsの再試行を繰り返さずに、以下の典型的な誤りを走査中にまとめて修正する
+        - コードフェンス(```json ... ```)やJSON前後の説明文
+        - 末尾のカンマ ({"a": 1,} / [1, 2,])
+        - 引用符で囲まれていない、もしくはシングルクォートで囲まれたプロパティ名
+        - 不正なエスケープシーケンス (\\x 等はバックスラッシュを取り除く)
+        - 文字列内の改行やタブなどの制御文字
+        - 途中で途切れた出力（閉じられていない文字列、括弧を補完する）
     """
-    Add quotes to property names in a JSON string.
-
-    Args:
-        json_string (str): The JSON string.
-
-    Returns:
-        str: The JSON string with quotes added to property names.
+    def __init__(self, text: str):
+        self._text = text
+        self._pos = 0
+        self._end = len(text)
+
+    def parse(self) -> Union[Dict[str, Any], List[Any]]:
+        error: Optional[LenientJSONDecodeError] = None
+        for start in self._candidate_starts():
+            self._pos = start
+            try:
+                return self._parse_value()
+            except LenientJSONDecodeError as e:
+                # 説明文の括弧（例: "Here [note]: {...}"）から解析した場合は、次の'{'または'['から解析し直す
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        raise LenientJSONDecodeError("JSON object or array not found", self._text, 0)
+
+    def _candidate_starts(self) -> Iterator[int]:
+        """'{'または'['の位置を先頭から順に返す（コードフェンスがある場合はその後から、無ければ全体から探す）"""
+        fence = self._text.find("```")
+        base = fence + 3 if fence >= 0 else 0
+        found = False
+        for m in _START.finditer(self._text, base):
+            found = True
+            yield m.start()
+        if not found and base:
+            for m in _START.finditer(self._text, 0, base):
+                yield m.start()
+
+    def _skip_ws(self) -> None:
+        self._pos = _WHITESPACE.match(self._text, self._pos).end()  # type: ignore
+
+    def _peek(self) -> str:
+        return self._text[self._pos] if self._pos < self._end else ""
+
+    def _parse_value(self) -> Any:
+        self._skip_ws()
+        c = self._peek()
+        if c == "{":
+            return self._parse_object()
+        if c == "[":
+            return self._parse_array()
+        if c == '"' or c == "'":
+            return self._parse_string(c)
+        if c == "":
+            # 値の途中で出力が途切れている
+            return None
+        m = _NUMBER.match(self._text, self._pos)
+        if m:
+            self._pos = m.end()
+            s = m.group()
+            return float(s) if ("." in s or "e" in s or "E" in s) else int(s)
+        for literal, value in _LITERALS:
+            if self._text.startswith(literal, self._pos):
+                self._pos += len(literal)
+                return value
+        raise LenientJSONDecodeError(f"Unexpected character {c!r}", self._text, self._pos)
+
+    def _parse_object(self) -> Dict[str, Any]:
+        obj: Dict[str, Any] = {}
+        self._pos += 1  # '{'
+        while True:
+            self._skip_ws()
+            c = self._peek()
+            if c == "}":
+                self._pos += 1
+                return obj
+            if c == "":
+                # 閉じ括弧が欠けている
+                return obj
+            if c == ",":
+                # 末尾や連続したカンマは無視する
+                self._pos += 1
+                continue
+            is_bare_key = not (c == '"' or c == "'")
+            if not is_bare_key:
+                key = self._parse_string(c)
+            else:
+                m = _BARE_KEY.match(self._text, self._pos)
+                if m is None:
+                    raise LenientJSONDecodeError("Expecting property name", self._text, self._pos)
+                key = m.group()
+                self._pos = m.end()
+            self._skip_ws()
+            if self._peek() == ":":
+                self._pos += 1
+            elif self._peek() == "":
+                return obj
+            elif is_bare_key:
+                # "etc..." のようなプロパティではない語句は読み飛ばす
+                continue
+            else:
+                raise LenientJSONDecodeError("Expecting ':' delimiter", self._text, self._pos)
+            self._skip_ws()
+            if self._pos >= self._end:
+                return obj
+            obj[key] = self._parse_value()
+
+    def _parse_array(self) -> List[Any]:
+        arr: List[Any] = []
+        self._pos += 1  # '['
+        while True:
+            self._skip_ws()
+            c = self._peek()
+            if c == "]":
+                self._pos += 1
+                return arr
+            if c == "":
+                return arr
+            if c == ",":
+                self._pos += 1
+                continue
+            arr.append(self._parse_value())
+
+    def _parse_string(self, quote: str) -> str:
+        chunk = _DOUBLE_QUOTED_CHUNK if quote == '"' else _SINGLE_QUOTED_CHUNK
+        text = self._text
+        self._pos += 1  # 開始の引用符
+        parts: List[str] = []
+        while True:
+            m = chunk.match(text, self._pos)
+            parts.append(m.group())  # type: ignore
+            self._pos = m.end()  # type: ignore
+            if self._pos >= self._end:
+                # 閉じられていない文字列
+                return "".join(parts)
+            c = text[self._pos]
+            if c == quote:
+                self._pos += 1
+                return "".join(parts)
+            # バックスラッシュ
+            esc = text[self._pos + 1] if self._pos + 1 < self._end else ""
+            if esc in _VALID_ESCAPES:
+                parts.append(_VALID_ESCAPES[esc])
+                self._pos += 2
+            elif esc == "u" and self._pos + 6 <= self._end:
+                try:
+                    parts.append(chr(int(text[self._pos + 2:self._pos + 6], 16)))
+                    self._pos += 6
+                except ValueError:
+                    # 不正な\uエスケープはバックスラッシュを取り除く
+                    self._pos += 1
+            else:
+                # 不正なエスケープはバックスラッシュを取り除く
+                self._pos += 1
+
+
+def lenient_json_loads(text: str) -> Union[Dict[str, Any], List[Any]]:
     """
+    生成AIの出力したJSON文字列を解析する
 
-    def replace_func(match):
-        return f'"{match.group(1)}":'
-
-    property_name_pattern = re.compile(r'(\w+):')
-    corrected_json_string = property_name_pattern.sub(
-        replace_func,
-        json_string)
-
-    try:
-        json.loads(corrected_json_string)
-        return corrected_json_string
-    except json.JSONDecodeError as e:
-        raise e
-
-
-def balance_braces(json_string: str) -> Optional[str]:
-    """
-    Balance the braces in a JSON string.
+    正しいJSONであればjson.loads（C実装）で解析し、失敗した場合のみLenientJsonParserで1回だけ走査する
 
     Args:
-        json_string (str): The JSON string.
+        text (str): JSON文字列
 
     Returns:
-        str: The JSON string with braces balanced.
-    """
-
-    open_braces_count = json_string.count('{')
-    close_braces_count = json_string.count('}')
-
-    while open_braces_count > close_braces_count:
-        json_string += '}'
-        close_braces_count += 1
-
-    while close_braces_count > open_braces_count:
-        json_string = json_string.rstrip('}')
-        close_braces_count -= 1
-
-    try:
-        json.loads(json_string)
-        return json_string
-    except json.JSONDecodeError as e:
-        pass
-
-
-def fix_invalid_escape(json_str: str, error_message: str) -> str:
-    while error_message.startswith('Invalid \\escape'):
-        bad_escape_location = extract_char_position(error_message)
-        json_str = json_str[:bad_escape_location] + \
-            json_str[bad_escape_location + 1:]
-        try:
-            json.loads(json_str)
-            return json_str
-        except json.JSONDecodeError as e:
-            error_message = str(e)
-    return json_str
-
-
-
-def correct_json(json_str: str) -> str:
+        dict | list: 解析結果
     """
-    Correct common JSON errors.
-
-    Args:
-        json_str (str): The JSON string.
-    """
-
     try:
-        json.loads(json_str)
-        return json_str
-    except json.JSONDecodeError as e:
-        error_message = str(e)
-        if error_message.startswith('Invalid \\escape'):
-            json_str = fix_invalid_escape(json_str, error_message)
-        if error_message.startswith('Expecting property name enclosed in double quotes'):
-            json_str = add_quotes_to_property_names(json_str)
-            try:
-                json.loads(json_str)
-                return json_str
-            except json.JSONDecodeError as e:
-                error_message = str(e)
-        if balanced_str := balance_braces(json_str):
-            return balanced_str
-    return json_str
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return LenientJsonParser(text).parse()
 
 
 def fix_and_parse_json(
     json_str: str,
 ) -> Union[str, Dict[Any, Any]]:
     """JSON文字列を修正して解析する"""
-    try:
-        json_str = json_str.replace('\t', '')
-        return json.loads(json_str)
-    except json.JSONDecodeError as _:  # エラーが発生した場合
-        try:
-            json_str = correct_json(json_str)
-            return json.loads(json_str)
-        except json.JSONDecodeError as _:  # エラーが再発した場合
-            pass
-
-    try:
-        brace_index = json_str.index("{")
-        json_str = json_str[brace_index:]
-        last_brace_index = json_str.rindex("}")
-        json_str = json_str[:last_brace_index+1]
-        return json.loads(json_str)
-    except (json.JSONDecodeError, ValueError) as e:  
-        raise e
+    return lenient_json_loads(json_str)  # type: ignore
@@ -0,0 +1,439 @@
+"""
+カウンター、ゲージ、ヒストグラムを保持する軽量なメトリクスの仕組み
+
+各モジュールはdefault_registryからメトリクスを取得して値を記録し、
+Prometheusのテキスト形式でファイルまたはHTTPで出力する
+
+Example:
+    from utils.metrics import default_registry as metrics
+
+    LLM_SECONDS = metrics.histogram("llm_request_duration_seconds", "LLMへのリクエストの所要時間", ("backend", "outcome"))
+    LLM_SECONDS.observe(0.8, backend="gemini", outcome="success")
+    with LLM_SECONDS.time(backend="gemini", outcome="success"):
+        ...
+
+    metrics.write_textfile("metrics.prom")  # node_exporterのtextfile collectorなどで読み込む
+    server = metrics.serve(port=9464)  # http://127.0.0.1:9464/metrics
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import os
+import threading
+import time
+
+LabelValues = Tuple[str, ...]
+
+
+class HdrHistogram():
+    """
+    HDR Histogramと同じ考え方の対数線形のバケットで値の分布を記録するヒストグラム
+
+    値を仮数と指数に分け、仮数を10**significant_figures個のバケットに分割する為、
+    値の大きさに関わらず相対誤差が10**-significant_figures程度に収まる
+    メモリ使用量は値の桁の範囲に比例し、記録した値の数には依存しない
+    0以下の値は分位点の計算では0として扱う
+
+    Args:
+        significant_figures: int 有効桁数（1〜4）
+    """
+    def __init__(self, significant_figures: int = 2):
+        if not 1 <= significant_figures <= 4:
+            raise ValueError("significant_figures must be between 1 and 4")
+        self._sub_buckets = 10 ** significant_figures
+        self._buckets: Dict[int, int] = {}
+        self._zero = 0  # 0以下の値の数
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        sub = min(self._sub_buckets - 1, int((mantissa - 0.5) * 2 * self._sub_buckets))
+        return exponent * self._sub_buckets + sub
+
+    def _value(self, index: int) -> float:
+        """バケットの中央の値"""
+        exponent, sub = divmod(index, self._sub_buckets)
+        return math.ldexp(0.5 + (sub + 0.5) * 0.5 / self._sub_buckets, exponent)
+
+    def record(self, value: float, count: int = 1):
+        if value > 0:
+            index = self._index(value)
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        else:
+            self._zero += count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """q（0〜1）分位点の値（記録した値が無い場合はNone）"""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = self._zero
+        if seen >= rank:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def merge(self, other: 'HdrHistogram'):
+        """他のヒストグラムの値を加える（有効桁数が同じである必要がある）"""
+        if other._sub_buckets != self._sub_buckets:
+            raise ValueError("cannot merge histograms with different significant figures")
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self._zero += other._zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def diff(self, previous: 'HdrHistogram') -> 'HdrHistogram':
+        """
+        previous（このヒストグラムの過去の複製）の後に記録した値のヒストグラム
+
+        min, maxは区間ごとに復元できない為、このヒストグラムの値を使用する
+        """
+        if previous._sub_buckets != self._sub_buckets:
+            raise ValueError("cannot diff histograms with different significant figures")
+        result = HdrHistogram.__new__(HdrHistogram)
+        result._sub_buckets = self._sub_buckets
+        result._buckets = {}
+        for index, count in self._buckets.items():
+            count -= previous._buckets.get(index, 0)
+            if count > 0:
+                result._buckets[index] = count
+        result._zero = self._zero - previous._zero
+        result.count = self.count - previous.count
+        result.sum = self.sum - previous.sum
+        result.min = self.min
+        result.max = self.max
+        return result
+
+    def to_dict(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> dict:
+        d = {"count": self.count, "sum": self.sum, "mean": self.mean}
+        d.update({f"p{round(q * 100, 1):g}": self.quantile(q) for q in quantiles})
+        return d
+
+
+class Metric():
+    """
+    ラベルの組ごとに値を保持するメトリクスの基底クラス
+
+    Args:
+        name: str メトリクス名（Prometheusの命名規則に従う）
+        documentation: str 説明（# HELPとして出力する）
+        labelnames: Tuple[str, ...] ラベル名
+    """
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"metric '{self.name}' expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _matcher(self, labels: Dict[str, object]) -> Callable[[LabelValues], bool]:
+        """labels（一部のラベルのみでよい）に一致するラベルの組を判定する関数"""
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"metric '{self.name}' has no labels {tuple(unknown)}")
+        positions = [(self.labelnames.index(n), str(v)) for n, v in labels.items()]
+        return lambda key: all(key[i] == v for i, v in positions)
+
+    def _matching(self, labels: Dict[str, object]) -> List[object]:
+        """
+        labels（一部のラベルのみでよい）に一致する全てのラベルの組の値
+        値はロックの外で変更される為、イミュータブルな値（数値）にのみ使用する
+        """
+        matches = self._matcher(labels)
+        with self._lock:
+            return [value for key, value in self._values.items() if matches(key)]
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """(サンプル名, ラベル, 値)を返す"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """増加のみする値（リクエスト数など）"""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount  # type: ignore
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)  # type: ignore
+
+    def total(self, **labels) -> float:
+        """labelsに一致する全てのラベルの組の合計"""
+        return sum(self._matching(labels))  # type: ignore
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    """増減する値（実行中のリクエスト数など）"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount  # type: ignore
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)  # type: ignore
+
+    def total(self, **labels) -> float:
+        """labelsに一致する全てのラベルの組の合計"""
+        return sum(self._matching(labels))  # type: ignore
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(1.0, **labels)
+        try:
+            yield
+        finally:
+            self.dec(1.0, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """
+    値の分布（所要時間など）を記録するメトリクス
+
+    PrometheusにはHDR Histogramのバケットをそのまま出力せず、
+    quantilesの分位点と合計、件数をsummary形式で出力する
+
+    Args:
+        significant_figures: int 有効桁数
+        quantiles: Tuple[float, ...] 出力する分位点
+    """
+    type_name = "summary"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        significant_figures: int = 2,
+        quantiles: Tuple[float, ...] = (0.5, 0.95, 0.99),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.significant_figures = significant_figures
+        self.quantiles = quantiles
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            hist = self._values.get(key)
+            if hist is None:
+                hist = self._values[key] = HdrHistogram(self.significant_figures)
+            hist.record(value)  # type: ignore
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        ブロック（またはデコレートした関数）の所要時間[s]を記録する
+
+        withで受け取ったラベルの辞書を変更すると、記録するラベルを変更できる（失敗した場合のoutcomeなど）
+        """
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> HdrHistogram:
+        """ラベルの組に対応するヒストグラムの複製（記録が無い場合は空のヒストグラム）"""
+        result = HdrHistogram(self.significant_figures)
+        with self._lock:
+            hist = self._values.get(self._key(labels))
+            if hist is not None:
+                result.merge(hist)  # type: ignore
+        return result
+
+    def aggregate(self, **labels) -> HdrHistogram:
+        """labels（一部のラベルのみでよい）に一致する全てのラベルの組のヒストグラムを合計した複製"""
+        result = HdrHistogram(self.significant_figures)
+        matches = self._matcher(labels)
+        # observeが同時にヒストグラムを変更する為、snapshotと同様にロックを保持したまま合計する
+        with self._lock:
+            for key, hist in self._values.items():
+                if matches(key):
+                    result.merge(hist)  # type: ignore
+        return result
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        return self.snapshot(**labels).quantile(q)
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            for key, hist in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for q in self.quantiles:
+                    rows.append((self.name, dict(labels, quantile=f"{q:g}"), hist.quantile(q)))  # type: ignore
+                rows.append((f"{self.name}_sum", labels, hist.sum))  # type: ignore
+                rows.append((f"{self.name}_count", labels, hist.count))  # type: ignore
+        yield from rows
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: Optional[float]) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry():
+    """
+    メトリクスを名前で管理し、Prometheusのテキスト形式で出力するクラス
+
+    同じ名前で取得した場合は登録済みのメトリクスを返す（種類が異なる場合はValueError）
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Iterable[str], **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric '{name}' is already registered as {type(metric).__name__}{metric.labelnames}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        significant_figures: int = 2,
+        quantiles: Tuple[float, ...] = (0.5, 0.95, 0.99),
+    ) -> Histogram:
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames,
+            significant_figures=significant_figures, quantiles=quantiles
+        )  # type: ignore
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def get_all(self) -> List[Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def reset(self):
+        """全てのメトリクスの値を消去する（メトリクスの登録は残す）"""
+        for metric in self.get_all():
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式（version 0.0.4）に変換する"""
+        lines: List[str] = []
+        for metric in sorted(self.get_all(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for sample_name, labels, value in metric.samples():
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{sample_name}{{{label_str}}} {_format_value(value)}" if label_str else f"{sample_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Prometheusのテキスト形式でファイルに出力する（読み込み中のファイルを壊さない為、一時ファイルを置き換える）"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        /metricsでPrometheusのテキスト形式を返すHTTPサーバーを別スレッドで開始する
+
+        Returns:
+            ThreadingHTTPServer: 停止する場合はshutdown()を呼び出す
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+default_registry = MetricsRegistry()
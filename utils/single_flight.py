@@ -0,0 +1,82 @@
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+import threading
+
+T = TypeVar("T")
+
+
+class _Call():
+    """実行中の呼び出し1件分（結果を待っている呼び出し元で共有する）"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters: int = 0
+
+
+class SingleFlight():
+    """
+    同じキーの呼び出しが同時に行われた場合、1回だけ実行して結果（または例外）を全ての呼び出し元に返すクラス
+
+    結果はキャッシュしない。実行が完了した後の呼び出しは再び実行される
+
+    Example:
+        flight = SingleFlight()
+        text = flight.do(("GENERATE_QUERY", prompt), lambda: llm.generate_content(prompt))
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed: int = 0  # 実際に実行した回数
+        self.coalesced: int = 0  # 実行中の呼び出しの結果を共有した回数
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        keyが同じ呼び出しが実行中であればその完了を待って結果を返し、そうでなければfnを実行する
+
+        Args:
+            key: Hashable 呼び出しを識別するキー
+            fn: Callable[[], T] 実行する関数
+
+        Raises:
+            fnが送出した例外（実行中の呼び出しを待っていた場合も同じ例外を送出する）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """実行中の呼び出しの数"""
+        with self._lock:
+            return len(self._calls)
+
+    def to_dict(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": self.in_flight(),
+        }